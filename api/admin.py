@@ -4,6 +4,7 @@ from .models import (
     Category,
     NewsLetter,
     Order,
+    CustomerOrder,
     Image,
     Product,
     ShippingAddress,
@@ -18,6 +19,7 @@ admin.site.register(Product)
 admin.site.register(Category)
 admin.site.register(NewsLetter)
 admin.site.register(Order)
+admin.site.register(CustomerOrder)
 admin.site.register(Image)
 admin.site.register(ShippingAddress)
 admin.site.register(Condition)
@@ -0,0 +1,173 @@
+from functools import wraps
+
+from asgiref.sync import sync_to_async
+from django.http import Http404, HttpResponse
+from rest_framework import status
+from rest_framework.exceptions import APIException
+from rest_framework.request import Request
+from rest_framework.response import Response
+
+from . import views
+from .cache import acached_response
+from .cart import acart_products, parse_cart, price_cart
+from .conditional import not_modified, set_validators
+from .errors import api_exception_handler
+from .facets import category_facet_names, facet_counts, filter_by_properties, property_filters
+from .fingerprints import acategory_list_validators, aproduct_list_validators, aproduct_validators
+from .models import Category, Product
+from .pagination import KeysetPagination, ProductPagination, SearchPagination
+from .parsers import JSONParser
+from .renderers import JSONRenderer
+from .serializers import CategorySerializer, ProductSerializer, sparse_fields
+
+
+# Native async versions of the hot catalog views, for ASGI deployments
+# (API_ASYNC_VIEWS). They only answer JSON; anything else (other methods,
+# the browsable API) is handed over to the sync DRF view in api/views.py.
+
+
+def wants_json(request):
+    file_format = request.GET.get('format')
+    if file_format:
+        return file_format == 'json'
+    return 'text/html' not in request.headers.get('Accept', '')
+
+
+def render(response):
+    if not isinstance(response, Response):
+        return response
+    rendered = HttpResponse(
+        JSONRenderer().render(response.data),
+        status=response.status_code,
+        content_type=JSONRenderer.media_type,
+    )
+    for name, value in response.items():
+        if name.lower() != 'content-type':
+            rendered.headers[name] = value
+    return rendered
+
+
+def async_api_view(methods, sync_view):
+    def decorator(handler):
+        async def view(request, *args, **kwargs):
+            if request.method not in methods or not wants_json(request):
+                return await sync_to_async(sync_view)(request, *args, **kwargs)
+
+            request = Request(request, parsers=[JSONParser()])
+            request.accepted_renderer = JSONRenderer()
+            request.accepted_media_type = JSONRenderer.media_type
+            try:
+                response = await handler(request, *args, **kwargs)
+            except (APIException, Http404) as exc:
+                response = api_exception_handler(exc, {'request': request})
+            return render(response)
+
+        # Like DRF views: clients authenticate with tokens, not cookies
+        view.csrf_exempt = True
+        return wraps(handler)(view)
+    return decorator
+
+
+async def list_products(request):
+    searched_term = request.query_params.get('search')
+    category_id = views.requested_category(request)
+
+    filters = property_filters(request.query_params)
+    products = views.product_queryset(request)
+    unfiltered_products = products
+    products = filter_by_properties(products, filters)
+
+    if searched_term is not None:
+        paginator = SearchPagination(searched_term)
+    else:
+        paginator = ProductPagination()
+    page = await paginator.apaginate_queryset(products, request)
+    serializer = ProductSerializer(page, many=True, context={
+        'fields': sparse_fields(request.query_params, ProductSerializer),
+    })
+    response = paginator.get_paginated_response(serializer.data)
+
+    if 'facets' in views.requested_includes(request) and searched_term is None:
+        names = None
+        if category_id is not None:
+            names = await sync_to_async(category_facet_names)(category_id)
+        response.data['facets'] = await sync_to_async(facet_counts)(
+            unfiltered_products, filters, names
+        )
+    return response
+
+
+@async_api_view(['GET'], views.product_list)
+async def product_list(request):
+    return await acached_response(
+        request, ['product-list'],
+        lambda: list_products(request),
+        lambda: aproduct_list_validators(request, views.product_queryset(request)),
+    )
+
+
+async def show_product(request, id):
+    fields = sparse_fields(request.query_params, ProductSerializer)
+    try:
+        product = await Product.objects.for_api(fields).aget(id=id)
+    except Product.DoesNotExist:
+        raise Http404
+    serializer = ProductSerializer(product, many=False, context={'fields': fields})
+    return Response(serializer.data, status=status.HTTP_200_OK)
+
+
+@async_api_view(['GET'], views.product_details)
+async def product_details(request, id):
+    return await acached_response(
+        request, [f'product:{id}', 'catalog-meta'],
+        lambda: show_product(request, id),
+        lambda: aproduct_validators(request, id),
+    )
+
+
+async def list_categories(request, with_products):
+    fields = sparse_fields(request.query_params, CategorySerializer)
+    categories = Category.objects.for_api(fields, with_products)
+    paginator = KeysetPagination()
+    page = await paginator.apaginate_queryset(categories, request)
+    serializer = CategorySerializer(page, many=True, context={
+        'request': request,
+        'include_products': with_products,
+        'fields': fields,
+    })
+    return paginator.get_paginated_response(serializer.data)
+
+
+@async_api_view(['GET'], views.category_list)
+async def category_list(request):
+    fields = sparse_fields(request.query_params, CategorySerializer)
+    with_products = views.embeds_products(request, fields)
+    etag, last_modified = await acategory_list_validators(request, with_products)
+    response = not_modified(request, etag, last_modified)
+    if response is None:
+        response = render(await list_categories(request, with_products))
+        set_validators(response, etag, last_modified)
+    return response
+
+
+@async_api_view(['POST'], views.get_cart_data)
+async def get_cart_data(request):
+    cart = parse_cart(request.data)
+    products = await acart_products(cart.keys(), request.query_params.get('reservation'))
+    return Response(price_cart(cart, products), status=status.HTTP_200_OK)
+
+
+@async_api_view(['POST'], views.get_saved_data)
+async def get_saved_data(request):
+    saved_data_ids_list = request.data
+
+    if (isinstance(saved_data_ids_list, list)):
+        fields = sparse_fields(request.query_params, ProductSerializer)
+        saved_items_data = Product.objects.for_api(fields).filter(id__in=saved_data_ids_list)
+        # aiterator() can't prefetch the images, a plain async for can
+        products = [product async for product in saved_items_data]
+        serializer = ProductSerializer(products, many=True, context={'fields': fields})
+        return Response(serializer.data, status=status.HTTP_200_OK)
+    return Response({
+        "detail": "invalid datatype. Must be a list or array of product ids"
+    }, status=status.HTTP_400_BAD_REQUEST)
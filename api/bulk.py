@@ -0,0 +1,114 @@
+from django.db import transaction
+from django.db.models import Case, Value, When
+from django.utils import timezone
+
+from .cache import invalidate
+from .models import SEARCH_FIELDS, ImageAlbum, Product, ProductFacet, property_pairs
+from .search import get_search_backend
+from .sqlite import retry_if_locked
+
+
+# Products written per transaction
+BULK_BATCH_SIZE = 500
+
+
+def batches(items, size=BULK_BATCH_SIZE):
+    for start in range(0, len(items), size):
+        yield items[start:start + size]
+
+
+def product_facets(products):
+    return [
+        ProductFacet(product=product, name=name, value=value)
+        for product in products
+        for name, value in property_pairs(product.properties)
+    ]
+
+
+def cache_namespaces(products):
+    namespaces = {'product-list'}
+    for product in products:
+        namespaces.add(f'product:{product.id}')
+        namespaces.add(f'category:{product.category_id}')
+        loaded_category_id = getattr(product, '_loaded_values', {}).get('category_id')
+        if loaded_category_id is not None:
+            namespaces.add(f'category:{loaded_category_id}')
+    return namespaces
+
+
+def bulk_create_products(validated_items):
+    """
+    Inserts products and their albums with bulk_create, one transaction per
+    batch. No per-row signal fires, so the work the post_save receivers do
+    (album, facet index, search index, cache) is done here in bulk instead.
+    """
+    created = []
+    for batch in batches(validated_items):
+        created.extend(create_batch(batch))
+    return created
+
+
+@retry_if_locked
+def create_batch(batch):
+    with transaction.atomic():
+        products = [Product(**data) for data in batch]
+        # bulk_create() skips save()
+        for product in products:
+            product.sync_in_stock()
+        products = Product.objects.bulk_create(products)
+        ImageAlbum.objects.bulk_create([
+            ImageAlbum(product=product, name=product.name) for product in products
+        ])
+        ProductFacet.objects.bulk_create(product_facets(products))
+        get_search_backend().index(products)
+        invalidate(cache_namespaces(products))
+    return products
+
+
+def bulk_update_products(pairs):
+    """
+    Applies validated data to already loaded products with bulk_update, one
+    transaction per batch. `pairs` is a list of (product, validated_data).
+    """
+    updated = []
+    for batch in batches(pairs):
+        now = timezone.now()
+        fields = {'updated_at'}
+        products = []
+        for product, data in batch:
+            for field, value in data.items():
+                setattr(product, field, value)
+            # bulk_update() skips auto_now and save()
+            product.updated_at = now
+            product.sync_in_stock()
+            fields.update(data)
+            products.append(product)
+        if 'quantity_available' in fields:
+            fields.add('product_in_stock')
+
+        update_batch(products, fields)
+        updated.extend(products)
+    return updated
+
+
+def rename_albums(products):
+    # The album mirrors the product name (see save_album), in one UPDATE
+    renamed = [product for product in products if 'name' in product.changed_fields({'name'})]
+    if renamed:
+        ImageAlbum.objects.filter(product__in=renamed).update(name=Case(*[
+            When(product_id=product.id, then=Value(product.name)) for product in renamed
+        ]))
+
+
+@retry_if_locked
+def update_batch(products, fields):
+    with transaction.atomic():
+        Product.objects.bulk_update(products, sorted(fields))
+        if 'name' in fields:
+            rename_albums(products)
+        if 'properties' in fields:
+            ProductFacet.objects.filter(product__in=products).delete()
+            ProductFacet.objects.bulk_create(product_facets(products))
+        if fields & SEARCH_FIELDS:
+            get_search_backend().index(products)
+        invalidate(cache_namespaces(products))
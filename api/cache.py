@@ -0,0 +1,206 @@
+import asyncio
+import hashlib
+import time
+import uuid
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core.cache import caches
+from django.db import transaction
+from django.http import HttpResponse
+from rest_framework.renderers import JSONRenderer
+
+from .conditional import conditional_response, not_modified, set_validators
+from .metrics import record_cache
+
+
+# How long a builder may hold the rebuild lock, and how often waiters poll
+LOCK_TIMEOUT = 10
+LOCK_POLL_INTERVAL = 0.02
+
+
+def get_cache():
+    return caches[settings.API_CACHE_ALIAS]
+
+
+def version_key(namespace):
+    return f'api:version:{namespace}'
+
+
+def get_versions(namespaces):
+    """
+    Returns the current version token of every namespace, creating the
+    missing ones. A response is cached under the versions of all the
+    namespaces it depends on, so bumping one of them orphans the entry.
+    """
+    cache = get_cache()
+    keys = [version_key(namespace) for namespace in namespaces]
+    versions = cache.get_many(keys)
+    for key in keys:
+        if key not in versions:
+            token = uuid.uuid4().hex[:12]
+            # Another process may have created it meanwhile; keep theirs
+            if not cache.add(key, token, timeout=None):
+                token = cache.get(key, token)
+            versions[key] = token
+    return [versions[key] for key in keys]
+
+
+def bump(namespaces):
+    get_cache().set_many({
+        version_key(namespace): uuid.uuid4().hex[:12] for namespace in namespaces
+    }, timeout=None)
+
+
+def invalidate(namespaces, using=None):
+    # Bump right away for this process, and again once the transaction
+    # commits so a reader can't re-cache the pre-commit state meanwhile.
+    namespaces = list(namespaces)
+    if not namespaces:
+        return
+    bump(namespaces)
+    transaction.on_commit(lambda: bump(namespaces), using=using)
+
+
+def response_key(request, namespaces):
+    versions = get_versions(namespaces)
+    # Pagination links are absolute, so the host is part of the key
+    url = request.build_absolute_uri()
+    digest = hashlib.sha1(url.encode('utf-8')).hexdigest()
+    return f'api:response:{namespaces[0]}:{"-".join(versions)}:{digest}'
+
+
+def wait_for(cache, key):
+    deadline = time.monotonic() + LOCK_TIMEOUT
+    while time.monotonic() < deadline:
+        time.sleep(LOCK_POLL_INTERVAL)
+        entry = cache.get(key)
+        if entry is not None:
+            return entry
+        if cache.get(f'{key}:lock') is None:
+            return None
+    return None
+
+
+def cached_response(request, namespaces, build, validators=None):
+    """
+    Read-through cache for rendered JSON responses.
+
+    `build` is only called on a miss and must return a DRF Response; only
+    200 responses are stored. Concurrent misses on the same key wait for the
+    first one to finish building instead of all rebuilding it.
+
+    `validators` returns the (ETag, Last-Modified) pair of the response
+    (see api/conditional.py). It is stored alongside the body, so cache hits
+    answer conditional requests without touching the database, and on a miss
+    a 304 is sent before anything is built.
+
+    Nothing is cached unless API_CACHE_ENABLED is set (see the settings).
+    """
+    renderer = request.accepted_renderer
+    # The browsable API and other formats go through the normal path
+    if not settings.API_CACHE_ENABLED or not isinstance(renderer, JSONRenderer):
+        if validators is None:
+            return build()
+        return conditional_response(request, validators, build)
+
+    cache = get_cache()
+    key = response_key(request, namespaces)
+    entry = cache.get(key)
+    record_cache(namespaces, entry is not None)
+    if entry is None:
+        etag, last_modified = validators() if validators else (None, None)
+        response = not_modified(request, etag, last_modified)
+        if response is not None:
+            return response
+
+        lock_key = f'{key}:lock'
+        if cache.add(lock_key, 1, timeout=LOCK_TIMEOUT):
+            try:
+                response = build()
+                if response.status_code != 200:
+                    return response
+                content = renderer.render(
+                    response.data, renderer.media_type, {'request': request}
+                )
+                entry = (content, etag, last_modified)
+                cache.set(key, entry, timeout=settings.API_CACHE_TIMEOUT)
+            finally:
+                cache.delete(lock_key)
+        else:
+            entry = wait_for(cache, key)
+            if entry is None:
+                return build()
+    else:
+        content, etag, last_modified = entry
+        response = not_modified(request, etag, last_modified)
+        if response is not None:
+            return response
+
+    return entry_response(entry, renderer)
+
+
+def entry_response(entry, renderer):
+    content, etag, last_modified = entry
+    response = HttpResponse(content, content_type=renderer.media_type)
+    return set_validators(response, etag, last_modified)
+
+
+async def await_for(cache, key):
+    deadline = time.monotonic() + LOCK_TIMEOUT
+    while time.monotonic() < deadline:
+        await asyncio.sleep(LOCK_POLL_INTERVAL)
+        entry = await cache.aget(key)
+        if entry is not None:
+            return entry
+        if await cache.aget(f'{key}:lock') is None:
+            return None
+    return None
+
+
+async def aconditional_response(request, validators, build):
+    etag, last_modified = await validators() if validators else (None, None)
+    response = not_modified(request, etag, last_modified)
+    if response is None:
+        response = await build()
+        if response.status_code == 200:
+            set_validators(response, etag, last_modified)
+    return response
+
+
+async def acached_response(request, namespaces, build, validators=None):
+    """
+    cached_response() for the async views (see api/async_views.py), which
+    only answer JSON. `build` and `validators` are coroutine functions.
+    """
+    if not settings.API_CACHE_ENABLED:
+        return await aconditional_response(request, validators, build)
+
+    renderer = request.accepted_renderer
+    cache = get_cache()
+    key = await sync_to_async(response_key)(request, namespaces)
+    entry = await cache.aget(key)
+    record_cache(namespaces, entry is not None)
+    if entry is not None:
+        _, etag, last_modified = entry
+        return not_modified(request, etag, last_modified) or entry_response(entry, renderer)
+
+    etag, last_modified = await validators() if validators else (None, None)
+    response = not_modified(request, etag, last_modified)
+    if response is not None:
+        return response
+
+    lock_key = f'{key}:lock'
+    if not await cache.aadd(lock_key, 1, timeout=LOCK_TIMEOUT):
+        entry = await await_for(cache, key)
+        return entry_response(entry, renderer) if entry is not None else await build()
+    try:
+        response = await build()
+        if response.status_code != 200:
+            return response
+        content = renderer.render(response.data, renderer.media_type, {'request': request})
+        entry = (content, etag, last_modified)
+        await cache.aset(key, entry, timeout=settings.API_CACHE_TIMEOUT)
+    finally:
+        await cache.adelete(lock_key)
+    return entry_response(entry, renderer)
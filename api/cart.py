@@ -0,0 +1,136 @@
+from django.conf import settings
+from django.db.models import F, OuterRef, Subquery
+from rest_framework.exceptions import ValidationError
+
+from .models import Image, Product
+from .reservations import held_quantity
+
+
+# Largest cart (distinct products) and line quantity accepted
+MAX_CART_LINES = 500
+MAX_LINE_QUANTITY = 1000
+MAX_PRODUCT_ID = 2 ** 63 - 1
+
+
+def parse_cart(payload):
+    """
+    Normalizes a cart payload into an ordered {product_id: quantity} dict.
+
+    Accepts `[{"id": 1, "qty": 2}, ...]` as well as a bare list of product
+    ids (quantity 1 each), as JSON integers. Repeated ids are merged.
+    """
+    if not isinstance(payload, list):
+        raise ValidationError(
+            "invalid datatype. Must be a list of {id, qty} objects or of product ids"
+        )
+
+    cart = {}
+    for line in payload:
+        if isinstance(line, dict):
+            product_id, quantity = line.get('id'), line.get('qty', 1)
+        else:
+            product_id, quantity = line, 1
+
+        # Integers only: no strings, no floats to truncate, no bools
+        if not all(type(value) is int for value in (product_id, quantity)):
+            raise ValidationError(f"invalid cart line: {line!r}, id and qty must be integers")
+        # Ids past 64 bits can't even be looked up
+        if not 1 <= product_id <= MAX_PRODUCT_ID or quantity < 1:
+            raise ValidationError(f"invalid cart line: {line!r}")
+
+        cart[product_id] = min(cart.get(product_id, 0) + quantity, MAX_LINE_QUANTITY)
+        if len(cart) > MAX_CART_LINES:
+            raise ValidationError(f"a cart can hold at most {MAX_CART_LINES} products")
+    return cart
+
+
+def cart_rows(product_ids, token=None):
+    # A single query: the first album image and the units held by other
+    # carts' reservations come along as subqueries
+    first_image = Image.objects.filter(
+        album__product=OuterRef('pk')
+    ).order_by('id').values('image')[:1]
+    return Product.objects.filter(id__in=product_ids).annotate(
+        thumbnail=Subquery(first_image),
+        to_sell=F('quantity_available') - held_quantity(token),
+    ).values_list(
+        'id', 'name', 'price', 'previous_price', 'discount',
+        'to_sell', 'free_shipping', 'thumbnail',
+    )
+
+
+def cart_products(product_ids, token=None):
+    return {row[0]: row for row in cart_rows(product_ids, token)}
+
+
+async def acart_products(product_ids, token=None):
+    return {row[0]: row async for row in cart_rows(product_ids, token)}
+
+
+def price_cart(cart, products=None, token=None):
+    """
+    Prices a parsed cart server side.
+
+    The charged unit price is `price`; when `previous_price` is higher the
+    difference is reported as savings, and `discount` is passed through as
+    the advertised percentage. A flat CART_SHIPPING_FEE applies unless every
+    line ships free.
+
+    Availability is what is left once the stock held by reservations other
+    than `token` (see api/reservations.py) is set aside.
+
+    `products` are the rows of cart_products(), loaded here when not given.
+    """
+    if products is None:
+        products = cart_products(cart.keys(), token)
+
+    # The storage the product serializer's thumbnails come from too
+    image_storage = Image._meta.get_field('image').storage
+    lines = []
+    missing = []
+    subtotal = savings = 0
+    all_available = True
+    free_shipping = True
+    for product_id, quantity in cart.items():
+        product = products.get(product_id)
+        if product is None:
+            missing.append(product_id)
+            continue
+        (_, name, price, previous_price, discount,
+         quantity_available, ships_free, thumbnail) = product
+
+        quantity_available = max(quantity_available, 0)
+        line_total = price * quantity
+        line_savings = max(previous_price - price, 0) * quantity
+        available = quantity_available >= quantity
+
+        subtotal += line_total
+        savings += line_savings
+        all_available = all_available and available
+        free_shipping = free_shipping and ships_free
+
+        lines.append({
+            'id': product_id,
+            'name': name,
+            'quantity': quantity,
+            'unit_price': price,
+            'previous_price': previous_price,
+            'discount': discount,
+            'line_total': line_total,
+            'line_savings': line_savings,
+            'free_shipping': ships_free,
+            'quantity_available': quantity_available,
+            'available': available,
+            'thumbnail': image_storage.url(thumbnail) if thumbnail else None,
+        })
+
+    shipping = 0 if free_shipping or not lines else settings.CART_SHIPPING_FEE
+    return {
+        'lines': lines,
+        'missing': missing,
+        'subtotal': subtotal,
+        'savings': savings,
+        'shipping': shipping,
+        'total': subtotal + shipping,
+        'available': all_available and not missing,
+    }
@@ -0,0 +1,54 @@
+import hashlib
+from calendar import timegm
+
+from django.utils.cache import get_conditional_response
+from django.utils.http import http_date, quote_etag
+
+
+def make_validators(request, *parts, last_modified=True):
+    """
+    Builds a strong ETag and a Last-Modified timestamp from the cheap
+    fingerprint of a response: the max(updated_at) and row counts of the
+    rows it is built from, plus the URL and media type it is rendered for.
+
+    Responses built from a set of rows pass last_modified=False: deleting a
+    row can't move max(updated_at) forward, only the count in the ETag.
+    """
+    renderer = getattr(request, 'accepted_renderer', None)
+    source = '|'.join([
+        request.build_absolute_uri(),
+        getattr(renderer, 'media_type', ''),
+    ] + [str(part) for part in parts])
+    etag = quote_etag(hashlib.sha1(source.encode('utf-8')).hexdigest())
+
+    timestamps = [part for part in parts if hasattr(part, 'utctimetuple')]
+    if not last_modified or not timestamps:
+        return etag, None
+    return etag, timegm(max(timestamps).utctimetuple())
+
+
+def not_modified(request, etag, last_modified):
+    response = get_conditional_response(request, etag=etag, last_modified=last_modified)
+    if response is not None:
+        set_validators(response, etag, last_modified)
+    return response
+
+
+def set_validators(response, etag, last_modified):
+    if etag and not response.has_header('ETag'):
+        response.headers['ETag'] = etag
+    if last_modified is not None and not response.has_header('Last-Modified'):
+        response.headers['Last-Modified'] = http_date(last_modified)
+    return response
+
+
+def conditional_response(request, get_validators, build):
+    # For views that are not cached: the fingerprint query alone decides
+    # whether the body has to be built at all.
+    etag, last_modified = get_validators()
+    response = not_modified(request, etag, last_modified)
+    if response is None:
+        response = build()
+        if response.status_code == 200:
+            set_validators(response, etag, last_modified)
+    return response
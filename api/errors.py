@@ -2,14 +2,28 @@ from rest_framework.views import exception_handler
 from http import HTTPStatus
 from typing import Any
 
+from django.db import OperationalError
+from rest_framework.exceptions import APIException
 from rest_framework.views import Response
 
+from .sqlite import is_locked
 
 
+class DatabaseBusy(APIException):
+    # A write that still found SQLite locked once retry_if_locked gave up
+    status_code = 503
+    default_detail = 'The database is busy, please try again.'
+    default_code = 'database_busy'
+    # Sent as Retry-After, in seconds
+    wait = 1
+
 
 def api_exception_handler(exc: Exception, context: dict[str, Any]) -> Response:
     """Custom API exception handler."""
 
+    if isinstance(exc, OperationalError) and is_locked(exc):
+        exc = DatabaseBusy()
+
     # Call REST framework's default exception handler first,
     # to get the standard error response.
     response = exception_handler(exc, context)
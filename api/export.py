@@ -0,0 +1,89 @@
+import csv
+import json
+
+from django.core.serializers.json import DjangoJSONEncoder
+
+from .serializers import ProductSerializer
+
+
+EXPORT_CHUNK_SIZE = 500
+
+EXPORT_FORMATS = {
+    'ndjson': 'application/x-ndjson',
+    'csv': 'text/csv',
+}
+
+CSV_COLUMNS = [
+    'id',
+    'name',
+    'category',
+    'category_name',
+    'condition',
+    'description',
+    'price',
+    'previous_price',
+    'discount',
+    'quantity_available',
+    'product_in_stock',
+    'free_shipping',
+    'ratings',
+    'properties',
+    'thumbnails',
+]
+
+
+def export_rows(queryset, chunk_size=EXPORT_CHUNK_SIZE):
+    """
+    Yields one serialized product at a time.
+
+    Products are read `chunk_size` rows at a time and their images are
+    prefetched per chunk, so memory stays flat whatever the catalog size.
+    """
+    # One serializer for the whole export, instead of one per product
+    serializer = ProductSerializer()
+    products = queryset.for_api().order_by('id').iterator(chunk_size=chunk_size)
+    for product in products:
+        yield serializer.to_representation(product)
+
+
+def ndjson_lines(rows):
+    encoder = DjangoJSONEncoder(separators=(',', ':'))
+    for row in rows:
+        yield encoder.encode(row) + '\n'
+
+
+class Echo:
+    # csv.writer only needs write(); hand every line straight back instead of
+    # buffering it
+    def write(self, value):
+        return value
+
+
+def csv_lines(rows):
+    writer = csv.writer(Echo())
+    yield writer.writerow(CSV_COLUMNS)
+    for row in rows:
+        yield writer.writerow([
+            row['id'],
+            row['name'],
+            row['category'],
+            row['category_details']['name'],
+            row['condition_details']['name'],
+            row['description'],
+            row['price'],
+            row['previous_price'],
+            row['discount'],
+            row['quantity_available'],
+            row['product_in_stock'],
+            row['free_shipping'],
+            row['ratings'],
+            json.dumps(row['properties']) if row['properties'] is not None else '',
+            ' '.join(row['thumbnails']),
+        ])
+
+
+def export_lines(queryset, file_format, chunk_size=EXPORT_CHUNK_SIZE):
+    rows = export_rows(queryset, chunk_size)
+    if file_format == 'csv':
+        return csv_lines(rows)
+    return ndjson_lines(rows)
@@ -0,0 +1,80 @@
+from django.db.models import Count
+
+from .models import Category, ProductFacet
+
+
+PROPERTY_PARAM_PREFIX = 'prop.'
+
+
+def property_filters(query_params):
+    # ?prop.color=Red&prop.color=Blue&prop.size=M -> {'color': ['Red', 'Blue'], 'size': ['M']}
+    filters = {}
+    for key in query_params:
+        if not key.startswith(PROPERTY_PARAM_PREFIX):
+            continue
+        name = key[len(PROPERTY_PARAM_PREFIX):]
+        values = [value for value in query_params.getlist(key) if value]
+        if name and values:
+            filters[name] = values
+    return filters
+
+
+def filter_by_properties(queryset, filters):
+    # Values of one property are OR'ed, different properties are AND'ed
+    for name, values in filters.items():
+        queryset = queryset.filter(id__in=ProductFacet.objects.filter(
+            name=name, value__in=values
+        ).values('product_id'))
+    return queryset
+
+
+def category_facet_names(category_id):
+    # Category properties list the facets a category offers:
+    # [{"name": "color", "value": ["Green", "Blue", "Red"]}]
+    properties = Category.objects.filter(id=category_id).values_list(
+        'properties', flat=True
+    ).first()
+    names = [
+        prop['name'] for prop in properties or []
+        if isinstance(prop, dict) and prop.get('name')
+    ]
+    return names or None
+
+
+def count_values(queryset, names=None, exclude=()):
+    rows = ProductFacet.objects.filter(product_id__in=queryset.order_by().values('id'))
+    if names is not None:
+        rows = rows.filter(name__in=names)
+    if exclude:
+        rows = rows.exclude(name__in=exclude)
+    # (product, name, value) is unique, so counting rows counts products
+    return rows.values_list('name', 'value').annotate(
+        count=Count('id')
+    ).order_by('name', '-count', 'value')
+
+
+def facet_counts(queryset, filters, names=None):
+    """
+    Count the products for every property value, using GROUP BY queries over
+    the facet index.
+
+    `queryset` is the listing before any property filter is applied. A
+    property's own filter is left out when counting its values, so
+    `?prop.color=Red` still reports how many Blue products there are.
+    """
+    facets = {}
+
+    def collect(rows):
+        for name, value, count in rows:
+            facets.setdefault(name, []).append({'value': value, 'count': count})
+
+    filtered = filter_by_properties(queryset, filters)
+    collect(count_values(filtered, names, exclude=list(filters)))
+
+    for name in filters:
+        if names is not None and name not in names:
+            continue
+        others = {key: values for key, values in filters.items() if key != name}
+        collect(count_values(filter_by_properties(queryset, others), [name]))
+
+    return facets
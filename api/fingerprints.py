@@ -0,0 +1,100 @@
+from django.db.models import Count, Max
+from django.http import Http404
+
+from .conditional import make_validators
+from .models import Category, Condition, Product
+
+
+# Cheap aggregate fingerprints (max(updated_at) and row counts) of the rows
+# each catalog response is built from, turned into ETag/Last-Modified pairs.
+# Only single-row responses get a Last-Modified: anything that embeds a set
+# of rows (the lists, a product's images, a category's products) revalidates
+# by ETag alone, as a deleted row leaves max(updated_at) where it was.
+
+def product_fingerprint(id):
+    return Product.objects.filter(id=id).annotate(
+        images_updated=Max('album__images__updated_at'),
+        images_count=Count('album__images'),
+    ).values_list(
+        'updated_at', 'category__updated_at', 'condition__updated_at',
+        'images_updated', 'images_count',
+    )
+
+
+def product_validators(request, id):
+    row = product_fingerprint(id).first()
+    if row is None:
+        raise Http404
+    return make_validators(request, *row, last_modified=False)
+
+
+async def aproduct_validators(request, id):
+    row = await product_fingerprint(id).afirst()
+    if row is None:
+        raise Http404
+    return make_validators(request, *row, last_modified=False)
+
+
+# `products` is the listing before property filters and pagination
+PRODUCT_LIST_AGGREGATES = {
+    'updated': Max('updated_at'),
+    'count': Count('id', distinct=True),
+    'categories_updated': Max('category__updated_at'),
+    'conditions_updated': Max('condition__updated_at'),
+    'images_updated': Max('album__images__updated_at'),
+    'images_count': Count('album__images'),
+}
+
+
+def product_list_validators(request, products):
+    row = products.order_by().aggregate(**PRODUCT_LIST_AGGREGATES)
+    return make_validators(request, *row.values(), last_modified=False)
+
+
+async def aproduct_list_validators(request, products):
+    row = await products.order_by().aaggregate(**PRODUCT_LIST_AGGREGATES)
+    return make_validators(request, *row.values(), last_modified=False)
+
+
+def categories_aggregates(with_products):
+    aggregates = {
+        'updated': Max('updated_at'),
+        'count': Count('id', distinct=True),
+    }
+    if with_products:
+        aggregates['products_updated'] = Max('_products__updated_at')
+        aggregates['products_count'] = Count('_products')
+    return aggregates
+
+
+def categories_fingerprint(categories, with_products):
+    return list(categories.aggregate(**categories_aggregates(with_products)).values())
+
+
+def category_validators(request, id, with_products):
+    parts = categories_fingerprint(Category.objects.filter(id=id), with_products)
+    if not parts[1]:
+        raise Http404
+    return make_validators(request, *parts, last_modified=not with_products)
+
+
+def category_list_validators(request, with_products):
+    parts = categories_fingerprint(Category.objects.all(), with_products)
+    return make_validators(request, *parts, last_modified=False)
+
+
+async def acategory_list_validators(request, with_products):
+    row = await Category.objects.aaggregate(**categories_aggregates(with_products))
+    return make_validators(request, *row.values(), last_modified=False)
+
+
+def condition_validators(request, id):
+    row = Condition.objects.filter(id=id).values_list('updated_at', flat=True).first()
+    if row is None:
+        raise Http404
+    return make_validators(request, row)
+
+
+def condition_list_validators(request):
+    row = Condition.objects.aggregate(updated=Max('updated_at'), count=Count('id'))
+    return make_validators(request, *row.values(), last_modified=False)
@@ -0,0 +1,180 @@
+import logging
+import multiprocessing
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from io import BytesIO
+
+from django.apps import apps
+from django.conf import settings
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.db import close_old_connections
+from django.utils import timezone
+
+from PIL import Image as PILImage, ImageOps
+
+from .storage import ReplacingStorage
+
+
+logger = logging.getLogger(__name__)
+
+# Variant name -> longest side in pixels. Images are never upscaled.
+VARIANTS = {
+    'thumb': 200,
+    'card': 480,
+    'full': 1200,
+}
+
+# Format -> Pillow save options
+FORMATS = {
+    'webp': {'format': 'WEBP', 'quality': 80, 'method': 4},
+    'jpeg': {'format': 'JPEG', 'quality': 82, 'optimize': True, 'progressive': True},
+}
+
+DERIVATIVES_DIR = 'derivatives'
+
+# Two workers can build the variants of the same source at once (the same
+# content uploaded twice, a rebuild racing an upload): each write replaces
+# the file atomically, so neither deletes what the other just saved.
+derivatives_storage = ReplacingStorage()
+
+
+def variant_name(name, variant, file_format):
+    # category/bg1.png -> derivatives/category/bg1.thumb.webp
+    root, _ = os.path.splitext(name)
+    return f'{DERIVATIVES_DIR}/{root}.{variant}.{file_format}'
+
+
+def flatten(image):
+    # JPEG has no alpha channel: composite transparent images on white
+    if image.mode in ('RGBA', 'LA', 'P'):
+        image = image.convert('RGBA')
+        background = PILImage.new('RGB', image.size, (255, 255, 255))
+        background.paste(image, mask=image.split()[-1])
+        return background
+    return image.convert('RGB')
+
+
+def build_variants(name):
+    """
+    Renders every variant of the stored image `name` in every format and
+    saves them next to each other under DERIVATIVES_DIR.
+
+    Returns the `variants` map stored on the model:
+    {"source": name, "thumb": {"width": 200, "webp": ..., "jpeg": ...}, ...}
+    """
+    with default_storage.open(name, 'rb') as source:
+        original = PILImage.open(source)
+        original = ImageOps.exif_transpose(original)
+        original.load()
+
+    original = flatten(original)
+    variants = {'source': name}
+    for variant, size in VARIANTS.items():
+        image = original.copy()
+        image.thumbnail((size, size), PILImage.LANCZOS)
+        entry = {'width': image.width}
+        for file_format, options in FORMATS.items():
+            buffer = BytesIO()
+            image.save(buffer, **options)
+            target = variant_name(name, variant, file_format)
+            entry[file_format] = derivatives_storage.save(target, ContentFile(buffer.getvalue()))
+        variants[variant] = entry
+    return variants
+
+
+def variant_urls(variants, name):
+    """
+    srcset-style map of the variant URLs of an image, or None while the
+    variants of its current file have not been built yet.
+    """
+    if not variants or not name or variants.get('source') != name:
+        return None
+    sizes = {}
+    srcset = {}
+    for variant in VARIANTS:
+        entry = variants.get(variant)
+        if entry is None:
+            continue
+        sizes[variant] = {}
+        for file_format in FORMATS:
+            url = derivatives_storage.url(entry[file_format])
+            sizes[variant][file_format] = url
+            srcset.setdefault(file_format, []).append(f"{url} {entry['width']}w")
+    return {
+        'sizes': sizes,
+        'srcset': {file_format: ', '.join(urls) for file_format, urls in srcset.items()},
+    }
+
+
+def save_variants(model_label, pk, field_name, variants_field, variants):
+    # Only store the result if the field still points at the same file
+    # update() skips auto_now, and the new variants must change the ETags
+    model = apps.get_model(model_label)
+    updated = model.objects.filter(
+        pk=pk, **{field_name: variants['source']}
+    ).update(**{variants_field: variants, 'updated_at': timezone.now()})
+    if updated:
+        model.variants_built(pk)
+
+
+_executor = None
+_executor_lock = threading.Lock()
+
+
+# Settings a spawned worker takes from the process that started it, since
+# they may have been changed there at runtime (override_settings())
+INHERITED_SETTINGS = ('MEDIA_ROOT', 'MEDIA_URL')
+
+
+def init_worker(inherited=None):
+    import django
+    django.setup()
+    for name, value in (inherited or {}).items():
+        setattr(settings, name, value)
+
+
+def process_pool(max_workers):
+    # Spawned, not forked: a fork would copy the parent's open database
+    # connections and any lock another of its threads held at that moment.
+    # init_worker() sets Django up from scratch instead.
+    return ProcessPoolExecutor(
+        max_workers=max_workers,
+        mp_context=multiprocessing.get_context('spawn'),
+        initializer=init_worker,
+        initargs=({name: getattr(settings, name) for name in INHERITED_SETTINGS},),
+    )
+
+
+def get_executor():
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = process_pool(settings.IMAGE_VARIANT_WORKERS)
+        return _executor
+
+
+def schedule_variants(model_label, pk, field_name, variants_field, name):
+    """
+    Builds the variants of `name` off the request thread, in a process pool
+    of IMAGE_VARIANT_WORKERS processes (inline when it is 0), then records
+    them on the model row.
+    """
+    if settings.IMAGE_VARIANT_WORKERS == 0:
+        try:
+            save_variants(model_label, pk, field_name, variants_field, build_variants(name))
+        except Exception:
+            logger.exception("Building image variants of %s failed", name)
+        return
+
+    def done(future):
+        # Runs on the pool's management thread, with its own db connection
+        try:
+            save_variants(model_label, pk, field_name, variants_field, future.result())
+        except Exception:
+            logger.exception("Building image variants of %s failed", name)
+        finally:
+            close_old_connections()
+
+    get_executor().submit(build_variants, name).add_done_callback(done)
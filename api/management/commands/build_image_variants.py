@@ -0,0 +1,53 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from api.images import build_variants, process_pool, save_variants
+from api.models import Category, Image
+
+
+# (model, image field, variants field) of every image that gets variants
+IMAGE_FIELDS = [
+    (Image, 'image', 'variants'),
+    (Category, 'category_banner_image', 'banner_variants'),
+    (Category, 'category_thumbnail_image', 'thumbnail_variants'),
+]
+
+
+class Command(BaseCommand):
+    help = "Builds the missing or stale WebP/JPEG variants of stored images."
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--workers', type=int, default=max(settings.IMAGE_VARIANT_WORKERS, 1)
+        )
+        parser.add_argument(
+            '--force', action='store_true', help="Rebuild variants that are up to date too."
+        )
+
+    def pending(self, force):
+        for model, field_name, variants_field in IMAGE_FIELDS:
+            rows = model.objects.exclude(**{f'{field_name}__isnull': True}).exclude(
+                **{field_name: ''}
+            ).values_list('pk', field_name, variants_field)
+            for pk, name, variants in rows.iterator():
+                if force or (variants or {}).get('source') != name:
+                    yield model._meta.label, pk, field_name, variants_field, name
+
+    def handle(self, *args, **options):
+        jobs = list(self.pending(options['force']))
+        built = failed = 0
+        with process_pool(options['workers']) as pool:
+            futures = [(job, pool.submit(build_variants, job[-1])) for job in jobs]
+            for (label, pk, field_name, variants_field, name), future in futures:
+                try:
+                    variants = future.result()
+                except Exception as exc:
+                    failed += 1
+                    self.stderr.write(f"{name}: {exc}")
+                    continue
+                save_variants(label, pk, field_name, variants_field, variants)
+                built += 1
+
+        self.stdout.write(self.style.SUCCESS(
+            f"Built variants of {built} images, {failed} failed."
+        ))
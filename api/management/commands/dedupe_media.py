@@ -0,0 +1,78 @@
+from django.core.management import call_command
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from api.cache import invalidate
+from api.models import Category, Image, content_storage, image_cache_namespaces
+from api.storage import is_hashed_name
+
+
+# (model, image field) of every field stored by ContentAddressedStorage
+IMAGE_FIELDS = [
+    (Image, 'image'),
+    (Category, 'category_banner_image'),
+    (Category, 'category_thumbnail_image'),
+]
+
+
+class Command(BaseCommand):
+    help = (
+        "Moves images uploaded before content-addressed storage to hash-derived "
+        "names, so identical files end up stored once."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--delete-originals', action='store_true',
+            help="Delete the old files once no row points at them anymore."
+        )
+
+    def cache_namespaces(self, model, pk):
+        # What the signals of a save() would have invalidated
+        if model is Image:
+            album_id = Image.objects.filter(pk=pk).values_list('album_id', flat=True).first()
+            return image_cache_namespaces(album_id)
+        return {f'category:{pk}', 'catalog-meta', 'product-list'}
+
+    def handle(self, *args, **options):
+        renamed = {}
+        namespaces = set()
+        for model, field_name in IMAGE_FIELDS:
+            rows = model.objects.exclude(**{f'{field_name}__isnull': True}).exclude(
+                **{field_name: ''}
+            ).values_list('pk', field_name)
+            for pk, name in rows.iterator():
+                if is_hashed_name(name):
+                    continue
+                if name not in renamed:
+                    if not content_storage.exists(name):
+                        self.stderr.write(f"{name}: missing")
+                        continue
+                    with content_storage.open(name, 'rb') as original:
+                        renamed[name] = content_storage.save(name, original)
+                # update() skips auto_now and the signals: the new URL has to
+                # change the ETags, and the cached responses are dropped below
+                updated = model.objects.filter(pk=pk, **{field_name: name}).update(
+                    **{field_name: renamed[name], 'updated_at': timezone.now()}
+                )
+                if updated:
+                    namespaces |= self.cache_namespaces(model, pk)
+        invalidate(namespaces)
+
+        if options['delete_originals']:
+            for name in renamed:
+                referenced = any(
+                    model.objects.filter(**{field_name: name}).exists()
+                    for model, field_name in IMAGE_FIELDS
+                )
+                if not referenced:
+                    content_storage.delete(name)
+
+        blobs = len(set(renamed.values()))
+        self.stdout.write(self.style.SUCCESS(
+            f"Moved {len(renamed)} files into {blobs} content-addressed blobs."
+        ))
+        # The variants recorded the old names as their source, so they count
+        # as stale until rebuilt for the new ones
+        if renamed:
+            call_command('build_image_variants', stdout=self.stdout, stderr=self.stderr)
@@ -0,0 +1,37 @@
+from django.core.management.base import BaseCommand
+
+from api.export import EXPORT_CHUNK_SIZE, EXPORT_FORMATS, export_lines
+from api.models import Product
+
+
+class Command(BaseCommand):
+    help = "Streams the product catalog as NDJSON or CSV to a file or stdout."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--format', choices=sorted(EXPORT_FORMATS), default='ndjson')
+        parser.add_argument('--output', '-o', help="File to write to (default: stdout)")
+        parser.add_argument('--chunk-size', type=int, default=EXPORT_CHUNK_SIZE)
+        parser.add_argument('--category', type=int, help="Only export this category id")
+
+    def handle(self, *args, **options):
+        products = Product.objects.all()
+        if options['category'] is not None:
+            products = products.filter(category_id=options['category'])
+
+        output = options['output']
+        # newline='' keeps csv's \r\n line endings untouched
+        stream = open(output, 'w', encoding='utf-8', newline='') if output else None
+        write = stream.write if stream else (lambda line: self.stdout.write(line, ending=''))
+        count = 0
+        try:
+            for line in export_lines(products, options['format'], options['chunk_size']):
+                write(line)
+                count += 1
+        finally:
+            if stream:
+                stream.close()
+
+        if stream:
+            if options['format'] == 'csv':
+                count -= 1
+            self.stderr.write(self.style.SUCCESS(f"Exported {count} products to {output}."))
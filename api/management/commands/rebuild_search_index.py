@@ -0,0 +1,36 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction, DEFAULT_DB_ALIAS
+
+from api.models import Product
+from api.search import get_search_backend
+
+
+class Command(BaseCommand):
+    help = "Rebuilds the product full-text search index from the products table."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=1000)
+        parser.add_argument('--database', default=DEFAULT_DB_ALIAS)
+
+    def handle(self, *args, **options):
+        batch_size = options['batch_size']
+        using = options['database']
+        backend = get_search_backend(using)
+        products = Product.objects.using(using).only(
+            'id', 'name', 'description', 'properties'
+        ).order_by('id')
+
+        indexed = 0
+        with transaction.atomic(using=using):
+            backend.clear()
+            batch = []
+            for product in products.iterator(chunk_size=batch_size):
+                batch.append(product)
+                if len(batch) == batch_size:
+                    backend.index(batch)
+                    indexed += len(batch)
+                    batch = []
+            backend.index(batch)
+            indexed += len(batch)
+
+        self.stdout.write(self.style.SUCCESS(f"Indexed {indexed} products."))
@@ -0,0 +1,14 @@
+from django.core.management.base import BaseCommand
+
+from api.reservations import SWEEP_BATCH_SIZE, sweep
+
+
+class Command(BaseCommand):
+    help = "Deletes expired stock reservations; run it periodically (e.g. from cron)."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=SWEEP_BATCH_SIZE)
+
+    def handle(self, *args, **options):
+        released = sweep(options['batch_size'])
+        self.stdout.write(self.style.SUCCESS(f"Released {released} expired reservations."))
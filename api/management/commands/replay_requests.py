@@ -0,0 +1,78 @@
+import json
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from api.replay import SAFE_METHODS, load_trace, replay, replayable, summarize, trace_paths
+
+
+class Command(BaseCommand):
+    help = (
+        "Replays a JSONL request trace (REQUEST_TRACE_FILE) against a server at the "
+        "recorded or a scaled rate and compares latencies per route. Recorded times "
+        "are measured inside Django, replayed ones include the network and server."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            'traces', nargs='*',
+            help="Trace files or globs to replay (default: REQUEST_TRACE_FILE of every "
+                 "worker, with its rotated backups)"
+        )
+        parser.add_argument('--url', default='http://127.0.0.1:8000', help="Server to replay against")
+        parser.add_argument(
+            '--rate', type=float, default=1.0,
+            help="Speed-up of the recorded pacing, e.g. 2 for twice as fast; 0 sends back to back"
+        )
+        parser.add_argument('--concurrency', type=int, default=16)
+        parser.add_argument('--timeout', type=float, default=30)
+        parser.add_argument('--limit', type=int, help="Replay only the first N requests")
+        parser.add_argument('--safe-only', action='store_true', help="Skip requests that write")
+        parser.add_argument('--output', '-o', help="Also write the summary to this JSON file")
+
+    def handle(self, *args, **options):
+        # The rotated backups are named like the trace plus '.1', '.2', ...
+        patterns = options['traces'] or [settings.REQUEST_TRACE_FILE + '*']
+        try:
+            records = load_trace(trace_paths(patterns))
+        except OSError as exc:
+            raise CommandError(exc)
+
+        skipped = [record for record in records if not replayable(record)]
+        records = [record for record in records if replayable(record)]
+        if options['safe_only']:
+            records = [record for record in records if record['method'] in SAFE_METHODS]
+        records = records[:options['limit']]
+        if not records:
+            raise CommandError("The trace has no requests to replay.")
+        if skipped:
+            self.stderr.write(
+                f"Skipping {len(skipped)} requests whose body was not kept "
+                f"(set REQUEST_TRACE_BODIES to record them)."
+            )
+
+        results = replay(
+            records, options['url'].rstrip('/'), options['rate'],
+            options['concurrency'], options['timeout'],
+        )
+        summary = summarize(results)
+
+        self.stdout.write(
+            f"{'route':<32} {'count':>6} {'p50 rec':>9} {'p50 now':>9} {'change':>8} "
+            f"{'p95 rec':>9} {'p95 now':>9} {'change':>8} {'status!':>7} {'errors':>6}"
+        )
+        for name, row in summary.items():
+            self.stdout.write(
+                f"{name:<32} {row['count']:>6} "
+                f"{row['recorded_p50_ms']:>9.2f} {row['replayed_p50_ms']:>9.2f} {percent(row['p50_change']):>8} "
+                f"{row['recorded_p95_ms']:>9.2f} {row['replayed_p95_ms']:>9.2f} {percent(row['p95_change']):>8} "
+                f"{row['status_mismatches']:>7} {row['errors']:>6}"
+            )
+        if options['output']:
+            with open(options['output'], 'w', encoding='utf-8') as output:
+                json.dump(summary, output, indent=2)
+        self.stderr.write(self.style.SUCCESS(f"Replayed {len(results)} requests."))
+
+
+def percent(change):
+    return '-' if change is None else f'{change:+.1f}%'
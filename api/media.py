@@ -0,0 +1,180 @@
+import mimetypes
+import os
+import re
+import stat
+
+from django.conf import settings
+from django.core.exceptions import SuspiciousFileOperation
+from django.http import FileResponse, Http404, HttpResponse, StreamingHttpResponse
+from django.utils._os import safe_join
+from django.utils.http import parse_http_date_safe
+from django.views.decorators.http import require_safe
+
+from .conditional import not_modified, set_validators
+from .storage import IMMUTABLE_CACHE_CONTROL, is_hashed_name
+
+
+# Precompressed siblings tried in order of preference: foo.css.br, foo.css.gz
+PRECOMPRESSED = [('br', '.br'), ('gzip', '.gz')]
+
+RANGE_RE = re.compile(r'^bytes=(\d*)-(\d*)$')
+
+RANGE_CHUNK_SIZE = 64 * 1024
+
+
+def accepted_encodings(request):
+    encodings = set()
+    for part in request.headers.get('Accept-Encoding', '').split(','):
+        coding, _, params = part.strip().partition(';')
+        if params.replace(' ', '') in ('q=0', 'q=0.0', 'q=0.00', 'q=0.000'):
+            continue
+        encodings.add(coding.strip().lower())
+    return encodings
+
+
+def find_file(request, document_root, path):
+    """
+    Resolves `path` inside `document_root`, preferring a precompressed copy
+    the client accepts. Returns (full path, stat result, content encoding).
+    """
+    try:
+        full_path = safe_join(document_root, path)
+    except (SuspiciousFileOperation, ValueError):
+        raise Http404
+    candidates = [(full_path, None)]
+    encodings = accepted_encodings(request)
+    candidates[:0] = [
+        (full_path + suffix, encoding)
+        for encoding, suffix in PRECOMPRESSED
+        if encoding in encodings
+    ]
+    for candidate, encoding in candidates:
+        try:
+            stat_result = os.stat(candidate)
+        except (FileNotFoundError, NotADirectoryError):
+            continue
+        if stat.S_ISREG(stat_result.st_mode):
+            return candidate, stat_result, encoding
+    raise Http404
+
+
+def byte_range(request, size, etag, last_modified):
+    """
+    Returns the (start, end) of a satisfiable single Range request, None to
+    send the whole file, or False when the range can't be satisfied.
+    """
+    header = request.headers.get('Range')
+    if not header:
+        return None
+    # If-Range: only send a part of the representation the client already has
+    if_range = request.headers.get('If-Range')
+    if if_range:
+        if if_range.startswith(('"', 'W/')):
+            if if_range != etag:
+                return None
+        elif parse_http_date_safe(if_range) != last_modified:
+            return None
+
+    match = RANGE_RE.match(header.strip())
+    # Multiple ranges are answered with the whole file
+    if match is None or match.groups() == ('', ''):
+        return None
+    first, last = match.groups()
+    if first == '':
+        # bytes=-500: the last 500 bytes
+        length = int(last)
+        if length == 0:
+            return False
+        return max(size - length, 0), size - 1
+    start = int(first)
+    end = min(int(last), size - 1) if last else size - 1
+    if start >= size or start > end:
+        return False
+    return start, end
+
+
+def read_range(file, start, end):
+    # Not zero-copy: the WSGI file wrapper only sends whole files
+    file.seek(start)
+    remaining = end - start + 1
+    try:
+        while remaining > 0:
+            chunk = file.read(min(RANGE_CHUNK_SIZE, remaining))
+            if not chunk:
+                break
+            remaining -= len(chunk)
+            yield chunk
+    finally:
+        file.close()
+
+
+def cache_control(path):
+    if is_hashed_name(path):
+        return IMMUTABLE_CACHE_CONTROL
+    return f'public, max-age={settings.MEDIA_MAX_AGE}'
+
+
+def sendfile_response(full_path, document_root):
+    # The front proxy sends the file itself, Range and all
+    response = HttpResponse()
+    if settings.MEDIA_SERVER == 'x-accel-redirect':
+        relative = os.path.relpath(full_path, document_root).replace(os.sep, '/')
+        response.headers['X-Accel-Redirect'] = settings.MEDIA_ACCEL_REDIRECT_PREFIX + relative
+    else:
+        response.headers['X-Sendfile'] = full_path
+    return response
+
+
+@require_safe
+def serve_media(request, path, document_root=None):
+    """
+    Serves a file of MEDIA_ROOT, outside DEBUG too.
+
+    With MEDIA_SERVER set to 'x-sendfile' or 'x-accel-redirect' the file is
+    handed over to the front proxy, Range requests included; otherwise it
+    goes out as a FileResponse, which the WSGI server can send with
+    sendfile(), and ranges are streamed through Python in RANGE_CHUNK_SIZE
+    reads. Both honour conditional requests, pick .br/.gz copies for clients
+    that accept them and send long-lived Cache-Control (immutable for
+    content-hashed names).
+    """
+    document_root = document_root or settings.MEDIA_ROOT
+    full_path, stat_result, encoding = find_file(request, document_root, path)
+
+    size = stat_result.st_size
+    last_modified = int(stat_result.st_mtime)
+    etag = f'"{stat_result.st_mtime_ns:x}-{size:x}{"-" + encoding if encoding else ""}"'
+    response = not_modified(request, etag, last_modified)
+    if response is not None:
+        response.headers['Vary'] = 'Accept-Encoding'
+        response.headers['Cache-Control'] = cache_control(path)
+        return response
+
+    content_type, _ = mimetypes.guess_type(path)
+    content_type = content_type or 'application/octet-stream'
+
+    if settings.MEDIA_SERVER in ('x-sendfile', 'x-accel-redirect'):
+        response = sendfile_response(full_path, document_root)
+    else:
+        span = byte_range(request, size, etag, last_modified)
+        if span is False:
+            response = HttpResponse(status=416)
+            response.headers['Content-Range'] = f'bytes */{size}'
+            return response
+        if span is None:
+            response = FileResponse(open(full_path, 'rb'))
+        else:
+            start, end = span
+            response = StreamingHttpResponse(
+                read_range(open(full_path, 'rb'), start, end), status=206
+            )
+            response.headers['Content-Range'] = f'bytes {start}-{end}/{size}'
+            response.headers['Content-Length'] = str(end - start + 1)
+        response.headers['Accept-Ranges'] = 'bytes'
+
+    response.headers['Content-Type'] = content_type
+    if encoding:
+        response.headers['Content-Encoding'] = encoding
+    response.headers['Vary'] = 'Accept-Encoding'
+    response.headers['Cache-Control'] = cache_control(path)
+    return set_validators(response, etag, last_modified)
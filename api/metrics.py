@@ -0,0 +1,317 @@
+import atexit
+import glob
+import json
+import logging
+import os
+import tempfile
+import threading
+import time
+import uuid
+from collections import defaultdict
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from django.core.exceptions import MiddlewareNotUsed
+from django.http import Http404, HttpResponse
+
+from .tracing import QueryStats
+
+
+logger = logging.getLogger(__name__)
+
+
+DURATION_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+SIZE_BUCKETS = (256, 1024, 4096, 16384, 65536, 262144, 1048576, 4194304)
+
+# name: (type, help)
+METRICS = {
+    'api_requests_total': ('counter', 'Requests handled, by route, method and status.'),
+    'api_request_duration_seconds': ('histogram', 'Time spent handling requests, by route.'),
+    'api_response_size_bytes': ('histogram', 'Size of response bodies, by route.'),
+    'api_db_queries_total': ('counter', 'SQL queries run, by route.'),
+    'api_db_query_duration_seconds_total': ('counter', 'Time spent in SQL queries, by route.'),
+    'api_cache_requests_total': ('counter', 'Response cache lookups, by cache and result.'),
+    'api_cache_hit_ratio': ('gauge', 'Share of response cache lookups that were hits.'),
+}
+
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+
+class Registry:
+    """
+    The metrics of this process. Updates only touch memory; a background
+    thread writes the totals to METRICS_DIR/metrics-<pid>-<random id>.json
+    every METRICS_FLUSH_INTERVAL seconds when they changed, and /metrics adds
+    up the files of every worker process, including ones that exited, so
+    counters never go back. The random id keeps a new process that got the
+    pid of an exited one from overwriting its file.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.flusher_pid = None
+        self.pid = None
+        self.reset()
+
+    def reset(self):
+        if self.pid != os.getpid():
+            self.filename = f'metrics-{os.getpid()}-{uuid.uuid4().hex[:12]}.json'
+        self.pid = os.getpid()
+        self.counters = defaultdict(float)
+        # key: [bucket counts..., sum, count]
+        self.histograms = {}
+        self.dirty = False
+
+    def check_pid(self):
+        # A forked worker must not report its parent's numbers as its own
+        if os.getpid() != self.pid:
+            self.reset()
+
+    def inc(self, name, labels, value=1):
+        with self.lock:
+            self.check_pid()
+            self.counters[(name, labels)] += value
+            self.dirty = True
+
+    def observe(self, name, labels, value, buckets):
+        with self.lock:
+            self.check_pid()
+            values = self.histograms.get((name, labels))
+            if values is None:
+                values = self.histograms[(name, labels)] = [0] * (len(buckets) + 2)
+            # Non-cumulative here; values over the last bound only count in +Inf
+            for index, bound in enumerate(buckets):
+                if value <= bound:
+                    values[index] += 1
+                    break
+            values[-2] += value
+            values[-1] += 1
+            self.dirty = True
+
+    def snapshot(self):
+        with self.lock:
+            self.check_pid()
+            self.dirty = False
+            return {
+                'counters': [[name, labels, value] for (name, labels), value in self.counters.items()],
+                'histograms': [
+                    [name, labels, list(values)] for (name, labels), values in self.histograms.items()
+                ],
+            }
+
+    def start_flusher(self):
+        # Once per process; a forked worker doesn't inherit its parent's thread
+        pid = os.getpid()
+        if self.flusher_pid == pid:
+            return
+        with self.lock:
+            if self.flusher_pid == pid:
+                return
+            self.flusher_pid = pid
+        threading.Thread(target=self.flush_periodically, name='metrics-flusher', daemon=True).start()
+
+    def flush_periodically(self):
+        while True:
+            time.sleep(settings.METRICS_FLUSH_INTERVAL)
+            if self.dirty:
+                try:
+                    self.flush()
+                except OSError:
+                    logger.exception("Could not write the metrics of this process")
+
+    def flush(self, directory=None):
+        directory = directory or metrics_dir()
+        os.makedirs(directory, exist_ok=True)
+        with self.lock:
+            self.check_pid()
+            path = os.path.join(directory, self.filename)
+        fd, tmp_path = tempfile.mkstemp(dir=directory, prefix='.metrics-')
+        with os.fdopen(fd, 'w') as tmp:
+            json.dump(self.snapshot(), tmp)
+        os.replace(tmp_path, path)
+
+
+registry = Registry()
+
+
+def metrics_dir():
+    return settings.METRICS_DIR or os.path.join(tempfile.gettempdir(), 'ecommerce-backend-metrics')
+
+
+def clear_metrics_dir(directory=None):
+    # For the server's master process as it starts (see gunicorn.conf.py): the
+    # files of the last run's workers would carry their totals over
+    directory = directory or metrics_dir()
+    # With the temporary files of interrupted flushes
+    paths = glob.glob(os.path.join(directory, 'metrics-*.json'))
+    paths += glob.glob(os.path.join(directory, '.metrics-*'))
+    for path in paths:
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+
+
+def flush_at_exit():
+    if settings.configured and settings.METRICS:
+        registry.flush()
+
+
+atexit.register(flush_at_exit)
+
+
+def labels(**values):
+    return tuple(sorted((name, str(value)) for name, value in values.items()))
+
+
+def record_cache(namespaces, hit):
+    # Labelled by kind of namespace: 'product' for 'product:12'
+    if settings.METRICS:
+        cache_name = next(iter(namespaces)).split(':')[0]
+        result = 'hit' if hit else 'miss'
+        registry.inc('api_cache_requests_total', labels(cache=cache_name, result=result))
+
+
+def route_name(request):
+    match = getattr(request, 'resolver_match', None)
+    if match is None:
+        return 'unmatched'
+    return match.url_name or match.view_name
+
+
+def response_size(response):
+    if not response.streaming:
+        return len(response.content)
+    length = response.get('Content-Length')
+    return int(length) if length and length.isdigit() else None
+
+
+class MetricsMiddleware:
+    # Feeds the per-route request metrics; off unless METRICS is set
+    async_capable = True
+    sync_capable = True
+
+    def __init__(self, get_response):
+        if not settings.METRICS:
+            raise MiddlewareNotUsed
+        self.get_response = get_response
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        started = time.perf_counter()
+        with QueryStats() as queries:
+            response = self.get_response(request)
+        self.record(request, response, queries, time.perf_counter() - started)
+        return response
+
+    async def __acall__(self, request):
+        started = time.perf_counter()
+        async with QueryStats() as queries:
+            response = await self.get_response(request)
+        self.record(request, response, queries, time.perf_counter() - started)
+        return response
+
+    def record(self, request, response, queries, duration):
+        route = route_name(request)
+        by_route = labels(route=route)
+        registry.inc('api_requests_total', labels(
+            route=route, method=request.method, status=response.status_code
+        ))
+        registry.observe('api_request_duration_seconds', by_route, duration, DURATION_BUCKETS)
+        size = response_size(response)
+        if size is not None:
+            registry.observe('api_response_size_bytes', by_route, size, SIZE_BUCKETS)
+        registry.inc('api_db_queries_total', by_route, queries.count)
+        registry.inc('api_db_query_duration_seconds_total', by_route, queries.duration)
+        registry.start_flusher()
+
+
+def collect(directory):
+    # The snapshots of all processes, added up
+    counters = defaultdict(float)
+    histograms = {}
+    for path in glob.glob(os.path.join(directory, 'metrics-*.json')):
+        try:
+            with open(path) as snapshot_file:
+                snapshot = json.load(snapshot_file)
+        except (OSError, ValueError):
+            continue
+        for name, label_pairs, value in snapshot['counters']:
+            counters[(name, tuple(map(tuple, label_pairs)))] += value
+        for name, label_pairs, values in snapshot['histograms']:
+            key = (name, tuple(map(tuple, label_pairs)))
+            if key in histograms:
+                histograms[key] = [a + b for a, b in zip(histograms[key], values)]
+            else:
+                histograms[key] = values
+    return counters, histograms
+
+
+def format_labels(label_pairs):
+    if not label_pairs:
+        return ''
+    escaped = (
+        (name, value.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n'))
+        for name, value in label_pairs
+    )
+    return '{' + ','.join(f'{name}="{value}"' for name, value in escaped) + '}'
+
+
+def format_value(value):
+    return str(int(value)) if float(value).is_integer() else repr(float(value))
+
+
+def cache_hit_ratios(counters):
+    lookups = defaultdict(lambda: {'hit': 0, 'miss': 0})
+    for (name, label_pairs), value in counters.items():
+        if name == 'api_cache_requests_total':
+            label_values = dict(label_pairs)
+            lookups[label_values['cache']][label_values['result']] += value
+    return {
+        (('cache', cache_name),): counts['hit'] / (counts['hit'] + counts['miss'])
+        for cache_name, counts in lookups.items()
+        if counts['hit'] + counts['miss']
+    }
+
+
+def exposition(counters, histograms):
+    # Prometheus text format
+    samples = defaultdict(list)
+    for (name, label_pairs), value in sorted(counters.items()):
+        samples[name].append(f'{name}{format_labels(label_pairs)} {format_value(value)}')
+    for label_pairs, ratio in sorted(cache_hit_ratios(counters).items()):
+        samples['api_cache_hit_ratio'].append(
+            f'api_cache_hit_ratio{format_labels(label_pairs)} {format_value(ratio)}'
+        )
+    for (name, label_pairs), values in sorted(histograms.items()):
+        buckets = DURATION_BUCKETS if name == 'api_request_duration_seconds' else SIZE_BUCKETS
+        cumulative = 0
+        for bound, count in zip(buckets, values):
+            cumulative += count
+            samples[name].append(
+                f'{name}_bucket{format_labels(label_pairs + (("le", format_value(bound)),))} '
+                f'{format_value(cumulative)}'
+            )
+        samples[name].append(
+            f'{name}_bucket{format_labels(label_pairs + (("le", "+Inf"),))} {format_value(values[-1])}'
+        )
+        samples[name].append(f'{name}_sum{format_labels(label_pairs)} {format_value(values[-2])}')
+        samples[name].append(f'{name}_count{format_labels(label_pairs)} {format_value(values[-1])}')
+
+    lines = []
+    for name, (kind, help_text) in METRICS.items():
+        if samples[name]:
+            lines += [f'# HELP {name} {help_text}', f'# TYPE {name} {kind}', *samples[name]]
+    return '\n'.join(lines) + '\n'
+
+
+def metrics_view(request):
+    # Public to anyone who can reach it: the proxy must keep it to the scraper
+    if not settings.METRICS:
+        raise Http404
+    directory = metrics_dir()
+    registry.flush(directory)
+    return HttpResponse(exposition(*collect(directory)), content_type=CONTENT_TYPE)
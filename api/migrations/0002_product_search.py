@@ -0,0 +1,109 @@
+from django.db import migrations
+
+
+# The full-text index as it was created at this point of the schema (see
+# api/search.py), copied here so later changes to the search backends don't
+# change what this migration does.
+
+SEARCH_TABLE = 'api_product_search'
+
+CREATE_INDEX = {
+    'sqlite': [
+        f'CREATE VIRTUAL TABLE IF NOT EXISTS {SEARCH_TABLE} USING fts5('
+        f"name, description, properties, tokenize='porter unicode61')",
+    ],
+    'postgresql': [
+        'CREATE EXTENSION IF NOT EXISTS pg_trgm',
+        f'CREATE TABLE IF NOT EXISTS {SEARCH_TABLE} ('
+        f'product_id bigint PRIMARY KEY REFERENCES api_product(id) '
+        f'ON DELETE CASCADE DEFERRABLE INITIALLY DEFERRED, '
+        f'name text NOT NULL, '
+        f'document tsvector NOT NULL)',
+        f'CREATE INDEX IF NOT EXISTS {SEARCH_TABLE}_document '
+        f'ON {SEARCH_TABLE} USING gin (document)',
+        f'CREATE INDEX IF NOT EXISTS {SEARCH_TABLE}_name_trgm '
+        f'ON {SEARCH_TABLE} USING gin (name gin_trgm_ops)',
+    ],
+}
+
+INDEX_PRODUCTS = {
+    'sqlite': (
+        f'INSERT OR REPLACE INTO {SEARCH_TABLE}(rowid, name, description, properties) '
+        f'VALUES (%s, %s, %s, %s)'
+    ),
+    'postgresql': (
+        f'INSERT INTO {SEARCH_TABLE}(product_id, name, document) VALUES (%s, %s, '
+        f"setweight(to_tsvector('english', %s), 'A') || "
+        f"setweight(to_tsvector('english', %s), 'B') || "
+        f"setweight(to_tsvector('english', %s), 'C')) "
+        f'ON CONFLICT (product_id) DO UPDATE '
+        f'SET name = EXCLUDED.name, document = EXCLUDED.document'
+    ),
+}
+
+
+def property_values(properties):
+    values = []
+    for prop in properties or []:
+        if not isinstance(prop, dict):
+            continue
+        value = prop.get('value')
+        if isinstance(value, (list, tuple)):
+            values.extend(str(v) for v in value)
+        elif value is not None:
+            values.append(str(value))
+    return ' '.join(values)
+
+
+def index_rows(vendor, products):
+    if vendor == 'postgresql':
+        return [
+            (p.id, p.name, p.name, p.description, property_values(p.properties))
+            for p in products
+        ]
+    return [(p.id, p.name, p.description, property_values(p.properties)) for p in products]
+
+
+def create_search_index(apps, schema_editor):
+    connection = schema_editor.connection
+    # Other databases search with icontains, without an index
+    if connection.vendor not in CREATE_INDEX:
+        return
+    with connection.cursor() as cursor:
+        for sql in CREATE_INDEX[connection.vendor]:
+            cursor.execute(sql)
+
+    Product = apps.get_model('api', 'Product')
+    products = Product.objects.using(connection.alias).order_by('id')
+    batch = []
+    for product in products.iterator(chunk_size=1000):
+        batch.append(product)
+        if len(batch) == 1000:
+            index_products(connection, batch)
+            batch = []
+    index_products(connection, batch)
+
+
+def index_products(connection, products):
+    if not products:
+        return
+    with connection.cursor() as cursor:
+        cursor.executemany(INDEX_PRODUCTS[connection.vendor], index_rows(connection.vendor, products))
+
+
+def drop_search_index(apps, schema_editor):
+    connection = schema_editor.connection
+    if connection.vendor in CREATE_INDEX:
+        with connection.cursor() as cursor:
+            cursor.execute(f'DROP TABLE IF EXISTS {SEARCH_TABLE}')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_search_index, drop_search_index),
+    ]
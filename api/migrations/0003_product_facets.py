@@ -0,0 +1,68 @@
+# Generated by Django 4.2.3 on 2026-10-18 07:09
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+# Copied from api.models at the time, so later changes there don't change
+# what this migration does
+FACET_MAX_LENGTH = 255
+
+
+def property_pairs(properties):
+    # properties -- [{"name": "color", "value": "Red"}], as (name, value) pairs
+    pairs = set()
+    for prop in properties or []:
+        if not isinstance(prop, dict) or not prop.get('name'):
+            continue
+        value = prop.get('value')
+        values = value if isinstance(value, (list, tuple)) else [value]
+        for value in values:
+            if value is None or value == '':
+                continue
+            pairs.add((
+                str(prop['name']).strip()[:FACET_MAX_LENGTH],
+                str(value).strip()[:FACET_MAX_LENGTH],
+            ))
+    return pairs
+
+
+def index_existing_products(apps, schema_editor):
+    Product = apps.get_model('api', 'Product')
+    ProductFacet = apps.get_model('api', 'ProductFacet')
+    db_alias = schema_editor.connection.alias
+    facets = [
+        ProductFacet(product_id=product_id, name=name, value=value)
+        for product_id, properties in Product.objects.using(db_alias).values_list('id', 'properties')
+        for name, value in property_pairs(properties)
+    ]
+    ProductFacet.objects.using(db_alias).bulk_create(facets, batch_size=1000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0002_product_search'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ProductFacet',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(max_length=255)),
+                ('value', models.CharField(max_length=255)),
+                ('product', models.ForeignKey(db_index=False, on_delete=django.db.models.deletion.CASCADE, related_name='facets', to='api.product')),
+            ],
+            options={
+                'verbose_name': 'Product Facet',
+                'verbose_name_plural': 'Product Facets',
+                'indexes': [models.Index(fields=['name', 'value', 'product'], name='product_facet_lookup')],
+            },
+        ),
+        migrations.AddConstraint(
+            model_name='productfacet',
+            constraint=models.UniqueConstraint(fields=('product', 'name', 'value'), name='unique_product_facet'),
+        ),
+        migrations.RunPython(index_existing_products, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,30 @@
+# Generated by Django 4.2.3 on 2026-10-18 07:20
+
+import api.models
+import api.storage
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0005_image_variants'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='category',
+            name='category_banner_image',
+            field=models.ImageField(storage=api.storage.ContentAddressedStorage(), upload_to='category/', verbose_name='Category Banner Image'),
+        ),
+        migrations.AlterField(
+            model_name='category',
+            name='category_thumbnail_image',
+            field=models.ImageField(blank=True, null=True, storage=api.storage.ContentAddressedStorage(), upload_to='category/', verbose_name='Category Thumbnail Image'),
+        ),
+        migrations.AlterField(
+            model_name='image',
+            name='image',
+            field=models.ImageField(storage=api.storage.ContentAddressedStorage(), upload_to=api.models.upload_file_to, verbose_name='Product image'),
+        ),
+    ]
@@ -0,0 +1,39 @@
+# Generated by Django 4.2.3 on 2026-10-18 07:25
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0006_content_addressed_storage'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='order',
+            name='unit_price',
+            field=models.BigIntegerField(default=0),
+        ),
+        migrations.CreateModel(
+            name='CustomerOrder',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('subtotal', models.BigIntegerField(default=0)),
+                ('shipping', models.BigIntegerField(default=0)),
+                ('total', models.BigIntegerField(default=0)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('customer', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='orders', to='api.shippingaddress')),
+            ],
+            options={
+                'verbose_name': 'Customer Order',
+                'verbose_name_plural': 'Customer Orders',
+            },
+        ),
+        migrations.AddField(
+            model_name='order',
+            name='order',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='lines', to='api.customerorder'),
+        ),
+    ]
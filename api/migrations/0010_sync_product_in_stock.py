@@ -0,0 +1,20 @@
+from django.db import migrations
+
+
+def sync_in_stock(apps, schema_editor):
+    # product_in_stock now always follows quantity_available; fix the rows
+    # where they drifted apart
+    Product = apps.get_model('api', 'Product')
+    Product.objects.filter(quantity_available__gt=0).update(product_in_stock=True)
+    Product.objects.filter(quantity_available__lte=0).update(product_in_stock=False)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0009_product_listing_indexes'),
+    ]
+
+    operations = [
+        migrations.RunPython(sync_in_stock, migrations.RunPython.noop),
+    ]
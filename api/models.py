@@ -1,15 +1,77 @@
-from django.db import models
+import copy
+from functools import partial
+
+from django.db import models, transaction
+from django.db.models import DEFERRED
+from django.db.models import Count, Prefetch, Q
+from django.core.exceptions import ObjectDoesNotExist
 from django.contrib.auth.models import User
-from django.db.models.signals import post_save, pre_save
+from django.db.models.signals import post_save, pre_save, post_delete
 from django.dispatch import receiver
+
+from .cache import invalidate
+from .images import schedule_variants, variant_urls
+from .search import get_search_backend
+from .storage import ContentAddressedStorage
 # Create your models here.
 
 
 def upload_file_to(instance, filename):
+    # Only the directory is kept: the storage names files after their content
     model = instance.album.__class__._meta
     name = model.verbose_name_plural.replace(" ", "_")
     return f'{name}/images/{filename}'
 
+
+# Uploaded images are stored once per distinct content
+content_storage = ContentAddressedStorage()
+
+
+# Longest property name/value kept in the facet index
+FACET_MAX_LENGTH = 255
+
+
+def property_pairs(properties):
+    # properties -- [{"name": "color", "value": "Red"}], as (name, value) pairs
+    pairs = set()
+    for prop in properties or []:
+        if not isinstance(prop, dict) or not prop.get('name'):
+            continue
+        value = prop.get('value')
+        values = value if isinstance(value, (list, tuple)) else [value]
+        for value in values:
+            if value is None or value == '':
+                continue
+            pairs.add((
+                str(prop['name']).strip()[:FACET_MAX_LENGTH],
+                str(value).strip()[:FACET_MAX_LENGTH],
+            ))
+    return pairs
+
+
+def snapshot(values):
+    # JSON values are copied so in-place edits still show up as changes
+    return {
+        name: copy.deepcopy(value) if isinstance(value, (dict, list)) else value
+        for name, value in values
+    }
+
+
+def schedule_stale_variants(instance, field_name, variants_field, using):
+    # (Re)builds the image variants once the row is committed, unless they
+    # already match the current file
+    name = getattr(instance, field_name).name
+    variants = getattr(instance, variants_field) or {}
+    if name and variants.get('source') != name:
+        transaction.on_commit(partial(
+            schedule_variants, instance._meta.label, instance.pk,
+            field_name, variants_field, name
+        ), using=using)
+
+
+# Number of products embedded in a category response when ?include=products
+CATEGORY_PRODUCTS_LIMIT = 10
+
 class Profile(models.Model):
     user = models.OneToOneField(
         User, 
@@ -32,8 +94,13 @@ def create_profile(sender, instance, created, **kwargs):
 
 
 @receiver(post_save, sender=User)
-def save_profile(sender, instance, **kwargs):
-    instance.user_profile.save()
+def save_profile(sender, instance, created, update_fields=None, **kwargs):
+    # Profile holds nothing derived from User, so partial saves such as the
+    # last_login update on every login have nothing to do. Full saves only
+    # backfill the profile of users created before profiles existed.
+    if created or update_fields is not None:
+        return
+    Profile.objects.get_or_create(user=instance)
 
     
 class ProductsProperties(models.Model):
@@ -57,6 +124,48 @@ class ProductsProperties(models.Model):
 
 
 
+# Columns the computed fields of CategorySerializer read
+CATEGORY_COMPUTED_FIELDS = {
+    'category_banner_image_variants': ['category_banner_image', 'banner_variants'],
+    'category_thumbnail_image_variants': ['category_thumbnail_image', 'thumbnail_variants'],
+    'products': ['name'],
+    'products_count': [],
+    'products_next': [],
+}
+CATEGORY_PRODUCTS_FIELDS = {'products', 'products_count', 'products_next'}
+
+
+class CategoryQuerySet(models.QuerySet):
+    def for_api(self, fields=None, with_products=False):
+        # Like ProductQuerySet.for_api(), with the embedded products
+        # (CategorySerializer's include_products) when asked for
+        queryset = self
+        if with_products:
+            queryset = queryset.with_products(
+                products=fields is None or bool(fields & {'products', 'products_next'}),
+                count=fields is None or bool(fields & {'products_count', 'products_next'}),
+            )
+        if fields is None:
+            return queryset
+        columns = {'id'}
+        for name in fields:
+            columns.update(CATEGORY_COMPUTED_FIELDS.get(name, [name]))
+        return queryset.only(*sorted(columns))
+
+    def with_products(self, limit=CATEGORY_PRODUCTS_LIMIT, products=True, count=True):
+        # A single sliced prefetch loads the first `limit` products of every
+        # category in the queryset, instead of one query per category.
+        # Either part can be left out when its fields aren't sent.
+        queryset = self
+        if count:
+            queryset = queryset.annotate(_products_count=Count('_products'))
+        if products:
+            embedded = Product.objects.order_by('id')[:limit]
+            queryset = queryset.prefetch_related(
+                Prefetch('_products', queryset=embedded, to_attr='embedded_products')
+            )
+        return queryset
+
 
 class Category(models.Model):
     name = models.CharField(
@@ -66,11 +175,13 @@ class Category(models.Model):
     )
     category_banner_image = models.ImageField(
         upload_to='category/', 
+        storage=content_storage,
         blank=False, null=False, 
         verbose_name="Category Banner Image"
     )
     category_thumbnail_image = models.ImageField(
         upload_to='category/', 
+        storage=content_storage,
         blank=True, null=True, 
         verbose_name="Category Thumbnail Image"
     )
@@ -80,12 +191,36 @@ class Category(models.Model):
     # process in a json string --- [{"name": "color", "value": ["Green", "Blue", "Red"]}]
 
     properties = models.JSONField(blank=True, null=True)
+    updated_at = models.DateTimeField(auto_now=True)
 
+    # Resized copies of the images, built by api/images.py
+    banner_variants = models.JSONField(blank=True, null=True, editable=False)
+    thumbnail_variants = models.JSONField(blank=True, null=True, editable=False)
+
+
+    objects = CategoryQuerySet.as_manager()
+
+    @property
+    def category_banner_image_variants(self):
+        return variant_urls(self.banner_variants, self.category_banner_image.name)
+
+    @property
+    def category_thumbnail_image_variants(self):
+        return variant_urls(self.thumbnail_variants, self.category_thumbnail_image.name)
+
+    @classmethod
+    def variants_built(cls, pk):
+        invalidate({f'category:{pk}'})
 
     @property
     def products(self):
-        products = self._products.all()
+        # Filled in by CategoryQuerySet.with_products(), otherwise only the
+        # first page of products is loaded.
+        products = getattr(self, 'embedded_products', None)
+        if products is None:
+            products = self._products.order_by('id')[:CATEGORY_PRODUCTS_LIMIT]
         products_list = [{
+            'id': product.id,
             'name': product.name,
             'category_details': {
                 'id': self.id,
@@ -104,6 +239,13 @@ class Category(models.Model):
         } for product in products]
         return products_list
 
+    @property
+    def products_count(self):
+        count = getattr(self, '_products_count', None)
+        if count is None:
+            count = self._products.count()
+        return count
+
     class Meta:
         verbose_name_plural = "Categories"
         verbose_name = "Category"
@@ -117,6 +259,7 @@ class Condition(models.Model):
         verbose_name="Condition Name", 
         blank=False, null=True
     )
+    updated_at = models.DateTimeField(auto_now=True)
 
     def __str__(self):
         return self.name
@@ -126,17 +269,53 @@ class Condition(models.Model):
         verbose_name = "Product Condition"
 
 
+# What the computed fields of ProductSerializer read: (columns, select_related, prefetch_related)
+PRODUCT_COMPUTED_FIELDS = {
+    'category_details': (['category', 'category__name'], ['category'], []),
+    'condition_details': (['condition', 'condition__name'], ['condition'], []),
+    'thumbnails': (['album__id'], ['album'], ['album__images']),
+    'thumbnail_variants': (['album__id'], ['album'], ['album__images']),
+}
+
+
+class ProductQuerySet(models.QuerySet):
+    def for_api(self, fields=None):
+        # Everything ProductSerializer touches (category_details, condition_details
+        # and thumbnails) is loaded up front, so a listing costs the same number
+        # of queries whatever its size. With `fields` (a sparse fieldset) only
+        # their columns are read, and only the joins and prefetches they need.
+        if fields is None:
+            return self.select_related(
+                'category', 'condition', 'album'
+            ).prefetch_related('album__images')
+
+        columns, joins, prefetches = {'id'}, set(), set()
+        for name in fields:
+            if name in PRODUCT_COMPUTED_FIELDS:
+                field_columns, field_joins, field_prefetches = PRODUCT_COMPUTED_FIELDS[name]
+                columns.update(field_columns)
+                joins.update(field_joins)
+                prefetches.update(field_prefetches)
+            else:
+                columns.add(name)
+        # select_related() without fields would follow every relation
+        queryset = self.select_related(*sorted(joins)) if joins else self
+        return queryset.prefetch_related(*sorted(prefetches)).only(*sorted(columns))
+
+
 class Product(models.Model):
     name = models.CharField(
         max_length=100, 
         verbose_name="Product Name", 
         blank=False, null=False
     )
+    # The category indexes in Meta already lead with category
     category = models.ForeignKey(
         Category, 
         related_name="_products", 
         on_delete=models.CASCADE, 
-        blank=False, null=False
+        blank=False, null=False,
+        db_index=False
     )
 
     condition = models.ForeignKey(
@@ -159,16 +338,86 @@ class Product(models.Model):
 
     # properties -- [{"name": "color", "value": "Red"}]
     properties = models.JSONField(blank=True, null=True)
+    updated_at = models.DateTimeField(auto_now=True, db_index=True)
+
+    objects = ProductQuerySet.as_manager()
 
     class Meta:
         verbose_name_plural = "Products"
         verbose_name = "Product"
+        indexes = [
+            # One per keyset ordering of the product list (see
+            # ProductPagination), with and without ?category=, so a page is
+            # read in index order instead of sorting every matching row
+            models.Index(fields=['price', 'id'], name='product_price'),
+            models.Index(fields=['ratings', 'id'], name='product_ratings'),
+            models.Index(fields=['category', 'id'], name='product_category'),
+            models.Index(fields=['category', 'price', 'id'], name='product_category_price'),
+            models.Index(fields=['category', 'ratings', 'id'], name='product_category_ratings'),
+        ]
+
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        # Column values as loaded, to tell what a later save() changed
+        instance._loaded_values = snapshot(zip(field_names, values))
+        return instance
+
+    def sync_in_stock(self):
+        # product_in_stock is never set on its own: it follows the stock level
+        self.product_in_stock = self.quantity_available > 0
+
+    def save(self, *args, **kwargs):
+        self.sync_in_stock()
+        update_fields = kwargs.get('update_fields')
+        if update_fields is not None and 'quantity_available' in update_fields:
+            update_fields = kwargs['update_fields'] = {*update_fields, 'product_in_stock'}
+        super().save(*args, **kwargs)
+        # What was just written becomes the new baseline
+        deferred = self.get_deferred_fields()
+        saved = snapshot(
+            (field.attname, getattr(self, field.attname))
+            for field in self._meta.concrete_fields
+            if field.attname not in deferred
+            and (update_fields is None or field.name in update_fields)
+        )
+        if update_fields is None:
+            self._loaded_values = saved
+        else:
+            self._loaded_values = {**getattr(self, '_loaded_values', {}), **saved}
+
+    def changed_fields(self, update_fields=None):
+        # Names of the fields that differ from the loaded values; everything
+        # counts as changed on an instance that was not loaded from the db.
+        loaded = getattr(self, '_loaded_values', None)
+        changed = set()
+        for field in self._meta.concrete_fields:
+            if update_fields is not None and field.name not in update_fields:
+                continue
+            value = DEFERRED if loaded is None else loaded.get(field.attname, DEFERRED)
+            if value is DEFERRED or value != getattr(self, field.attname):
+                changed.add(field.name)
+        return changed
 
     # Helper methods
     @property
     def thumbnails(self):
-        images_url_list = [album.image.url for album in self.album.images.all()]
+        # Reads from the prefetch cache when the product came from for_api()
+        try:
+            album = self.album
+        except ObjectDoesNotExist:
+            return []
+        images_url_list = [image.image.url for image in album.images.all()]
         return images_url_list
+
+    @property
+    def thumbnail_variants(self):
+        # Same order as thumbnails; None for images not resized yet
+        try:
+            album = self.album
+        except ObjectDoesNotExist:
+            return []
+        return [image.image_variants for image in album.images.all()]
     
     @property
     def condition_details(self):
@@ -210,8 +459,108 @@ def create_album(sender, created, instance, **kwargs):
         ImageAlbum.objects.create(product=instance, name=instance.name)
 
 @receiver(post_save, sender=Product)
-def save_album(sender, instance, **kwargs):
-    instance.album.save()
+def save_album(sender, instance, created, using, update_fields=None, **kwargs):
+    # The album only mirrors the product name
+    if created or 'name' not in instance.changed_fields(update_fields):
+        return
+    ImageAlbum.objects.using(using).filter(product=instance).update(name=instance.name)
+
+
+# Keep the full-text search index in step with the products table
+SEARCH_FIELDS = {'name', 'description', 'properties'}
+
+@receiver(post_save, sender=Product)
+def index_product(sender, instance, created, using, update_fields=None, **kwargs):
+    if created or instance.changed_fields(update_fields) & SEARCH_FIELDS:
+        get_search_backend(using).index([instance])
+
+@receiver(post_delete, sender=Product)
+def unindex_product(sender, instance, using, **kwargs):
+    get_search_backend(using).remove([instance.id])
+
+
+class ProductFacetQuerySet(models.QuerySet):
+    def sync(self, product):
+        # Only touches the rows whose (name, value) pair actually changed
+        wanted = property_pairs(product.properties)
+        existing = set(self.filter(product=product).values_list('name', 'value'))
+        stale = existing - wanted
+        if stale:
+            condition = Q()
+            for name, value in stale:
+                condition |= Q(name=name, value=value)
+            self.filter(condition, product=product).delete()
+        missing = wanted - existing
+        if missing:
+            self.bulk_create([
+                self.model(product=product, name=name, value=value)
+                for name, value in missing
+            ])
+
+
+class ProductFacet(models.Model):
+    # Normalized copy of Product.properties used for filtering and facet counts
+    # The unique constraint below already leads with product
+    product = models.ForeignKey(
+        Product,
+        related_name="facets",
+        on_delete=models.CASCADE,
+        db_index=False
+    )
+    name = models.CharField(max_length=FACET_MAX_LENGTH)
+    value = models.CharField(max_length=FACET_MAX_LENGTH)
+
+    objects = ProductFacetQuerySet.as_manager()
+
+    class Meta:
+        verbose_name_plural = "Product Facets"
+        verbose_name = "Product Facet"
+        constraints = [
+            models.UniqueConstraint(
+                fields=['product', 'name', 'value'], name='unique_product_facet'
+            ),
+        ]
+        indexes = [
+            models.Index(fields=['name', 'value', 'product'], name='product_facet_lookup'),
+        ]
+
+    def __str__(self) -> str:
+        return f"{self.name}: {self.value}"
+
+
+@receiver(post_save, sender=Product)
+def index_product_facets(sender, instance, created, update_fields=None, **kwargs):
+    if created or 'properties' in instance.changed_fields(update_fields):
+        ProductFacet.objects.sync(instance)
+
+
+# Cached API responses are keyed on namespace versions (see api/cache.py);
+# bumping a namespace invalidates every response built from it.
+@receiver([post_save, post_delete], sender=Product)
+def invalidate_product_cache(sender, instance, using, **kwargs):
+    namespaces = {
+        f'product:{instance.id}',
+        f'category:{instance.category_id}',
+        'product-list',
+    }
+    loaded_category_id = getattr(instance, '_loaded_values', {}).get('category_id')
+    if loaded_category_id is not None:
+        namespaces.add(f'category:{loaded_category_id}')
+    invalidate(namespaces, using)
+
+# Product responses embed their category and condition; those depend on the
+# shared 'catalog-meta' namespace instead of being bumped one product at a time
+@receiver([post_save, post_delete], sender=Category)
+def invalidate_category_cache(sender, instance, using, **kwargs):
+    invalidate({f'category:{instance.id}', 'catalog-meta', 'product-list'}, using)
+
+@receiver([post_save, post_delete], sender=Condition)
+def invalidate_condition_cache(sender, instance, using, **kwargs):
+    invalidate({'catalog-meta', 'product-list'}, using)
+
+@receiver([post_save, post_delete], sender=ImageAlbum)
+def invalidate_album_cache(sender, instance, using, **kwargs):
+    invalidate({f'product:{instance.product_id}', 'product-list'}, using)
 
 
 class Image(models.Model):
@@ -224,9 +573,14 @@ class Image(models.Model):
     )
     image = models.ImageField(
         upload_to=upload_file_to, 
+        storage=content_storage,
         blank=False, null=False, 
         verbose_name="Product image"
     )
+    updated_at = models.DateTimeField(auto_now=True)
+
+    # Resized copies of the image, built by api/images.py
+    variants = models.JSONField(blank=True, null=True, editable=False)
 
     class Meta:
         verbose_name_plural = "Images"
@@ -234,6 +588,40 @@ class Image(models.Model):
     def __str__(self) -> str:
         return self.name
 
+    @property
+    def image_variants(self):
+        return variant_urls(self.variants, self.image.name)
+
+    @classmethod
+    def variants_built(cls, pk):
+        album_id = cls.objects.filter(pk=pk).values_list('album_id', flat=True).first()
+        invalidate(image_cache_namespaces(album_id))
+
+
+def image_cache_namespaces(album_id, using=None):
+    product_id = ImageAlbum.objects.using(using).filter(
+        id=album_id
+    ).values_list('product_id', flat=True).first()
+    namespaces = {'product-list'}
+    if product_id is not None:
+        namespaces.add(f'product:{product_id}')
+    return namespaces
+
+@receiver([post_save, post_delete], sender=Image)
+def invalidate_image_cache(sender, instance, using, **kwargs):
+    invalidate(image_cache_namespaces(instance.album_id, using), using)
+
+
+# Image variants are built off the request thread (see api/images.py)
+@receiver(post_save, sender=Image)
+def build_image_variants(sender, instance, using, **kwargs):
+    schedule_stale_variants(instance, 'image', 'variants', using)
+
+@receiver(post_save, sender=Category)
+def build_category_variants(sender, instance, using, **kwargs):
+    schedule_stale_variants(instance, 'category_banner_image', 'banner_variants', using)
+    schedule_stale_variants(instance, 'category_thumbnail_image', 'thumbnail_variants', using)
+
 
 class ShippingAddress(models.Model):
     first_name = models.CharField(
@@ -281,6 +669,53 @@ class ShippingAddress(models.Model):
 
 
 
+class StockReservation(models.Model):
+    # Units of a product held for a cart in checkout until `expires_at`;
+    # expired rows no longer count and are deleted lazily or by the sweeper
+    product = models.ForeignKey(
+        Product,
+        related_name="reservations",
+        on_delete=models.CASCADE,
+        db_index=False
+    )
+    token = models.CharField(max_length=32)
+    quantity = models.IntegerField()
+    expires_at = models.DateTimeField()
+
+    class Meta:
+        verbose_name_plural = "Stock Reservations"
+        verbose_name = "Stock Reservation"
+        constraints = [
+            models.UniqueConstraint(fields=['token', 'product'], name='unique_reservation_line'),
+        ]
+        indexes = [
+            # Covers the per-product sum of active holds
+            models.Index(
+                fields=['product', 'expires_at', 'quantity'], name='reservation_availability'
+            ),
+            models.Index(fields=['expires_at'], name='reservation_expiry'),
+        ]
+
+    def __str__(self) -> str:
+        return f"{self.quantity} x {self.product_id} until {self.expires_at}"
+
+
+class CustomerOrder(models.Model):
+    # A placed cart; its products are the Order rows in `lines`
+    customer = models.ForeignKey(ShippingAddress, related_name="orders", on_delete=models.CASCADE)
+    subtotal = models.BigIntegerField(default=0)
+    shipping = models.BigIntegerField(default=0)
+    total = models.BigIntegerField(default=0)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        verbose_name_plural = "Customer Orders"
+        verbose_name = "Customer Order"
+
+    def __str__(self) -> str:
+        return f"Order #{self.id} by {self.customer.first_name} {self.customer.last_name}"
+
+
 class Order(models.Model):
     product = models.ForeignKey(
         Product, 
@@ -289,6 +724,14 @@ class Order(models.Model):
     )
     quantity = models.IntegerField()
     customer = models.ForeignKey(ShippingAddress, on_delete=models.CASCADE)
+    order = models.ForeignKey(
+        CustomerOrder,
+        related_name="lines",
+        on_delete=models.CASCADE,
+        blank=True, null=True
+    )
+    # Price charged per unit when the order was placed
+    unit_price = models.BigIntegerField(default=0)
 
     class Meta:
         verbose_name_plural = "Orders"
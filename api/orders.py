@@ -0,0 +1,98 @@
+from django.db import transaction
+from django.db.models import Case, F, Value, When, prefetch_related_objects
+from django.utils import timezone
+
+from .cache import invalidate
+from .cart import price_cart
+from .models import CustomerOrder, Order, Product, ShippingAddress, StockReservation
+from .reservations import OutOfStock, held_quantity, unavailable_lines
+from .sqlite import retry_if_locked
+
+
+def take_stock(product_id, quantity, now, token=None):
+    """
+    Takes `quantity` units of a product in a single conditional UPDATE, so
+    concurrent orders can't both take the last units. Units held by other
+    carts' reservations are not for sale. Only the stock level decides;
+    product_in_stock is rewritten from it in the same statement.
+    Returns False when there is not enough stock.
+    """
+    # product_in_stock comes first: MySQL evaluates SET clauses left to
+    # right against the already updated values
+    return Product.objects.filter(
+        id=product_id,
+        quantity_available__gte=Value(quantity) + held_quantity(token, now),
+    ).update(
+        product_in_stock=Case(
+            When(quantity_available__gt=quantity, then=Value(True)), default=Value(False)
+        ),
+        quantity_available=F('quantity_available') - quantity,
+        # update() skips auto_now, and the stock change must show in ETags
+        updated_at=now,
+    ) == 1
+
+
+def create_order(cart, address):
+    priced = price_cart(cart)
+    customer = ShippingAddress.objects.create(**address)
+    order = CustomerOrder.objects.create(
+        customer=customer,
+        subtotal=priced['subtotal'],
+        shipping=priced['shipping'],
+        total=priced['total'],
+    )
+    Order.objects.bulk_create([
+        Order(
+            order=order,
+            customer=customer,
+            product_id=line['id'],
+            quantity=line['quantity'],
+            unit_price=line['unit_price'],
+        )
+        for line in priced['lines']
+    ])
+    order.priced = priced
+    # Loaded while the transaction holds the write lock: once the order is
+    # committed, the response must not depend on a read that can still fail
+    prefetch_related_objects([order], 'lines')
+    return order
+
+
+@retry_if_locked
+def place_order(cart, address, token=None):
+    """
+    Places a parsed cart ({product_id: quantity}, see api/cart.py) for the
+    validated shipping `address` in one transaction, turning the holds of
+    the reservation `token` (see api/reservations.py) into the order.
+
+    Stock rows are updated in ascending id order, so two orders sharing
+    products always lock them in the same order and can't deadlock. If any
+    line is short the whole order is rolled back and OutOfStock lists every
+    short line.
+    """
+    product_ids = sorted(cart)
+    with transaction.atomic():
+        now = timezone.now()
+        short = [
+            product_id for product_id in product_ids
+            if not take_stock(product_id, cart[product_id], now, token)
+        ]
+        if short:
+            # Gives back the stock of the lines already taken
+            transaction.set_rollback(True)
+        else:
+            order = create_order(cart, address)
+            if token:
+                StockReservation.objects.filter(token=token).delete()
+            category_ids = Product.objects.filter(id__in=product_ids).values_list(
+                'category_id', flat=True
+            ).distinct()
+            invalidate(
+                {'product-list'}
+                | {f'product:{id}' for id in product_ids}
+                | {f'category:{id}' for id in category_ids}
+            )
+    if short:
+        # Read after the rollback: what is actually left now
+        raise OutOfStock(unavailable_lines(cart, short, token))
+    return order
@@ -0,0 +1,214 @@
+import json
+import math
+from base64 import urlsafe_b64decode, urlsafe_b64encode
+
+from asgiref.sync import sync_to_async
+from django.db.models import Q
+from rest_framework.exceptions import NotFound
+from rest_framework.pagination import BasePagination, _positive_int
+from rest_framework.response import Response
+from rest_framework.utils.urls import remove_query_param, replace_query_param
+
+from .search import get_search_backend
+
+
+# Every sort key is a database integer
+KEY_MIN, KEY_MAX = -2 ** 63, 2 ** 63 - 1
+
+
+def encode_cursor(position, reverse=False):
+    payload = {'p': list(position)}
+    if reverse:
+        payload['r'] = 1
+    data = json.dumps(payload, separators=(',', ':')).encode('ascii')
+    return urlsafe_b64encode(data).decode('ascii').rstrip('=')
+
+
+def decode_cursor(cursor):
+    padded = cursor + '=' * (-len(cursor) % 4)
+    payload = json.loads(urlsafe_b64decode(padded.encode('ascii')))
+    return payload['p'], bool(payload.get('r'))
+
+
+class KeysetPagination(BasePagination):
+    """
+    Keyset (seek) pagination behind an opaque cursor.
+
+    Pages are fetched with a `WHERE (sort_key, id) > (last_sort_key, last_id)`
+    condition instead of an OFFSET, so the hundredth page costs the same as
+    the first one.
+    """
+    page_size = 24
+    max_page_size = 100
+    page_size_query_param = 'page_size'
+    cursor_query_param = 'cursor'
+    ordering_query_param = 'ordering'
+    # Fields clients may sort by; `id` is always appended as the tie breaker
+    ordering_fields = ('id',)
+    invalid_cursor_message = 'Invalid cursor'
+
+    def paginate_queryset(self, queryset, request, view=None):
+        queryset, position = self.page_queryset(queryset, request)
+        return self.set_page(list(queryset), position)
+
+    async def apaginate_queryset(self, queryset, request, view=None):
+        queryset, position = self.page_queryset(queryset, request)
+        return self.set_page([row async for row in queryset], position)
+
+    def page_queryset(self, queryset, request):
+        # The (page_size + 1) rows after the cursor, to tell if there is more
+        self.request = request
+        self.base_url = request.build_absolute_uri()
+        self.page_size = self.get_page_size(request)
+        self.key_fields, self.descending = self.get_ordering(request)
+        position, self.reverse = self.get_cursor(request)
+
+        # Walking backwards flips the ordering and the comparison
+        descending = self.descending != self.reverse
+        queryset = queryset.order_by(*[
+            f'-{field}' if descending else field for field in self.key_fields
+        ])
+        if position is not None:
+            queryset = queryset.filter(self.keyset_filter(position, descending))
+        return queryset[:self.page_size + 1], position
+
+    def set_page(self, results, position):
+        has_more = len(results) > self.page_size
+        results = results[:self.page_size]
+
+        if self.reverse:
+            results.reverse()
+            self.has_next = True
+            self.has_previous = has_more
+        else:
+            self.has_next = has_more
+            self.has_previous = position is not None
+
+        self.page = results
+        return results
+
+    def get_paginated_response(self, data):
+        return Response({
+            'next': self.get_next_link(),
+            'previous': self.get_previous_link(),
+            'results': data,
+        })
+
+    def get_page_size(self, request):
+        try:
+            return _positive_int(
+                request.query_params[self.page_size_query_param],
+                strict=True,
+                cutoff=self.max_page_size
+            )
+        except (KeyError, ValueError):
+            return self.page_size
+
+    def get_ordering(self, request):
+        ordering = request.query_params.get(self.ordering_query_param, 'id')
+        descending = ordering.startswith('-')
+        field = ordering.lstrip('-')
+        if field not in self.ordering_fields:
+            field, descending = 'id', False
+        key_fields = (field,) if field == 'id' else (field, 'id')
+        return key_fields, descending
+
+    def get_cursor(self, request):
+        cursor = request.query_params.get(self.cursor_query_param)
+        if not cursor:
+            return None, False
+        try:
+            position, reverse = decode_cursor(cursor)
+        except (TypeError, ValueError, KeyError):
+            raise NotFound(self.invalid_cursor_message)
+        if not isinstance(position, list) or len(position) != len(self.key_fields):
+            raise NotFound(self.invalid_cursor_message)
+        # Cursors come from clients: their values go into the query as is
+        if not all(self.valid_key(field, value) for field, value in zip(self.key_fields, position)):
+            raise NotFound(self.invalid_cursor_message)
+        return position, reverse
+
+    def valid_key(self, field, value):
+        return isinstance(value, int) and not isinstance(value, bool) and KEY_MIN <= value <= KEY_MAX
+
+    def keyset_filter(self, position, descending):
+        # (a, b) > (x, y)  <=>  a > x OR (a = x AND b > y)
+        lookup = 'lt' if descending else 'gt'
+        condition = Q()
+        equal = {}
+        for field, value in zip(self.key_fields, position):
+            condition |= Q(**equal, **{f'{field}__{lookup}': value})
+            equal[field] = value
+        return condition
+
+    def get_position(self, instance):
+        return [getattr(instance, field) for field in self.key_fields]
+
+    def get_next_link(self):
+        if not self.has_next or not self.page:
+            return None
+        cursor = encode_cursor(self.get_position(self.page[-1]))
+        return replace_query_param(self.base_url, self.cursor_query_param, cursor)
+
+    def get_previous_link(self):
+        if not self.has_previous:
+            return None
+        if not self.page:
+            return remove_query_param(self.base_url, self.cursor_query_param)
+        cursor = encode_cursor(self.get_position(self.page[0]), reverse=True)
+        return replace_query_param(self.base_url, self.cursor_query_param, cursor)
+
+
+class ProductPagination(KeysetPagination):
+    ordering_fields = ('id', 'price', 'ratings')
+
+
+class SearchPagination(KeysetPagination):
+    """
+    Pages through full-text search results by relevance, seeking on the
+    `(score, id)` pairs returned by the search backend.
+    """
+
+    def __init__(self, term):
+        self.term = term
+
+    def get_ordering(self, request):
+        return ('score', 'id'), False
+
+    def valid_key(self, field, value):
+        if field == 'score':
+            return isinstance(value, (int, float)) and not isinstance(value, bool) and math.isfinite(value)
+        return super().valid_key(field, value)
+
+    async def apaginate_queryset(self, queryset, request, view=None):
+        # The search backends only run raw SQL through the sync connection
+        return await sync_to_async(self.paginate_queryset)(queryset, request, view)
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.request = request
+        self.base_url = request.build_absolute_uri()
+        self.page_size = self.get_page_size(request)
+        self.key_fields, self.descending = self.get_ordering(request)
+        position, self.reverse = self.get_cursor(request)
+
+        rows = get_search_backend(queryset.db).search(
+            self.term, queryset,
+            after=position, reverse=self.reverse, limit=self.page_size + 1
+        )
+        has_more = len(rows) > self.page_size
+        rows = rows[:self.page_size]
+        if self.reverse:
+            rows.reverse()
+            self.has_next = True
+            self.has_previous = has_more
+        else:
+            self.has_next = has_more
+            self.has_previous = position is not None
+
+        products = queryset.in_bulk([product_id for _, product_id in rows])
+        self.positions = {product_id: [score, product_id] for score, product_id in rows}
+        self.page = [products[product_id] for _, product_id in rows if product_id in products]
+        return self.page
+
+    def get_position(self, instance):
+        return self.positions[instance.id]
@@ -0,0 +1,38 @@
+import io
+
+from django.conf import settings
+from rest_framework import parsers
+from rest_framework.exceptions import ParseError
+
+from .renderers import JSONRenderer, orjson
+
+# orjson reads integers over 64 bits as floats, losing digits. Such numbers
+# are found as runs of 19 digits in the body with every digit mapped to '0'
+# (much faster than a regex).
+DIGITS_AS_ZEROS = bytes(b'0'[0] if byte in b'0123456789' else b' '[0] for byte in range(256))
+LONG_NUMBER = b'0' * 19
+
+
+class JSONParser(parsers.JSONParser):
+    """
+    DRF's JSONParser, decoding with orjson when it's installed. Bodies that
+    aren't UTF-8 or hold numbers too long for orjson to read exactly are
+    left to the stdlib parser.
+    """
+
+    renderer_class = JSONRenderer
+
+    def parse(self, stream, media_type=None, parser_context=None):
+        parser_context = parser_context or {}
+        encoding = parser_context.get('encoding', settings.DEFAULT_CHARSET)
+        if orjson is None or not self.strict or encoding.lower().replace('-', '') != 'utf8':
+            return super().parse(stream, media_type, parser_context)
+
+        body = stream.read()
+        if LONG_NUMBER in body.translate(DIGITS_AS_ZEROS):
+            return super().parse(io.BytesIO(body), media_type, parser_context)
+        try:
+            return orjson.loads(body)
+        except orjson.JSONDecodeError as exc:
+            raise ParseError('JSON parse error - %s' % str(exc))
+
@@ -0,0 +1,68 @@
+import math
+from decimal import Decimal
+
+from rest_framework import renderers
+
+from .timing import TimedRendererMixin
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+
+def has_non_finite(data):
+    # NaN and infinities, which orjson writes as null
+    stack = [data]
+    while stack:
+        value = stack.pop()
+        if isinstance(value, dict):
+            stack.extend(value.values())
+        elif isinstance(value, (list, tuple)):
+            stack.extend(value)
+        elif isinstance(value, float):
+            if not math.isfinite(value):
+                return True
+        elif isinstance(value, Decimal) and not value.is_finite():
+            return True
+    return False
+
+
+class FastJSONRenderer(renderers.JSONRenderer):
+    """
+    DRF's JSONRenderer, encoding with orjson when it's installed: several
+    times faster on big product lists, with the same output. Datetimes and
+    other types orjson would format its own way go through DRF's encoder,
+    like the types it doesn't know (Decimal, lazy strings). Anything orjson
+    can't do (indented output, ASCII-only output, integers over 64 bits,
+    dict keys other than strings, NaN and infinities) is left to the stdlib
+    renderer, which rejects non-finite numbers under STRICT_JSON.
+    """
+
+    options = orjson.OPT_PASSTHROUGH_DATETIME if orjson else 0
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if orjson is None or data is None or self.ensure_ascii or not self.compact:
+            return super().render(data, accepted_media_type, renderer_context)
+        if self.get_indent(accepted_media_type, renderer_context or {}) is not None:
+            return super().render(data, accepted_media_type, renderer_context)
+        try:
+            ret = orjson.dumps(data, default=self.encoder_class().default, option=self.options)
+        except orjson.JSONEncodeError:
+            return super().render(data, accepted_media_type, renderer_context)
+        # Only bodies with a null can hold one, which spares most of them the walk
+        if b'null' in ret and has_non_finite(data):
+            return super().render(data, accepted_media_type, renderer_context)
+        # Escaped like DRF does, to stay a strict javascript subset. Looking
+        # for their first byte alone is much faster on ASCII bodies.
+        if b'\xe2' in ret:
+            ret = ret.replace(b'\xe2\x80\xa8', b'\\u2028').replace(b'\xe2\x80\xa9', b'\\u2029')
+        return ret
+
+
+class JSONRenderer(TimedRendererMixin, FastJSONRenderer):
+    pass
+
+
+class BrowsableAPIRenderer(TimedRendererMixin, renderers.BrowsableAPIRenderer):
+    pass
@@ -0,0 +1,135 @@
+import glob
+import json
+import time
+import urllib.request
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from urllib.error import HTTPError, URLError
+
+from django.urls import Resolver404, resolve
+
+
+SAFE_METHODS = ('GET', 'HEAD', 'OPTIONS')
+
+
+def trace_paths(patterns):
+    """
+    The files matching `patterns`, in order: plain paths, globs, or the
+    REQUEST_TRACE_FILE setting, whose '{pid}' matches every worker's file.
+    A glob that matches nothing is an error, like a missing file.
+    """
+    paths = []
+    for pattern in patterns:
+        pattern = pattern.replace('{pid}', '*')
+        if not any(char in pattern for char in '*?['):
+            matches = [pattern]
+        else:
+            matches = sorted(glob.glob(pattern))
+            if not matches:
+                raise FileNotFoundError(f"No trace files match {pattern}")
+        paths.extend(path for path in matches if path not in paths)
+    return paths
+
+
+def load_trace(paths):
+    # Records of every trace file (api/tracing.py), oldest first
+    records = []
+    for path in paths:
+        with open(path, encoding='utf-8') as trace:
+            records.extend(json.loads(line) for line in trace if line.strip())
+    records.sort(key=lambda record: record['ts'])
+    return records
+
+
+def replayable(record):
+    # A body that was only hashed can't be sent again
+    return record.get('body_sha256') is None or 'body' in record
+
+
+def route_name(record):
+    try:
+        name = resolve(record['path']).url_name or record['path']
+    except Resolver404:
+        name = record['path']
+    return f"{record['method']} {name}"
+
+
+def send(base_url, record, timeout):
+    url = base_url + record['path']
+    if record.get('query'):
+        url += '?' + record['query']
+    headers = {'Accept': 'application/json'}
+    data = None
+    if 'body' in record:
+        data = record['body'].encode('utf-8')
+        headers['Content-Type'] = record['content_type']
+    request = urllib.request.Request(url, data=data, method=record['method'], headers=headers)
+
+    started = time.perf_counter()
+    try:
+        with urllib.request.urlopen(request, timeout=timeout) as response:
+            response.read()
+            status = response.status
+    except HTTPError as error:
+        error.read()
+        status = error.code
+    except (URLError, OSError):
+        status = None
+    return status, time.perf_counter() - started
+
+
+def replay(records, base_url, rate=1.0, concurrency=16, timeout=30):
+    """
+    Sends `records` to `base_url`, spaced as recorded and sped up `rate`
+    times (0 sends them back to back). Returns [(record, status, seconds)].
+    """
+    if not records:
+        return []
+    first = datetime.fromisoformat(records[0]['ts'])
+    started = time.monotonic()
+    with ThreadPoolExecutor(concurrency) as pool:
+        futures = []
+        for record in records:
+            if rate:
+                offset = (datetime.fromisoformat(record['ts']) - first).total_seconds()
+                delay = started + offset / rate - time.monotonic()
+                if delay > 0:
+                    time.sleep(delay)
+            futures.append((record, pool.submit(send, base_url, record, timeout)))
+        return [(record, *future.result()) for record, future in futures]
+
+
+def percentile(values, fraction):
+    values = sorted(values)
+    return values[min(int(len(values) * fraction), len(values) - 1)]
+
+
+def summarize(results):
+    """
+    Recorded against replayed latency (ms) per route, with the replies whose
+    status differs from the recorded one.
+    """
+    routes = defaultdict(lambda: {'recorded': [], 'replayed': [], 'mismatches': 0, 'errors': 0})
+    for record, status, seconds in results:
+        route = routes[route_name(record)]
+        route['recorded'].append(record['duration_ms'])
+        route['replayed'].append(seconds * 1000)
+        if status is None:
+            route['errors'] += 1
+        elif status != record['status']:
+            route['mismatches'] += 1
+
+    summary = {}
+    for name, route in sorted(routes.items()):
+        row = {'count': len(route['recorded'])}
+        for fraction, label in ((0.50, 'p50'), (0.95, 'p95')):
+            recorded = percentile(route['recorded'], fraction)
+            replayed = percentile(route['replayed'], fraction)
+            row[f'recorded_{label}_ms'] = round(recorded, 3)
+            row[f'replayed_{label}_ms'] = round(replayed, 3)
+            row[f'{label}_change'] = round((replayed - recorded) / recorded * 100, 1) if recorded else None
+        row['status_mismatches'] = route['mismatches']
+        row['errors'] = route['errors']
+        summary[name] = row
+    return summary
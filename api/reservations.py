@@ -0,0 +1,116 @@
+import uuid
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import OuterRef, Q, Subquery, Sum, Value
+from django.db.models.functions import Coalesce
+from django.utils import timezone
+
+from .models import Product, StockReservation
+from .sqlite import lock_for_write, retry_if_locked
+
+
+# Expired holds deleted per statement by the sweeper
+SWEEP_BATCH_SIZE = 1000
+
+
+class OutOfStock(Exception):
+    def __init__(self, unavailable):
+        super().__init__(unavailable)
+        # [{"id": 1, "requested": 2, "available": 1}], available 0 for
+        # products that don't exist
+        self.unavailable = unavailable
+
+
+def new_token():
+    return uuid.uuid4().hex
+
+
+def held_quantity(token=None, now=None):
+    """
+    Units of the outer Product held by active reservations, except those of
+    `token`. A correlated SUM over the (product, expires_at, quantity)
+    index, so it never touches the products or orders tables.
+    """
+    holds = StockReservation.objects.filter(
+        product=OuterRef('pk'), expires_at__gt=now or timezone.now()
+    )
+    if token:
+        holds = holds.exclude(token=token)
+    total = holds.order_by().values('product').annotate(total=Sum('quantity')).values('total')
+    return Coalesce(Subquery(total), Value(0))
+
+
+def available_to_sell(product_ids, token=None):
+    # {product_id: units a cart holding `token` can still buy}
+    rows = Product.objects.filter(id__in=product_ids).annotate(
+        held=held_quantity(token)
+    ).values_list('id', 'quantity_available', 'held')
+    return {id: max(quantity - held, 0) for id, quantity, held in rows}
+
+
+def unavailable_lines(cart, product_ids, token=None):
+    stock = available_to_sell(product_ids, token)
+    return [
+        {'id': id, 'requested': cart[id], 'available': stock.get(id, 0)}
+        for id in product_ids
+    ]
+
+
+@retry_if_locked
+def reserve(cart, token=None):
+    """
+    Holds every line of a parsed cart ({product_id: quantity}) for
+    RESERVATION_TTL seconds, replacing the previous holds of `token` (a new
+    token is made when None). All or nothing: OutOfStock when any line is
+    short. Returns (token, expires_at).
+    """
+    token = token or new_token()
+    now = timezone.now()
+    expires_at = now + timedelta(seconds=settings.RESERVATION_TTL)
+    product_ids = sorted(cart)
+    with transaction.atomic():
+        # Row locks in id order, as in place_order(); SQLite has a single
+        # writer and ignores them, so it takes its write lock before reading
+        lock_for_write(StockReservation)
+        locked = Product.objects.select_for_update().filter(id__in=product_ids).order_by('id')
+        list(locked.values_list('id', flat=True))
+
+        stock = available_to_sell(product_ids, token)
+        short = [id for id in product_ids if stock.get(id, 0) < cart[id]]
+        if short:
+            raise OutOfStock([
+                {'id': id, 'requested': cart[id], 'available': stock.get(id, 0)}
+                for id in short
+            ])
+
+        # Expired holds of these products are released on the way
+        StockReservation.objects.filter(
+            Q(token=token) | Q(product_id__in=product_ids, expires_at__lte=now)
+        ).delete()
+        StockReservation.objects.bulk_create([
+            StockReservation(
+                token=token, product_id=id, quantity=cart[id], expires_at=expires_at
+            )
+            for id in product_ids
+        ])
+    return token, expires_at
+
+
+@retry_if_locked
+def release(token):
+    return StockReservation.objects.filter(token=token).delete()[0]
+
+
+def sweep(batch_size=SWEEP_BATCH_SIZE):
+    # Deletes expired holds in short batches so writers are never blocked long
+    now = timezone.now()
+    released = 0
+    while True:
+        ids = list(StockReservation.objects.filter(
+            expires_at__lte=now
+        ).values_list('id', flat=True)[:batch_size])
+        if not ids:
+            return released
+        released += StockReservation.objects.filter(id__in=ids).delete()[0]
@@ -0,0 +1,232 @@
+import re
+
+from django.db import connections, DEFAULT_DB_ALIAS
+from django.db.models import Q
+
+
+SEARCH_TABLE = 'api_product_search'
+
+WORD_RE = re.compile(r'\w+', re.UNICODE)
+
+
+def property_values(properties):
+    # properties -- [{"name": "color", "value": "Red"}], values may also be lists
+    values = []
+    for prop in properties or []:
+        if not isinstance(prop, dict):
+            continue
+        value = prop.get('value')
+        if isinstance(value, (list, tuple)):
+            values.extend(str(v) for v in value)
+        elif value is not None:
+            values.append(str(value))
+    return ' '.join(values)
+
+
+class SearchBackend:
+    """
+    Fallback backend for databases without a full-text index.
+
+    Every backend exposes the same interface: `create_index`/`drop_index`
+    for migrations, `index`/`remove`/`clear` to keep the index in sync, and
+    `search` returning `(score, product_id)` rows ordered best match first
+    (lowest score first), keyset-paginated on `(score, product_id)`.
+    """
+
+    def __init__(self, connection):
+        self.connection = connection
+
+    def create_index(self):
+        pass
+
+    def drop_index(self):
+        pass
+
+    def index(self, products):
+        pass
+
+    def remove(self, product_ids):
+        pass
+
+    def clear(self):
+        pass
+
+    def search(self, term, queryset, after=None, reverse=False, limit=24):
+        products = queryset.filter(
+            Q(name__icontains=term) | Q(description__icontains=term)
+        )
+        if after is not None:
+            products = products.filter(id__lt=after[1]) if reverse else products.filter(id__gt=after[1])
+        ids = products.order_by('-id' if reverse else 'id').values_list('id', flat=True)
+        return [(0.0, product_id) for product_id in ids[:limit]]
+
+    def restrict_sql(self, column, queryset):
+        # Limits the search to the rows of an already filtered product queryset
+        if not queryset.query.has_filters():
+            return '', []
+        sql, params = queryset.order_by().values('id').query.sql_with_params()
+        return f' AND {column} IN ({sql})', list(params)
+
+    def keyset_sql(self, after, reverse):
+        if after is None:
+            return '', []
+        op = '<' if reverse else '>'
+        score, product_id = after
+        return (
+            f' WHERE (score {op} %s OR (score = %s AND product_id {op} %s))',
+            [score, score, product_id],
+        )
+
+    def ranked_search(self, inner_sql, params, after, reverse, limit):
+        keyset, keyset_params = self.keyset_sql(after, reverse)
+        direction = 'DESC' if reverse else 'ASC'
+        sql = (
+            f'SELECT score, product_id FROM ({inner_sql}) ranked{keyset} '
+            f'ORDER BY score {direction}, product_id {direction} LIMIT %s'
+        )
+        with self.connection.cursor() as cursor:
+            cursor.execute(sql, params + keyset_params + [limit])
+            return [(float(score), product_id) for score, product_id in cursor.fetchall()]
+
+
+class SQLiteSearchBackend(SearchBackend):
+    # Column weights for bm25(): a hit in the name counts the most
+    weights = (10.0, 2.0, 1.0)
+
+    def create_index(self):
+        with self.connection.cursor() as cursor:
+            cursor.execute(
+                f'CREATE VIRTUAL TABLE IF NOT EXISTS {SEARCH_TABLE} USING fts5('
+                f"name, description, properties, tokenize='porter unicode61')"
+            )
+
+    def drop_index(self):
+        with self.connection.cursor() as cursor:
+            cursor.execute(f'DROP TABLE IF EXISTS {SEARCH_TABLE}')
+
+    def index(self, products):
+        rows = [
+            (p.id, p.name, p.description, property_values(p.properties))
+            for p in products
+        ]
+        if not rows:
+            return
+        with self.connection.cursor() as cursor:
+            cursor.executemany(
+                f'INSERT OR REPLACE INTO {SEARCH_TABLE}(rowid, name, description, properties) '
+                f'VALUES (%s, %s, %s, %s)',
+                rows
+            )
+
+    def remove(self, product_ids):
+        with self.connection.cursor() as cursor:
+            cursor.executemany(
+                f'DELETE FROM {SEARCH_TABLE} WHERE rowid = %s',
+                [(product_id,) for product_id in product_ids]
+            )
+
+    def clear(self):
+        with self.connection.cursor() as cursor:
+            cursor.execute(f'DELETE FROM {SEARCH_TABLE}')
+
+    def match_query(self, term):
+        # Quote every word so user input can't inject FTS5 query syntax,
+        # and prefix-match them so "iph" finds "iphone".
+        return ' '.join(f'"{word}"*' for word in WORD_RE.findall(term))
+
+    def search(self, term, queryset, after=None, reverse=False, limit=24):
+        match = self.match_query(term)
+        if not match:
+            return []
+        weights = ', '.join(str(weight) for weight in self.weights)
+        restrict, restrict_params = self.restrict_sql('rowid', queryset)
+        inner_sql = (
+            f'SELECT rowid AS product_id, bm25({SEARCH_TABLE}, {weights}) AS score '
+            f'FROM {SEARCH_TABLE} WHERE {SEARCH_TABLE} MATCH %s{restrict}'
+        )
+        return self.ranked_search(inner_sql, [match] + restrict_params, after, reverse, limit)
+
+
+class PostgresSearchBackend(SearchBackend):
+    config = 'english'
+
+    def create_index(self):
+        with self.connection.cursor() as cursor:
+            cursor.execute('CREATE EXTENSION IF NOT EXISTS pg_trgm')
+            cursor.execute(
+                f'CREATE TABLE IF NOT EXISTS {SEARCH_TABLE} ('
+                f'product_id bigint PRIMARY KEY REFERENCES api_product(id) '
+                f'ON DELETE CASCADE DEFERRABLE INITIALLY DEFERRED, '
+                f'name text NOT NULL, '
+                f'document tsvector NOT NULL)'
+            )
+            cursor.execute(
+                f'CREATE INDEX IF NOT EXISTS {SEARCH_TABLE}_document '
+                f'ON {SEARCH_TABLE} USING gin (document)'
+            )
+            cursor.execute(
+                f'CREATE INDEX IF NOT EXISTS {SEARCH_TABLE}_name_trgm '
+                f'ON {SEARCH_TABLE} USING gin (name gin_trgm_ops)'
+            )
+
+    def drop_index(self):
+        with self.connection.cursor() as cursor:
+            cursor.execute(f'DROP TABLE IF EXISTS {SEARCH_TABLE}')
+
+    def index(self, products):
+        rows = [
+            (p.id, p.name, p.name, p.description, property_values(p.properties))
+            for p in products
+        ]
+        if not rows:
+            return
+        config = self.config
+        with self.connection.cursor() as cursor:
+            cursor.executemany(
+                f'INSERT INTO {SEARCH_TABLE}(product_id, name, document) VALUES (%s, %s, '
+                f"setweight(to_tsvector('{config}', %s), 'A') || "
+                f"setweight(to_tsvector('{config}', %s), 'B') || "
+                f"setweight(to_tsvector('{config}', %s), 'C')) "
+                f'ON CONFLICT (product_id) DO UPDATE '
+                f'SET name = EXCLUDED.name, document = EXCLUDED.document',
+                rows
+            )
+
+    def remove(self, product_ids):
+        with self.connection.cursor() as cursor:
+            cursor.execute(
+                f'DELETE FROM {SEARCH_TABLE} WHERE product_id = ANY(%s)',
+                [list(product_ids)]
+            )
+
+    def clear(self):
+        with self.connection.cursor() as cursor:
+            cursor.execute(f'TRUNCATE {SEARCH_TABLE}')
+
+    def search(self, term, queryset, after=None, reverse=False, limit=24):
+        term = ' '.join(WORD_RE.findall(term))
+        if not term:
+            return []
+        restrict, restrict_params = self.restrict_sql('product_id', queryset)
+        # Full-text rank plus trigram similarity on the name, so near misses
+        # ("iphnoe") still find something. Negated so that lower is better,
+        # like bm25() on SQLite.
+        inner_sql = (
+            f'SELECT product_id, '
+            f'-(ts_rank(document, query) + similarity(name, %s))::float8 AS score '
+            f"FROM {SEARCH_TABLE}, websearch_to_tsquery('{self.config}', %s) query "
+            f'WHERE (document @@ query OR name %% %s){restrict}'
+        )
+        params = [term, term, term] + restrict_params
+        return self.ranked_search(inner_sql, params, after, reverse, limit)
+
+
+BACKENDS = {
+    'sqlite': SQLiteSearchBackend,
+    'postgresql': PostgresSearchBackend,
+}
+
+
+def get_search_backend(using=DEFAULT_DB_ALIAS, connection=None):
+    connection = connection or connections[using]
+    return BACKENDS.get(connection.vendor, SearchBackend)(connection)
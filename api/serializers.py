@@ -1,14 +1,122 @@
+from urllib.parse import urlencode
+
+from django.urls import reverse
 from rest_framework import serializers
-from .models import Product, Category, Condition
+from .models import (
+    Product, Category, Condition, CustomerOrder, Order, ShippingAddress, CATEGORY_PRODUCTS_LIMIT
+)
+from .pagination import encode_cursor
+from .timing import TimedSerializerMixin
+
+
+# Largest number of products accepted by one bulk request
+MAX_BULK_PRODUCTS = 1000
+
+
+class PreloadedPrimaryKeyRelatedField(serializers.PrimaryKeyRelatedField):
+    # Resolves ids from the objects a BulkProductListSerializer loaded for the
+    # whole batch, instead of running one query per item.
+    def to_internal_value(self, data):
+        preloaded = self.context.get('preloaded', {}).get(self.field_name)
+        if preloaded is None or isinstance(data, bool) or not isinstance(data, (int, str)):
+            return super().to_internal_value(data)
+        try:
+            return preloaded[int(data)]
+        except (TypeError, ValueError):
+            self.fail('incorrect_type', data_type=type(data).__name__)
+        except KeyError:
+            self.fail('does_not_exist', pk_value=data)
+
+
+class BulkProductListSerializer(serializers.ListSerializer):
+    """
+    Validates a list of products item by item: invalid items are reported in
+    `item_errors` (with their index) instead of failing the whole batch, and
+    the valid ones are kept in `valid_items` as (index, validated_data).
+    """
+
+    def to_internal_value(self, data):
+        if not isinstance(data, list):
+            self.fail('not_a_list', input_type=type(data).__name__)
+        if len(data) > MAX_BULK_PRODUCTS:
+            raise serializers.ValidationError(
+                f"at most {MAX_BULK_PRODUCTS} products can be sent at once"
+            )
+
+        self.preload_related(data)
+        self.valid_items = []
+        self.item_errors = []
+        for index, item in enumerate(data):
+            try:
+                self.valid_items.append((index, self.child.run_validation(item)))
+            except serializers.ValidationError as exc:
+                self.item_errors.append({'index': index, 'errors': exc.detail})
+        return [validated for _, validated in self.valid_items]
 
+    def preload_related(self, data):
+        # One query per related model for the whole batch
+        preloaded = {}
+        for field_name, model in (('category', Category), ('condition', Condition)):
+            ids = set()
+            for item in data:
+                value = item.get(field_name) if isinstance(item, dict) else None
+                if isinstance(value, int) and not isinstance(value, bool):
+                    ids.add(value)
+                elif isinstance(value, str) and value.isdigit():
+                    ids.add(int(value))
+            preloaded[field_name] = model.objects.in_bulk(ids)
+        self._context['preloaded'] = preloaded
+
+
+def split_names(value):
+    return {name.strip() for name in value.split(',') if name.strip()}
+
+
+def sparse_fields(query_params, serializer_class):
+    """
+    The fields of `serializer_class` asked for with ?fields=id,name and/or
+    ?omit=description, or None when the request wants all of them.
+    """
+    requested = query_params.get('fields')
+    omitted = query_params.get('omit')
+    if requested is None and omitted is None:
+        return None
+    known = set(serializer_class.Meta.fields)
+    fields = split_names(requested) if requested is not None else set(known)
+    omit = split_names(omitted or '')
+    unknown = (fields | omit) - known
+    if unknown:
+        raise serializers.ValidationError({
+            'fields': [f"Unknown fields: {', '.join(sorted(unknown))}"]
+        })
+    return fields - omit
+
+
+class SparseFieldsMixin:
+    # Only keeps the fields in the 'fields' context entry (see sparse_fields()),
+    # when there is one
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        fields = self.context.get('fields')
+        if fields is not None:
+            for field_name in set(self.fields) - fields:
+                self.fields.pop(field_name)
+
+
+class ProductSerializer(TimedSerializerMixin, SparseFieldsMixin, serializers.ModelSerializer):
+    category = PreloadedPrimaryKeyRelatedField(queryset=Category.objects.all())
+    condition = PreloadedPrimaryKeyRelatedField(queryset=Condition.objects.all())
 
-class ProductSerializer(serializers.ModelSerializer):
     class Meta:
         model = Product
+        list_serializer_class = BulkProductListSerializer
+        # Follows quantity_available (Product.sync_in_stock())
+        read_only_fields = ['product_in_stock']
         fields = [
             'id',
             'name',
             'category',
+            'condition',
             'category_details',
             'condition_details',
             'properties',
@@ -19,12 +127,19 @@ class ProductSerializer(serializers.ModelSerializer):
             'product_in_stock',
             'ratings',
             'thumbnails',
+            'thumbnail_variants',
             'previous_price',
             'free_shipping',
         ]
 
 
-class CategorySerializer(serializers.ModelSerializer):
+class CategorySerializer(TimedSerializerMixin, SparseFieldsMixin, serializers.ModelSerializer):
+    products = serializers.ReadOnlyField()
+    products_count = serializers.ReadOnlyField()
+    products_next = serializers.SerializerMethodField()
+    category_banner_image_variants = serializers.ReadOnlyField()
+    category_thumbnail_image_variants = serializers.ReadOnlyField()
+
     class Meta:
         model = Category
         fields = [
@@ -32,11 +147,34 @@ class CategorySerializer(serializers.ModelSerializer):
             'name',
             'category_banner_image',
             'category_thumbnail_image',
+            'category_banner_image_variants',
+            'category_thumbnail_image_variants',
             'properties',
             'products',
+            'products_count',
+            'products_next',
         ]
 
-class ConditionSerializer(serializers.ModelSerializer):
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        # Embedded products are opt-in (?include=products)
+        if not self.context.get('include_products'):
+            for field_name in ('products', 'products_count', 'products_next'):
+                self.fields.pop(field_name, None)
+
+    def get_products_next(self, category):
+        if category.products_count <= CATEGORY_PRODUCTS_LIMIT:
+            return None
+        # Continue the product list right after the last embedded product
+        last_id = category.products[-1]['id']
+        url = reverse('product_list') + '?' + urlencode({
+            'category': category.id,
+            'cursor': encode_cursor([last_id]),
+        })
+        request = self.context.get('request')
+        return request.build_absolute_uri(url) if request is not None else url
+
+class ConditionSerializer(TimedSerializerMixin, serializers.ModelSerializer):
     class Meta:
         model = Condition
         fields = [
@@ -45,3 +183,42 @@ class ConditionSerializer(serializers.ModelSerializer):
         ]
 
 
+class ShippingAddressSerializer(TimedSerializerMixin, serializers.ModelSerializer):
+    class Meta:
+        model = ShippingAddress
+        fields = [
+            'first_name',
+            'last_name',
+            'country',
+            'state',
+            'postal_code',
+            'address_one',
+            'address_two',
+        ]
+
+
+class OrderLineSerializer(TimedSerializerMixin, serializers.ModelSerializer):
+    class Meta:
+        model = Order
+        fields = [
+            'product',
+            'quantity',
+            'unit_price',
+        ]
+
+
+class CustomerOrderSerializer(TimedSerializerMixin, serializers.ModelSerializer):
+    customer = ShippingAddressSerializer(read_only=True)
+    lines = OrderLineSerializer(many=True, read_only=True)
+
+    class Meta:
+        model = CustomerOrder
+        fields = [
+            'id',
+            'customer',
+            'lines',
+            'subtotal',
+            'shipping',
+            'total',
+            'created_at',
+        ]
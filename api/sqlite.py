@@ -0,0 +1,96 @@
+import logging
+import random
+import time
+from functools import wraps
+
+from django.conf import settings
+from django.db import OperationalError, router, transaction
+from django.db.backends.signals import connection_created
+from django.dispatch import receiver
+
+
+logger = logging.getLogger(__name__)
+
+LOCKED_MESSAGES = ('database is locked', 'database table is locked')
+
+
+def tuned_pragmas():
+    # busy_timeout first: switching to WAL needs a moment of exclusive access
+    return [
+        ('busy_timeout', settings.SQLITE_BUSY_TIMEOUT),
+        ('journal_mode', 'WAL'),
+        ('synchronous', 'NORMAL'),
+        ('mmap_size', settings.SQLITE_MMAP_SIZE),
+        ('cache_size', settings.SQLITE_CACHE_SIZE),
+        ('temp_store', 'MEMORY'),
+    ]
+
+
+@receiver(connection_created)
+def tune_sqlite(sender, connection, **kwargs):
+    """
+    Applies the SQLITE_TUNED profile to every new SQLite connection. In WAL
+    mode readers no longer wait for writers (and the other way round), and
+    synchronous=NORMAL only syncs at checkpoints: a power loss can drop the
+    last commits, but never corrupts the database. Writers queue for up to
+    SQLITE_BUSY_TIMEOUT ms instead of failing right away.
+    """
+    if connection.vendor != 'sqlite' or not settings.SQLITE_TUNED:
+        return
+    with connection.cursor() as cursor:
+        for name, value in tuned_pragmas():
+            cursor.execute(f'PRAGMA {name} = {value}')
+
+
+def lock_for_write(model):
+    """
+    Takes SQLite's write lock at the start of the current transaction, as
+    BEGIN IMMEDIATE would (Django 4.2 can't issue it). A transaction that
+    reads before its first write otherwise fails with 'database is locked'
+    at that write, without waiting out the busy timeout, whenever another
+    writer committed after its first read. Other databases lock rows with
+    select_for_update() instead; this does nothing there.
+    """
+    connection = transaction.get_connection(router.db_for_write(model))
+    if connection.vendor == 'sqlite':
+        with connection.cursor() as cursor:
+            # Matches no row (through the primary key), but any write
+            # statement takes the lock
+            cursor.execute(f'UPDATE "{model._meta.db_table}" SET id = id WHERE id < 0')
+
+
+def is_locked(exc):
+    return any(message in str(exc) for message in LOCKED_MESSAGES)
+
+
+def retry_if_locked(func):
+    """
+    Runs `func`, which makes one write transaction, again when SQLite reports
+    the database locked: up to SQLITE_WRITE_RETRIES more times, waiting
+    SQLITE_RETRY_BACKOFF seconds doubled at every try, with jitter. The busy
+    timeout can't help a transaction that read before writing while another
+    one committed; only starting over can.
+
+    Inside an outer atomic block the error is raised as is, since only the
+    outermost transaction can be run again.
+    """
+
+    @wraps(func)
+    def wrapper(*args, **kwargs):
+        attempt = 0
+        while True:
+            try:
+                return func(*args, **kwargs)
+            except OperationalError as exc:
+                if (
+                    not is_locked(exc)
+                    or attempt >= settings.SQLITE_WRITE_RETRIES
+                    or transaction.get_connection().in_atomic_block
+                ):
+                    raise
+            delay = settings.SQLITE_RETRY_BACKOFF * 2 ** attempt * random.uniform(0.5, 1.5)
+            attempt += 1
+            logger.warning(f"{func.__name__}: database is locked, retry {attempt} in {delay:.3f}s")
+            time.sleep(delay)
+
+    return wrapper
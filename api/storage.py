@@ -0,0 +1,79 @@
+import hashlib
+import os
+import posixpath
+import re
+import uuid
+
+from django.core.files import File
+from django.core.files.storage import FileSystemStorage
+from django.utils.deconstruct import deconstructible
+
+
+# <upload_to>/<2 hex>/<sha256><ext>, as produced by ContentAddressedStorage
+HASHED_NAME_RE = re.compile(r'(?:^|/)([0-9a-f]{2})/\1[0-9a-f]{62}\.[^/.]+$')
+
+# Hashed files never change under the same URL
+IMMUTABLE_CACHE_CONTROL = 'public, max-age=31536000, immutable'
+
+
+def is_hashed_name(name):
+    return HASHED_NAME_RE.search(name) is not None
+
+
+def content_hash(content):
+    digest = hashlib.sha256()
+    if hasattr(content, 'seek'):
+        content.seek(0)
+    for chunk in content.chunks():
+        digest.update(chunk if isinstance(chunk, bytes) else chunk.encode('utf-8'))
+    if hasattr(content, 'seek'):
+        content.seek(0)
+    return digest.hexdigest()
+
+
+@deconstructible
+class ReplacingStorage(FileSystemStorage):
+    """
+    Saves over a file already stored under the same name instead of picking
+    a suffixed one. The content is written under a unique temporary name and
+    moved into place, so concurrent writers of the same name never see a
+    partial file or a missing one.
+    """
+
+    def get_available_name(self, name, max_length=None):
+        return name
+
+    def _save(self, name, content):
+        tmp_name = super()._save(f'{name}.{uuid.uuid4().hex}.tmp', content)
+        os.replace(self.path(tmp_name), self.path(name))
+        return name
+
+
+@deconstructible
+class ContentAddressedStorage(ReplacingStorage):
+    """
+    Stores every file under a name derived from the sha256 of its content,
+    inside the directory chosen by the field's upload_to:
+
+        category/bg1.png -> category/3f/3f9a...c1.png
+
+    Uploading the same bytes twice gives back the name of the blob already
+    stored instead of writing a suffixed copy.
+    """
+
+    def hashed_name(self, name, content):
+        directory, filename = posixpath.split(name.replace('\\', '/'))
+        ext = os.path.splitext(filename)[1].lower()
+        digest = content_hash(content)
+        return posixpath.join(directory, digest[:2], digest + ext)
+
+    def save(self, name, content, max_length=None):
+        if name is None:
+            name = content.name
+        if not hasattr(content, 'chunks'):
+            content = File(content, name)
+        name = self.hashed_name(name, content)
+        if self.exists(name):
+            return name
+        # A file already stored under this name has the same content
+        return super().save(name, content, max_length=max_length)
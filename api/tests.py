@@ -1,3 +1,1664 @@
-from django.test import TestCase
+import csv
+import importlib.util
+import io
+import json
+import os
+import random
+import re
+import shutil
+import tempfile
+import threading
+import time
+from datetime import datetime, timedelta
+from decimal import Decimal
+from unittest import mock, skipUnless
 
-# Create your tests here.
+from asgiref.sync import iscoroutinefunction, sync_to_async
+from django.conf import settings
+from django.core.handlers.asgi import ASGIHandler
+from django.contrib.auth.models import User, update_last_login
+from django.utils import timezone
+from django.core.cache import cache
+from django.core.exceptions import MiddlewareNotUsed
+from django.core.files.base import ContentFile
+from django.core.files.storage import FileSystemStorage, default_storage
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import call_command
+from django.db import OperationalError, connection, connections, transaction
+from django.test import (
+    AsyncRequestFactory, Client, LiveServerTestCase, SimpleTestCase, TestCase, TransactionTestCase,
+    override_settings,
+)
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from rest_framework.decorators import api_view
+from rest_framework.exceptions import ParseError
+from rest_framework.renderers import JSONRenderer
+from rest_framework.request import Request
+from rest_framework.response import Response
+from rest_framework.test import APIRequestFactory
+from PIL import Image as PILImage
+
+from benchmarks import routes as benchmark_routes
+from benchmarks.catalog import seed_catalog
+
+from . import async_views, metrics, parsers, renderers, sqlite
+from .cache import cached_response
+from .images import VARIANTS, build_variants
+from .media import serve_media
+from .models import (
+    Category, Condition, CustomerOrder, Image, ImageAlbum, Order, Product, ProductFacet, Profile,
+    StockReservation,
+)
+from .orders import OutOfStock, place_order
+from .pagination import encode_cursor
+from .replay import trace_paths
+from .reservations import reserve
+from .serializers import ProductSerializer
+from .timing import ServerTimingMiddleware
+from .tracing import RequestTraceMiddleware
+
+
+def create_catalog(products=3, images=2):
+    category = Category.objects.create(
+        name="Electronics", category_banner_image="category/bg1.png"
+    )
+    condition = Condition.objects.create(name="New")
+    created = []
+    for i in range(products):
+        product = Product.objects.create(
+            name=f"Product {i}",
+            category=category,
+            condition=condition,
+            description="A product",
+            price=1000 + i,
+            previous_price=1200 + i,
+            quantity_available=10,
+            product_in_stock=True,
+            properties=[{"name": "color", "value": "Red"}],
+        )
+        for j in range(images):
+            Image.objects.create(
+                name=f"Image {j}",
+                album=product.album,
+                image=f"Image_Albums/images/p{j}.png",
+            )
+        created.append(product)
+    return category, condition, created
+
+
+class APITestCase(TestCase):
+    def setUp(self):
+        cache.clear()
+
+
+class ProductQueryCountTests(APITestCase):
+    def test_product_list_query_count_is_constant(self):
+        create_catalog(products=2)
+        # fingerprint, products, images
+        with self.assertNumQueries(3):
+            response = self.client.get(reverse("product_list"))
+        self.assertEqual(len(response.json()["results"]), 2)
+
+        create_catalog(products=10)
+        with self.assertNumQueries(3):
+            response = self.client.get(reverse("product_list"))
+        self.assertEqual(len(response.json()["results"]), 12)
+        self.assertEqual(len(response.json()["results"][0]["thumbnails"]), 2)
+
+    def test_saved_data_query_count_is_constant(self):
+        _, _, products = create_catalog(products=5)
+        with self.assertNumQueries(2):
+            response = self.client.post(
+                reverse("get_saved_data"),
+                [p.id for p in products],
+                content_type="application/json",
+            )
+        self.assertEqual(len(response.json()), 5)
+
+
+class CategoryProductsTests(APITestCase):
+    def test_products_are_opt_in(self):
+        create_catalog(products=2)
+        with self.assertNumQueries(2):
+            response = self.client.get(reverse("category_list"))
+        self.assertNotIn("products", response.json()["results"][0])
+
+    def test_embedded_products_are_capped_and_batch_loaded(self):
+        create_catalog(products=12)
+        create_catalog(products=3)
+        with self.assertNumQueries(3):
+            response = self.client.get(reverse("category_list"), {"include": "products"})
+        first, second = response.json()["results"]
+        self.assertEqual(len(first["products"]), 10)
+        self.assertEqual(first["products_count"], 12)
+        self.assertIn(f"category={first['id']}", first["products_next"])
+        self.assertEqual(len(second["products"]), 3)
+        self.assertIsNone(second["products_next"])
+
+
+class SparseFieldsetTests(APITestCase):
+    def test_product_fields_prune_columns_and_queries(self):
+        create_catalog(products=3)
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(reverse("product_list"), {"fields": "id,name,price"})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(list(response.json()["results"][0]), ["id", "name", "price"])
+        # fingerprint and products: no join, no image prefetch
+        self.assertEqual(len(queries), 2)
+        self.assertNotIn("description", queries[1]["sql"])
+        self.assertNotIn("JOIN", queries[1]["sql"])
+
+        with self.assertNumQueries(3):
+            response = self.client.get(reverse("product_list"), {"fields": "id,thumbnails"})
+        self.assertEqual(len(response.json()["results"][0]["thumbnails"]), 2)
+
+    def test_omit(self):
+        _, _, products = create_catalog(products=1)
+        response = self.client.get(
+            reverse("product_details", args=[products[0].id]), {"omit": "description,properties"}
+        )
+        product = response.json()
+        self.assertNotIn("description", product)
+        self.assertNotIn("properties", product)
+        self.assertEqual(product["category_details"]["name"], "Electronics")
+
+        response = self.client.post(
+            reverse("get_saved_data") + "?fields=id,condition_details",
+            [products[0].id], content_type="application/json",
+        )
+        self.assertEqual(response.json(), [{"id": products[0].id, "condition_details": {
+            "id": products[0].condition_id, "name": "New",
+        }}])
+
+    def test_unknown_fields_are_rejected(self):
+        response = self.client.get(reverse("product_list"), {"fields": "id,password"})
+        self.assertEqual(response.status_code, 400)
+        self.assertIn("password", str(response.json()))
+
+    def test_category_fields_skip_embedded_products(self):
+        create_catalog(products=12)
+        # fingerprint and categories, neither counting nor loading products
+        with self.assertNumQueries(2):
+            response = self.client.get(
+                reverse("category_list"), {"include": "products", "fields": "id,name"}
+            )
+        self.assertEqual(response.json()["results"][0], {
+            "id": Category.objects.get().id, "name": "Electronics",
+        })
+
+        # The count is annotated, the products aren't prefetched
+        with self.assertNumQueries(2):
+            response = self.client.get(
+                reverse("category_list"), {"include": "products", "fields": "id,products_count"}
+            )
+        self.assertEqual(response.json()["results"][0]["products_count"], 12)
+
+
+class KeysetPaginationTests(APITestCase):
+    def collect(self, params):
+        seen, previous_pages = [], []
+        response = self.client.get(reverse("product_list"), params)
+        while True:
+            seen.extend(product["id"] for product in response.json()["results"])
+            previous_pages.append(response.json()["previous"])
+            if response.json()["next"] is None:
+                return seen, response, previous_pages
+            response = self.client.get(response.json()["next"])
+
+    def test_walks_every_product_once_in_sort_order(self):
+        _, _, products = create_catalog(products=7, images=0)
+        Product.objects.filter(id__in=[p.id for p in products[:3]]).update(price=5)
+
+        seen, _, previous_pages = self.collect({"ordering": "-price", "page_size": 2})
+        expected = list(
+            Product.objects.order_by("-price", "-id").values_list("id", flat=True)
+        )
+        self.assertEqual(seen, expected)
+        self.assertIsNone(previous_pages[0])
+
+    def test_previous_link_returns_preceding_page(self):
+        create_catalog(products=5, images=0)
+        first = self.client.get(reverse("product_list"), {"page_size": 2})
+        second = self.client.get(first.json()["next"])
+        back = self.client.get(second.json()["previous"])
+        self.assertEqual(
+            [p["id"] for p in back.json()["results"]],
+            [p["id"] for p in first.json()["results"]],
+        )
+        self.assertIsNone(back.json()["previous"])
+
+    def test_invalid_cursor_is_not_found(self):
+        response = self.client.get(reverse("product_list"), {"cursor": "bogus"})
+        self.assertEqual(response.status_code, 404)
+
+    def test_tampered_cursors_are_not_found(self):
+        create_catalog(products=2, images=0)
+        cases = [
+            ("product_list", {}, ["abc"]),
+            ("product_list", {}, [None]),
+            ("product_list", {}, [{"a": 1}]),
+            ("product_list", {}, [True]),
+            ("product_list", {}, [10 ** 30]),
+            ("product_list", {"ordering": "price"}, [None, 1]),
+            ("product_list", {"search": "product"}, [float("inf"), 1]),
+            ("category_list", {}, ["abc"]),
+            ("condition_list", {}, [10 ** 30]),
+        ]
+        for name, params, position in cases:
+            with self.subTest(name=name, params=params, position=position):
+                response = self.client.get(
+                    reverse(name), {**params, "cursor": encode_cursor(position)}
+                )
+                self.assertEqual(response.status_code, 404)
+
+    def test_category_products_next_continues_after_embedded_products(self):
+        category, _, products = create_catalog(products=12, images=0)
+        response = self.client.get(
+            reverse("category_details", args=[category.id]), {"include": "products"}
+        )
+        following = self.client.get(response.json()["products_next"])
+        self.assertEqual(
+            [p["id"] for p in following.json()["results"]],
+            [p.id for p in products[10:]],
+        )
+
+
+class ProductSearchTests(APITestCase):
+    def setUp(self):
+        super().setUp()
+        _, _, (self.phone, self.case, self.lamp) = create_catalog(products=3, images=0)
+        self.phone.name, self.phone.description = "Red iPhone", "A phone"
+        self.case.name, self.case.description = "Case", "Fits the iPhone perfectly"
+        self.lamp.name, self.lamp.properties = "Lamp", [{"name": "color", "value": "Crimson"}]
+        for product in (self.phone, self.case, self.lamp):
+            product.save()
+
+    def search(self, term, **params):
+        response = self.client.get(reverse("product_list"), {"search": term, **params})
+        return [product["id"] for product in response.json()["results"]]
+
+    def test_results_are_ranked_by_relevance(self):
+        self.assertEqual(self.search("iphone"), [self.phone.id, self.case.id])
+
+    def test_matches_description_prefixes_and_property_values(self):
+        self.assertEqual(self.search("perfect"), [self.case.id])
+        self.assertEqual(self.search("crimson"), [self.lamp.id])
+
+    def test_index_follows_saves_and_deletes(self):
+        self.lamp.name = "Desk iPhone stand"
+        self.lamp.save()
+        self.assertIn(self.lamp.id, self.search("iphone"))
+        self.phone.delete()
+        self.assertNotIn(self.phone.id, self.search("iphone"))
+
+    def test_query_syntax_is_not_interpreted(self):
+        self.assertEqual(self.search('"iphone (* -'), [self.phone.id, self.case.id])
+
+    def test_paginates_with_other_filters(self):
+        other_category, _, _ = create_catalog(products=1, images=0)
+        Product.objects.filter(id=self.case.id).update(category=other_category)
+        self.assertEqual(
+            self.search("iphone", category=other_category.id), [self.case.id]
+        )
+        first = self.client.get(reverse("product_list"), {"search": "iphone", "page_size": 1})
+        second = self.client.get(first.json()["next"])
+        self.assertEqual(second.json()["results"][0]["id"], self.case.id)
+        self.assertIsNone(second.json()["next"])
+
+
+class ProductFacetTests(APITestCase):
+    def setUp(self):
+        super().setUp()
+        self.category, _, products = create_catalog(products=4, images=0)
+        variants = [("Red", "M"), ("Red", "L"), ("Blue", "M"), ("Green", "S")]
+        for product, (color, size) in zip(products, variants):
+            product.properties = [
+                {"name": "color", "value": color},
+                {"name": "size", "value": size},
+            ]
+            product.save()
+        self.products = products
+
+    def test_index_is_kept_in_sync(self):
+        product = self.products[0]
+        self.assertEqual(
+            set(product.facets.values_list("name", "value")),
+            {("color", "Red"), ("size", "M")},
+        )
+        product.properties = [{"name": "color", "value": ["Red", "Black"]}]
+        product.save()
+        self.assertEqual(
+            set(product.facets.values_list("name", "value")),
+            {("color", "Red"), ("color", "Black")},
+        )
+
+    def test_filters_by_properties(self):
+        response = self.client.get(
+            reverse("product_list"), {"prop.color": ["Red", "Blue"], "prop.size": "M"}
+        )
+        self.assertEqual(
+            [p["id"] for p in response.json()["results"]],
+            [self.products[0].id, self.products[2].id],
+        )
+
+    def test_facet_counts_leave_out_own_filter(self):
+        with self.assertNumQueries(5):
+            response = self.client.get(
+                reverse("product_list"), {"prop.color": "Red", "include": "facets"}
+            )
+        facets = response.json()["facets"]
+        self.assertEqual(
+            facets["color"],
+            [{"value": "Red", "count": 2}, {"value": "Blue", "count": 1}, {"value": "Green", "count": 1}],
+        )
+        self.assertEqual(
+            facets["size"],
+            [{"value": "L", "count": 1}, {"value": "M", "count": 1}],
+        )
+
+    def test_category_must_be_an_integer(self):
+        for category in ("abc", "1.5", str(2 ** 64)):
+            response = self.client.get(reverse("product_list"), {"category": category, "include": "facets"})
+            self.assertEqual(response.status_code, 400)
+            self.assertIn("category", response.json()["error"]["details"])
+        response = self.client.get(reverse("product_list"), {"category": self.category.id})
+        self.assertEqual(len(response.json()["results"]), 4)
+
+    def test_category_properties_choose_the_facets(self):
+        self.category.properties = [{"name": "size", "value": ["S", "M", "L"]}]
+        self.category.save()
+        response = self.client.get(
+            reverse("product_list"), {"category": self.category.id, "include": "facets"}
+        )
+        self.assertEqual(list(response.json()["facets"]), ["size"])
+
+
+@override_settings(CART_SHIPPING_FEE=500)
+class CartPricingTests(APITestCase):
+    def post_cart(self, payload):
+        return self.client.post(
+            reverse("get_cart_data"), payload, content_type="application/json"
+        )
+
+    def test_prices_lines_in_one_query(self):
+        _, _, (first, second, third) = create_catalog(products=3)
+        Product.objects.filter(id=third.id).update(quantity_available=1)
+        with self.assertNumQueries(1):
+            response = self.post_cart([
+                {"id": first.id, "qty": 2},
+                {"id": third.id, "qty": 2},
+                {"id": first.id, "qty": 1},
+                {"id": 9999, "qty": 1},
+            ])
+        data = response.json()
+        self.assertEqual([line["id"] for line in data["lines"]], [first.id, third.id])
+        line = data["lines"][0]
+        self.assertEqual(line["quantity"], 3)
+        self.assertEqual(line["line_total"], 3 * first.price)
+        self.assertEqual(line["line_savings"], 3 * (first.previous_price - first.price))
+        self.assertEqual(line["thumbnail"], "/media/Image_Albums/images/p0.png")
+        product = self.client.get(reverse("product_details", args=[first.id])).json()
+        self.assertEqual(line["thumbnail"], product["thumbnails"][0])
+        self.assertTrue(line["available"])
+        self.assertFalse(data["lines"][1]["available"])
+        self.assertEqual(data["missing"], [9999])
+        self.assertEqual(data["shipping"], 500)
+        self.assertEqual(data["total"], data["subtotal"] + 500)
+        self.assertFalse(data["available"])
+
+    def test_free_shipping_and_bare_ids(self):
+        _, _, products = create_catalog(products=2, images=0)
+        Product.objects.update(free_shipping=True)
+        data = self.post_cart([p.id for p in products]).data
+        self.assertEqual(data["shipping"], 0)
+        self.assertEqual([line["quantity"] for line in data["lines"]], [1, 1])
+        self.assertTrue(data["available"])
+
+    def test_rejects_invalid_payloads(self):
+        self.assertEqual(self.post_cart({"id": 1}).status_code, 400)
+        self.assertEqual(self.post_cart([{"id": 1, "qty": 0}]).status_code, 400)
+        self.assertEqual(self.post_cart([{"id": "x"}]).status_code, 400)
+        self.assertEqual(self.post_cart(list(range(1, 502))).status_code, 400)
+        self.assertEqual(self.post_cart([{"id": 10 ** 30}]).status_code, 400)
+        self.assertEqual(self.post_cart([{"id": 1, "qty": 2.7}]).status_code, 400)
+        self.assertEqual(self.post_cart([{"id": "1"}]).status_code, 400)
+        self.assertEqual(self.post_cart([True]).status_code, 400)
+
+
+@override_settings(API_CACHE_ENABLED=True)
+class ResponseCacheTests(APITestCase):
+    def test_hits_skip_the_database(self):
+        _, _, (product, _) = create_catalog(products=2)
+        url = reverse("product_details", args=[product.id])
+        first = self.client.get(url)
+        with self.assertNumQueries(0):
+            second = self.client.get(url)
+        self.assertEqual(first.json(), second.json())
+
+    @override_settings(API_CACHE_ENABLED=False)
+    def test_can_be_turned_off(self):
+        _, _, (product, _) = create_catalog(products=2)
+        url = reverse("product_details", args=[product.id])
+        self.client.get(url)
+        # Not invalidated, which only a cached response would miss
+        Product.objects.filter(id=product.id).update(name="Renamed")
+        self.assertEqual(self.client.get(url).json()["name"], "Renamed")
+
+    def test_product_edit_invalidates_only_affected_entries(self):
+        category, _, (product, other) = create_catalog(products=2)
+        urls = {
+            "product": reverse("product_details", args=[product.id]),
+            "other": reverse("product_details", args=[other.id]),
+            "list": reverse("product_list"),
+            "category": reverse("category_details", args=[category.id]) + "?include=products",
+        }
+        for url in urls.values():
+            self.client.get(url)
+
+        product.name = "Renamed"
+        product.save()
+
+        with self.assertNumQueries(0):
+            self.client.get(urls["other"])
+        self.assertEqual(self.client.get(urls["product"]).json()["name"], "Renamed")
+        self.assertEqual(self.client.get(urls["list"]).json()["results"][0]["name"], "Renamed")
+        self.assertEqual(self.client.get(urls["category"]).json()["products"][0]["name"], "Renamed")
+
+    def test_related_changes_invalidate_products(self):
+        category, condition, (product,) = create_catalog(products=1, images=1)
+        url = reverse("product_details", args=[product.id])
+        self.client.get(url)
+
+        Image.objects.create(name="New", album=product.album, image="Image_Albums/images/new.png")
+        self.assertEqual(len(self.client.get(url).json()["thumbnails"]), 2)
+
+        condition.name = "Used"
+        condition.save()
+        self.assertEqual(self.client.get(url).json()["condition_details"]["name"], "Used")
+
+        category.name = "Phones"
+        category.save()
+        self.assertEqual(self.client.get(url).json()["category_details"]["name"], "Phones")
+
+    def test_category_and_condition_edits_bump_a_fixed_set_of_namespaces(self):
+        category, condition, _ = create_catalog(products=5, images=0)
+        with mock.patch("api.models.invalidate") as invalidate:
+            category.save()
+            condition.save()
+        self.assertEqual(
+            [call.args[0] for call in invalidate.call_args_list],
+            [{f"category:{category.id}", "catalog-meta", "product-list"}, {"catalog-meta", "product-list"}],
+        )
+
+    def test_concurrent_misses_build_once(self):
+        builds = []
+
+        def build():
+            builds.append(1)
+            time.sleep(0.2)
+            return Response({"ok": True})
+
+        def fetch(results):
+            request = Request(APIRequestFactory().get("/api/product/"))
+            request.accepted_renderer = JSONRenderer()
+            results.append(cached_response(request, ["product-list"], build).content)
+
+        results = []
+        threads = [threading.Thread(target=fetch, args=(results,)) for _ in range(5)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(len(builds), 1)
+        self.assertEqual(results, [b'{"ok":true}'] * 5)
+
+
+@override_settings(API_CACHE_ENABLED=True)
+class ConditionalGetTests(APITestCase):
+    def test_detail_revalidates_with_etag(self):
+        _, _, (product,) = create_catalog(products=1)
+        url = reverse("product_details", args=[product.id])
+        response = self.client.get(url)
+        etag = response["ETag"]
+
+        # Answered from the stored validators, without a query or a body
+        with self.assertNumQueries(0):
+            response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(response.content, b"")
+
+        cache.clear()
+        # On a miss only the fingerprint query runs
+        with self.assertNumQueries(1):
+            response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+
+        Image.objects.filter(album=product.album).first().delete()
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response["ETag"], etag)
+
+    def test_single_rows_revalidate_with_last_modified(self):
+        condition = Condition.objects.create(name="New")
+        url = reverse("condition_details", args=[condition.id])
+        last_modified = self.client.get(url)["Last-Modified"]
+        response = self.client.get(url, HTTP_IF_MODIFIED_SINCE=last_modified)
+        self.assertEqual(response.status_code, 304)
+
+    def test_row_sets_have_no_last_modified(self):
+        # A delete can't move max(updated_at) forward: If-Modified-Since
+        # would keep answering 304 for a list that lost a row
+        _, _, (product, _) = create_catalog(products=2)
+        urls = [
+            reverse("product_list"),
+            reverse("category_list"),
+            reverse("condition_list"),
+            reverse("product_details", args=[product.id]),
+            reverse("category_details", args=[product.category_id]) + "?include=products",
+        ]
+        for url in urls:
+            response = self.client.get(url)
+            self.assertEqual(response.status_code, 200, url)
+            self.assertTrue(response.has_header("ETag"), url)
+            self.assertFalse(response.has_header("Last-Modified"), url)
+
+        etag = self.client.get(reverse("product_list"))["ETag"]
+        product.delete()
+        response = self.client.get(reverse("product_list"), HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+
+    def test_lists_revalidate_without_serializing(self):
+        create_catalog(products=2)
+        for name in ("product_list", "category_list", "condition_list"):
+            url = reverse(name)
+            etag = self.client.get(url)["ETag"]
+            cache.clear()
+            with self.assertNumQueries(1):
+                response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+            self.assertEqual(response.status_code, 304, name)
+
+    def test_etag_changes_with_the_page(self):
+        create_catalog(products=3, images=0)
+        url = reverse("product_list")
+        self.assertNotEqual(
+            self.client.get(url, {"page_size": 1})["ETag"],
+            self.client.get(url, {"page_size": 2})["ETag"],
+        )
+
+    def test_missing_objects_are_not_found(self):
+        self.assertEqual(self.client.get(reverse("product_details", args=[99])).status_code, 404)
+        self.assertEqual(self.client.get(reverse("category_details", args=[99])).status_code, 404)
+        self.assertEqual(self.client.get(reverse("condition_details", args=[99])).status_code, 404)
+
+
+class CatalogExportTests(APITestCase):
+    def test_streams_ndjson(self):
+        _, _, products = create_catalog(products=3)
+        response = self.client.get(reverse("export_products", args=["ndjson"]))
+        self.assertTrue(response.streaming)
+        self.assertEqual(response["Content-Type"], "application/x-ndjson")
+        rows = [json.loads(line) for line in b"".join(response.streaming_content).splitlines()]
+        self.assertEqual([row["id"] for row in rows], [p.id for p in products])
+        self.assertEqual(len(rows[0]["thumbnails"]), 2)
+
+    def test_streams_csv_with_constant_queries_per_chunk(self):
+        create_catalog(products=5)
+        response = self.client.get(reverse("export_products", args=["csv"]))
+        # chunk of products + its images
+        with self.assertNumQueries(2):
+            content = b"".join(response.streaming_content).decode()
+        rows = list(csv.reader(io.StringIO(content)))
+        self.assertEqual(rows[0][:2], ["id", "name"])
+        self.assertEqual(len(rows), 6)
+        self.assertEqual(rows[1][3], "Electronics")
+
+    def test_category_must_be_an_integer(self):
+        response = self.client.get(reverse("export_products", args=["csv"]), {"category": "abc"})
+        self.assertEqual(response.status_code, 400)
+
+    def test_unknown_format_is_not_found(self):
+        response = self.client.get(reverse("export_products", args=["xml"]))
+        self.assertEqual(response.status_code, 404)
+
+    def test_management_command(self):
+        create_catalog(products=2)
+        out = io.StringIO()
+        call_command("export_catalog", stdout=out)
+        self.assertEqual(len(out.getvalue().splitlines()), 2)
+
+
+class BulkProductTests(APITestCase):
+    def setUp(self):
+        super().setUp()
+        self.category, self.condition, _ = create_catalog(products=0)
+
+    def item(self, name, **fields):
+        return {
+            "name": name,
+            "category": self.category.id,
+            "condition": self.condition.id,
+            "description": f"{name} description",
+            "price": 100,
+            "properties": [{"name": "color", "value": "Red"}],
+            **fields,
+        }
+
+    def test_creates_products_and_albums_in_bulk(self):
+        items = [self.item(f"Bulk {i}") for i in range(30)]
+        items[3]["category"] = 9999
+        items[7].pop("name")
+        with self.assertNumQueries(8):
+            response = self.client.post(reverse("product_bulk"), items, content_type="application/json")
+        self.assertEqual(response.status_code, 201)
+        data = response.json()
+        self.assertEqual(len(data["data"]), 28)
+        self.assertEqual([error["index"] for error in data["errors"]], [3, 7])
+        self.assertEqual(ImageAlbum.objects.count(), 28)
+        self.assertEqual(ProductFacet.objects.filter(name="color", value="Red").count(), 28)
+
+        search = self.client.get(reverse("product_list"), {"search": "bulk"}).json()
+        self.assertEqual(len(search["results"]), 24)
+
+    def test_updates_products_in_bulk(self):
+        _, _, products = create_catalog(products=3, images=0)
+        self.client.get(reverse("product_details", args=[products[0].id]))
+        items = [{"id": p.id, "price": 5, "properties": [{"name": "size", "value": "XL"}]} for p in products]
+        items.append({"id": 9999, "price": 1})
+        response = self.client.patch(reverse("product_bulk"), items, content_type="application/json")
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()["errors"], [{"index": 3, "errors": {"id": ["Product not found."]}}])
+        self.assertEqual(set(Product.objects.values_list("price", flat=True)), {5})
+        self.assertEqual(ProductFacet.objects.filter(name="size").count(), 3)
+        self.assertFalse(ProductFacet.objects.filter(name="color").exists())
+        detail = self.client.get(reverse("product_details", args=[products[0].id])).json()
+        self.assertEqual(detail["price"], 5)
+
+    def test_renames_carry_over_to_albums(self):
+        _, _, (first, second) = create_catalog(products=2, images=0)
+        items = [{"id": first.id, "name": "Renamed"}, {"id": second.id, "name": second.name}]
+        response = self.client.patch(reverse("product_bulk"), items, content_type="application/json")
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(
+            dict(ImageAlbum.objects.values_list("product_id", "name")),
+            {first.id: "Renamed", second.id: second.name},
+        )
+
+    def test_rejects_non_lists_and_all_invalid_batches(self):
+        response = self.client.post(reverse("product_bulk"), {"name": "x"}, content_type="application/json")
+        self.assertEqual(response.status_code, 400)
+        response = self.client.post(reverse("product_bulk"), [{"name": "x"}], content_type="application/json")
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response.json()["errors"][0]["index"], 0)
+
+
+class WriteAmplificationTests(APITestCase):
+    def test_product_update_writes_once(self):
+        create_catalog(products=1, images=0)
+        product = Product.objects.get()
+        product.price = 1
+        with self.assertNumQueries(1):
+            product.save()
+
+        # Only a rename touches the album and the search index
+        product.name = "Renamed"
+        with self.assertNumQueries(3):
+            product.save()
+        self.assertEqual(ImageAlbum.objects.get().name, "Renamed")
+
+        product.properties.append({"name": "size", "value": "M"})
+        product.save()
+        self.assertEqual(product.facets.count(), 2)
+
+    def test_login_does_not_touch_the_profile(self):
+        user = User.objects.create_user("shopper", password="secret")
+        self.assertTrue(Profile.objects.filter(user=user).exists())
+        with self.assertNumQueries(1):
+            update_last_login(None, user)
+
+
+@override_settings(IMAGE_VARIANT_WORKERS=0)
+class ImageVariantTests(APITestCase):
+    def setUp(self):
+        super().setUp()
+        media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, media_root)
+        media = override_settings(MEDIA_ROOT=media_root)
+        media.enable()
+        self.addCleanup(media.disable)
+
+    def store_png(self, name, size=(800, 600)):
+        buffer = io.BytesIO()
+        PILImage.new("RGBA", size, (200, 30, 30, 128)).save(buffer, "PNG")
+        return default_storage.save(name, ContentFile(buffer.getvalue()))
+
+    def test_variants_are_built_after_commit(self):
+        _, _, (product,) = create_catalog(products=1, images=0)
+        name = self.store_png("Image_Albums/images/photo.png")
+        with self.captureOnCommitCallbacks(execute=True):
+            image = Image.objects.create(name="Photo", album=product.album, image=name)
+
+        image.refresh_from_db()
+        self.assertEqual(image.variants["source"], name)
+        self.assertEqual(image.variants["thumb"]["width"], 200)
+        # Never upscaled
+        self.assertEqual(image.variants["full"]["width"], 800)
+        with default_storage.open(image.variants["card"]["webp"]) as variant:
+            self.assertEqual(PILImage.open(variant).format, "WEBP")
+
+        response = self.client.get(reverse("product_details", args=[product.id]))
+        (variants,) = response.json()["thumbnail_variants"]
+        self.assertEqual(set(variants["sizes"]), {"thumb", "card", "full"})
+        self.assertTrue(variants["srcset"]["jpeg"].endswith(" 800w"))
+
+    def test_variants_of_replaced_file_are_stale(self):
+        _, _, (product,) = create_catalog(products=1, images=0)
+        name = self.store_png("Image_Albums/images/photo.png")
+        with self.captureOnCommitCallbacks(execute=True):
+            image = Image.objects.create(name="Photo", album=product.album, image=name)
+        image.refresh_from_db()
+        image.image = self.store_png("Image_Albums/images/other.png")
+        self.assertIsNone(image.image_variants)
+        with self.captureOnCommitCallbacks(execute=True):
+            image.save()
+        image.refresh_from_db()
+        self.assertEqual(image.variants["source"], image.image.name)
+        self.assertTrue(default_storage.exists(image.variants["thumb"]["jpeg"]))
+
+    def test_rebuilds_replace_variants_in_place(self):
+        # Another worker may be building the same source: a variant already
+        # there must never be deleted ahead of its replacement
+        name = self.store_png("category/banner.png")
+        built = build_variants(name)
+        paths = [
+            default_storage.path(built[variant][file_format])
+            for variant in VARIANTS for file_format in ("webp", "jpeg")
+        ]
+        missing = []
+        real_save = FileSystemStorage._save
+
+        def save(storage, name, content):
+            missing.extend(path for path in paths if not os.path.exists(path))
+            return real_save(storage, name, content)
+
+        with mock.patch.object(FileSystemStorage, "_save", autospec=True, side_effect=save):
+            self.assertEqual(build_variants(name), built)
+        self.assertEqual(missing, [])
+        _, files = default_storage.listdir("derivatives/category")
+        self.assertEqual(len(files), len(paths))
+
+    def test_backfill_command(self):
+        category = Category.objects.create(
+            name="Phones", category_banner_image=self.store_png("category/banner.png")
+        )
+        out = io.StringIO()
+        call_command("build_image_variants", workers=1, stdout=out)
+        category.refresh_from_db()
+        self.assertEqual(category.banner_variants["source"], category.category_banner_image.name)
+        self.assertIsNone(category.thumbnail_variants)
+        self.assertIn("Built variants of 1 images", out.getvalue())
+
+
+class ContentAddressedStorageTests(APITestCase):
+    def setUp(self):
+        super().setUp()
+        media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, media_root)
+        media = override_settings(MEDIA_ROOT=media_root, IMAGE_VARIANT_WORKERS=0)
+        media.enable()
+        self.addCleanup(media.disable)
+
+    def png(self, name, color):
+        buffer = io.BytesIO()
+        PILImage.new("RGB", (4, 4), color).save(buffer, "PNG")
+        return SimpleUploadedFile(name, buffer.getvalue(), content_type="image/png")
+
+    def test_identical_uploads_share_one_blob(self):
+        first = Category.objects.create(name="A", category_banner_image=self.png("bg1.png", "red"))
+        second = Category.objects.create(name="B", category_banner_image=self.png("BG1.PNG", "red"))
+        other = Category.objects.create(name="C", category_banner_image=self.png("bg1.png", "blue"))
+
+        self.assertEqual(first.category_banner_image.name, second.category_banner_image.name)
+        self.assertNotEqual(first.category_banner_image.name, other.category_banner_image.name)
+        self.assertRegex(first.category_banner_image.name, r"^category/[0-9a-f]{2}/[0-9a-f]{64}\.png$")
+        _, files = default_storage.listdir(first.category_banner_image.name.rsplit("/", 1)[0])
+        self.assertEqual(files, [first.category_banner_image.name.rsplit("/", 1)[1]])
+
+    def test_hashed_files_are_served_immutable(self):
+        category = Category.objects.create(name="A", category_banner_image=self.png("bg1.png", "red"))
+        default_storage.save("category/plain.png", ContentFile(b"png"))
+        request = APIRequestFactory().get("/media/")
+
+        response = serve_media(request, category.category_banner_image.name, settings.MEDIA_ROOT)
+        self.assertEqual(response.status_code, 200)
+        self.assertIn("immutable", response["Cache-Control"])
+        response = serve_media(request, "category/plain.png", settings.MEDIA_ROOT)
+        self.assertNotIn("immutable", response["Cache-Control"])
+
+    def test_dedupe_command(self):
+        for name in ("category/bg1.png", "category/bg1_ih656wn.png"):
+            default_storage.save(name, ContentFile(self.png("x.png", "red").read()))
+        Category.objects.create(name="A", category_banner_image="category/bg1.png")
+        Category.objects.create(name="B", category_banner_image="category/bg1_ih656wn.png")
+
+        category = Category.objects.get(name="A")
+        with self.settings(API_CACHE_ENABLED=True):
+            self.client.get(reverse("category_details", args=[category.id]))
+
+            out = io.StringIO()
+            call_command("dedupe_media", delete_originals=True, stdout=out)
+            names = set(Category.objects.values_list("category_banner_image", flat=True))
+            self.assertEqual(len(names), 1)
+            self.assertFalse(default_storage.exists("category/bg1.png"))
+            name = names.pop()
+            self.assertTrue(default_storage.exists(name))
+
+            # Cached responses and image variants follow the new name
+            response = self.client.get(reverse("category_details", args=[category.id]))
+            self.assertTrue(response.json()["category_banner_image"].endswith(name))
+        category.refresh_from_db()
+        self.assertEqual(category.banner_variants["source"], name)
+        self.assertIn("Built variants of 2 images", out.getvalue())
+
+
+class MediaServingTests(APITestCase):
+    def setUp(self):
+        super().setUp()
+        media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, media_root)
+        media = override_settings(MEDIA_ROOT=media_root)
+        media.enable()
+        self.addCleanup(media.disable)
+        default_storage.save("products/file.txt", ContentFile(b"0123456789"))
+
+    def test_whole_file(self):
+        response = self.client.get("/media/products/file.txt")
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(b"".join(response.streaming_content), b"0123456789")
+        self.assertEqual(response["Accept-Ranges"], "bytes")
+        self.assertIn("max-age=", response["Cache-Control"])
+
+        response = self.client.get(
+            "/media/products/file.txt", HTTP_IF_NONE_MATCH=response["ETag"]
+        )
+        self.assertEqual(response.status_code, 304)
+
+    def test_ranges(self):
+        response = self.client.get("/media/products/file.txt", HTTP_RANGE="bytes=2-4")
+        self.assertEqual(response.status_code, 206)
+        self.assertEqual(b"".join(response.streaming_content), b"234")
+        self.assertEqual(response["Content-Range"], "bytes 2-4/10")
+
+        response = self.client.get("/media/products/file.txt", HTTP_RANGE="bytes=-3")
+        self.assertEqual(b"".join(response.streaming_content), b"789")
+
+        response = self.client.get("/media/products/file.txt", HTTP_RANGE="bytes=20-")
+        self.assertEqual(response.status_code, 416)
+
+        # A stale If-Range gets the whole file
+        response = self.client.get(
+            "/media/products/file.txt", HTTP_RANGE="bytes=2-4", HTTP_IF_RANGE='"stale"'
+        )
+        self.assertEqual(response.status_code, 200)
+
+    def test_precompressed_copy(self):
+        default_storage.save("products/file.txt.gz", ContentFile(b"gzipped"))
+        response = self.client.get("/media/products/file.txt", HTTP_ACCEPT_ENCODING="gzip, br")
+        self.assertEqual(response["Content-Encoding"], "gzip")
+        self.assertEqual(response["Content-Type"], "text/plain")
+        self.assertEqual(b"".join(response.streaming_content), b"gzipped")
+
+        response = self.client.get("/media/products/file.txt")
+        self.assertNotIn("Content-Encoding", response)
+        self.assertIn("Accept-Encoding", response["Vary"])
+
+    @override_settings(MEDIA_SERVER="x-accel-redirect")
+    def test_accel_redirect(self):
+        response = self.client.get("/media/products/file.txt")
+        self.assertEqual(response["X-Accel-Redirect"], "/protected-media/products/file.txt")
+        self.assertEqual(response.content, b"")
+
+    @override_settings(MEDIA_SERVER="x-sendfile")
+    def test_offload_leaves_ranges_to_the_proxy(self):
+        for byte_range in ("bytes=2-4", "bytes=20-"):
+            response = self.client.get("/media/products/file.txt", HTTP_RANGE=byte_range)
+            self.assertEqual(response.status_code, 200)
+            self.assertTrue(response["X-Sendfile"].endswith("file.txt"))
+            self.assertNotIn("Content-Range", response)
+            self.assertEqual(response.content, b"")
+
+    def test_outside_media_root_is_not_found(self):
+        response = self.client.get("/media/../manage.py")
+        self.assertEqual(response.status_code, 404)
+        response = self.client.get("/media/products/missing.txt")
+        self.assertEqual(response.status_code, 404)
+
+
+class AsyncViewTests(APITestCase):
+    def setUp(self):
+        super().setUp()
+        self.factory = AsyncRequestFactory()
+
+    async def get_json(self, view, path, *args, headers=None):
+        response = await view(self.factory.get(path, headers=headers), *args)
+        return response, json.loads(response.content) if response.content else None
+
+    async def test_product_list_matches_sync_view(self):
+        await sync_to_async(create_catalog)(products=3)
+        path = reverse("product_list") + "?page_size=2"
+        response, data = await self.get_json(async_views.product_list, path)
+        self.assertEqual(response.status_code, 200)
+        expected = (await sync_to_async(self.client.get)(path)).json()
+        self.assertEqual(data, expected)
+
+        # Cached, and answers conditional requests
+        response, _ = await self.get_json(
+            async_views.product_list, path, headers={"If-None-Match": response["ETag"]}
+        )
+        self.assertEqual(response.status_code, 304)
+
+    async def test_product_details(self):
+        _, _, (product,) = await sync_to_async(create_catalog)(products=1)
+        path = reverse("product_details", args=[product.id])
+        response, data = await self.get_json(async_views.product_details, path, product.id)
+        self.assertEqual(data["id"], product.id)
+        self.assertEqual(len(data["thumbnails"]), 2)
+
+        response, data = await self.get_json(async_views.product_details, path, 999)
+        self.assertEqual(response.status_code, 404)
+        self.assertEqual(data["error"]["status_code"], 404)
+
+    async def test_invalid_category_is_bad_request(self):
+        path = reverse("product_list") + "?category=abc"
+        response, data = await self.get_json(async_views.product_list, path)
+        self.assertEqual(response.status_code, 400)
+        self.assertIn("category", data["error"]["details"])
+
+    async def test_category_list(self):
+        await sync_to_async(create_catalog)(products=2)
+        path = reverse("category_list") + "?include=products"
+        response, data = await self.get_json(async_views.category_list, path)
+        self.assertEqual(data["results"][0]["products_count"], 2)
+        self.assertIn("ETag", response)
+
+    async def test_cart_and_saved_data(self):
+        _, _, products = await sync_to_async(create_catalog)(products=2)
+        request = self.factory.post(
+            reverse("get_cart_data"),
+            [{"id": products[0].id, "qty": 2}],
+            content_type="application/json",
+        )
+        data = json.loads((await async_views.get_cart_data(request)).content)
+        self.assertEqual(data["subtotal"], 2000)
+
+        request = self.factory.post(
+            reverse("get_saved_data"), [p.id for p in products], content_type="application/json"
+        )
+        data = json.loads((await async_views.get_saved_data(request)).content)
+        self.assertEqual(len(data), 2)
+
+        request = self.factory.post(reverse("get_cart_data"), {}, content_type="application/json")
+        self.assertEqual((await async_views.get_cart_data(request)).status_code, 400)
+
+    async def test_other_methods_use_the_sync_view(self):
+        _, _, (product,) = await sync_to_async(create_catalog)(products=1)
+        request = self.factory.delete(reverse("product_details", args=[product.id]))
+        response = await async_views.product_details(request, product.id)
+        self.assertEqual(response.status_code, 204)
+        self.assertFalse(await Product.objects.filter(id=product.id).aexists())
+
+
+ADDRESS = {
+    "first_name": "Ada",
+    "last_name": "Obi",
+    "country": "Nigeria",
+    "state": "Lagos",
+    "postal_code": "100001",
+    "address_one": "1 Marina",
+    "address_two": "Lagos Island",
+}
+
+
+class AsyncMiddlewareTests(SimpleTestCase):
+    def async_settings(self):
+        # The settings module as loaded with API_ASYNC_VIEWS on
+        with mock.patch.dict(os.environ, {"API_ASYNC_VIEWS": "True"}):
+            spec = importlib.util.find_spec(settings.SETTINGS_MODULE)
+            module = importlib.util.module_from_spec(spec)
+            spec.loader.exec_module(module)
+        return module
+
+    def test_async_chain_is_never_adapted_to_sync(self):
+        middleware = self.async_settings().MIDDLEWARE
+        self.assertNotIn("whitenoise.middleware.WhiteNoiseMiddleware", middleware)
+        with override_settings(
+            MIDDLEWARE=middleware, METRICS=True, SERVER_TIMING=True, REQUEST_TRACE_SAMPLE_RATE=1
+        ), self.assertNoLogs("django.request", "DEBUG"):
+            handler = ASGIHandler()
+        self.assertTrue(iscoroutinefunction(handler._middleware_chain))
+
+
+class OrderPlacementTests(APITestCase):
+    def order(self, items):
+        return self.client.post(
+            reverse("order_list"),
+            {"items": items, "shipping_address": ADDRESS},
+            content_type="application/json",
+        )
+
+    def test_places_all_lines_and_takes_stock(self):
+        _, _, (first, second) = create_catalog(products=2, images=0)
+        response = self.order([{"id": second.id, "qty": 10}, {"id": first.id, "qty": 3}])
+        self.assertEqual(response.status_code, 201)
+        data = response.json()["data"]
+        self.assertEqual(data["subtotal"], 3 * 1000 + 10 * 1001)
+        self.assertEqual(len(data["lines"]), 2)
+        self.assertEqual(data["customer"]["first_name"], "Ada")
+
+        first.refresh_from_db()
+        second.refresh_from_db()
+        self.assertEqual((first.quantity_available, first.product_in_stock), (7, True))
+        self.assertEqual((second.quantity_available, second.product_in_stock), (0, False))
+
+    def test_short_line_rolls_back_the_whole_order(self):
+        _, _, (first, second) = create_catalog(products=2, images=0)
+        response = self.order([{"id": first.id, "qty": 1}, {"id": second.id, "qty": 11}])
+        self.assertEqual(response.status_code, 409)
+        self.assertEqual(
+            response.json()["unavailable"], [{"id": second.id, "requested": 11, "available": 10}]
+        )
+        first.refresh_from_db()
+        self.assertEqual(first.quantity_available, 10)
+        self.assertFalse(CustomerOrder.objects.exists())
+        self.assertFalse(Order.objects.exists())
+
+    def test_products_created_through_the_api_can_be_ordered(self):
+        category, condition, _ = create_catalog(products=0)
+        response = self.client.post(reverse("product_list"), {
+            "name": "Fresh stock",
+            "category": category.id,
+            "condition": condition.id,
+            "description": "Just in",
+            "price": 500,
+            "quantity_available": 5,
+        }, content_type="application/json")
+        self.assertEqual(response.status_code, 201)
+        self.assertTrue(response.json()["data"]["product_in_stock"])
+
+        product_id = response.json()["data"]["id"]
+        self.assertEqual(self.order([{"id": product_id, "qty": 5}]).status_code, 201)
+        self.assertEqual(self.order([{"id": product_id, "qty": 1}]).status_code, 409)
+
+    def test_in_stock_flag_follows_the_quantity(self):
+        _, _, (product,) = create_catalog(products=1, images=0)
+        payload = self.client.get(reverse("product_details", args=[product.id])).json()
+        payload.update(quantity_available=0, product_in_stock=True)
+        response = self.client.put(
+            reverse("product_details", args=[product.id]), payload, content_type="application/json"
+        )
+        self.assertEqual(response.status_code, 202)
+        product.refresh_from_db()
+        self.assertEqual((product.quantity_available, product.product_in_stock), (0, False))
+
+        response = self.client.patch(
+            reverse("product_bulk"), [{"id": product.id, "quantity_available": 3}],
+            content_type="application/json",
+        )
+        self.assertEqual(response.status_code, 200)
+        product.refresh_from_db()
+        self.assertEqual((product.quantity_available, product.product_in_stock), (3, True))
+
+    def test_lock_held_past_the_retries_is_service_unavailable(self):
+        _, _, (product,) = create_catalog(products=1, images=0)
+        with mock.patch("api.views.place_order", side_effect=OperationalError("database is locked")):
+            response = self.order([{"id": product.id, "qty": 1}])
+        self.assertEqual(response.status_code, 503)
+        self.assertEqual(response["Retry-After"], "1")
+        self.assertEqual(response.json()["error"]["status_code"], 503)
+
+    def test_invalid_payloads(self):
+        _, _, (product,) = create_catalog(products=1, images=0)
+        self.assertEqual(self.order([]).status_code, 400)
+        response = self.client.post(
+            reverse("order_list"),
+            {"items": [product.id], "shipping_address": {"first_name": "Ada"}},
+            content_type="application/json",
+        )
+        self.assertEqual(response.status_code, 400)
+        product.refresh_from_db()
+        self.assertEqual(product.quantity_available, 10)
+
+
+# The buyers retry below; place_order's own retries would only log
+class OrderConcurrencyTests(TransactionTestCase):
+    # on_commit callbacks run here; keep image variants out of it
+    @mock.patch("api.models.schedule_variants")
+    def test_concurrent_buyers_never_oversell(self, schedule_variants):
+        _, _, (product,) = create_catalog(products=1, images=0)
+        buyers = 100
+        barrier = threading.Barrier(buyers)
+        statuses = []
+
+        def buy():
+            # Through the view and retry_if_locked alone: a lock still held
+            # after the retries must come back as a 503, never a 500
+            client = Client()
+            barrier.wait()
+            try:
+                response = client.post(reverse("order_list"), {
+                    "items": [{"id": product.id, "qty": 1}], "shipping_address": ADDRESS,
+                }, content_type="application/json")
+                statuses.append(response.status_code)
+                if response.status_code == 503:
+                    self.assertEqual(response["Retry-After"], "1")
+            finally:
+                connection.close()
+
+        threads = [threading.Thread(target=buy) for _ in range(buyers)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(len(statuses), buyers)
+        self.assertLessEqual(set(statuses), {201, 409, 503})
+        placed = statuses.count(201)
+        self.assertGreater(placed, 0)
+        self.assertLessEqual(placed, 10)
+        # Turned away only once everything was sold
+        if 409 in statuses:
+            self.assertEqual(placed, 10)
+        product.refresh_from_db()
+        self.assertEqual(product.quantity_available, 10 - placed)
+        self.assertEqual(product.product_in_stock, placed < 10)
+        self.assertEqual(Order.objects.filter(product=product).count(), placed)
+
+
+class StockReservationTests(APITestCase):
+    def setUp(self):
+        super().setUp()
+        _, _, (self.product,) = create_catalog(products=1, images=0)
+
+    def reserve(self, qty, token=None):
+        payload = {"items": [{"id": self.product.id, "qty": qty}]}
+        if token:
+            payload["token"] = token
+        return self.client.post(reverse("reservation_list"), payload, content_type="application/json")
+
+    def cart_line(self, qty, token=None):
+        url = reverse("get_cart_data")
+        if token:
+            url += f"?reservation={token}"
+        response = self.client.post(
+            url, [{"id": self.product.id, "qty": qty}], content_type="application/json"
+        )
+        return response.json()["lines"][0]
+
+    def test_holds_are_set_aside_for_other_carts(self):
+        response = self.reserve(7)
+        self.assertEqual(response.status_code, 201)
+        token = response.json()["token"]
+
+        self.assertEqual(self.cart_line(3)["quantity_available"], 3)
+        self.assertFalse(self.cart_line(4)["available"])
+        self.assertEqual(self.cart_line(10, token)["quantity_available"], 10)
+
+        response = self.reserve(4)
+        self.assertEqual(response.status_code, 409)
+        self.assertEqual(response.json()["unavailable"][0]["available"], 3)
+        # Re-reserving under the same token replaces the holds
+        self.assertEqual(self.reserve(9, token).status_code, 201)
+        self.assertEqual(StockReservation.objects.get().quantity, 9)
+
+    def test_cart_stays_one_query(self):
+        reserve({self.product.id: 2})
+        with self.assertNumQueries(1):
+            self.cart_line(1)
+
+    def test_orders_respect_and_consume_holds(self):
+        token, _ = reserve({self.product.id: 8})
+        with self.assertRaises(OutOfStock) as raised:
+            place_order({self.product.id: 3}, ADDRESS)
+        self.assertEqual(raised.exception.unavailable[0]["available"], 2)
+
+        place_order({self.product.id: 8}, ADDRESS, token)
+        self.product.refresh_from_db()
+        self.assertEqual(self.product.quantity_available, 2)
+        self.assertFalse(StockReservation.objects.exists())
+
+    def test_expired_holds_are_released(self):
+        token, _ = reserve({self.product.id: 10})
+        StockReservation.objects.update(expires_at=timezone.now() - timedelta(seconds=1))
+        self.assertEqual(self.cart_line(10)["quantity_available"], 10)
+
+        out = io.StringIO()
+        call_command("release_expired_reservations", stdout=out)
+        self.assertIn("Released 1", out.getvalue())
+        self.assertFalse(StockReservation.objects.exists())
+
+        response = self.client.delete(reverse("reservation_details", args=[token]))
+        self.assertEqual(response.status_code, 204)
+
+
+@skipUnless(connection.vendor == "sqlite", "EXPLAIN QUERY PLAN is SQLite syntax")
+class QueryPlanTests(APITestCase):
+    """
+    Runs EXPLAIN QUERY PLAN on every query an endpoint makes and fails when
+    one falls back to reading a whole table to filter it, or to sorting every
+    matching row to return one page.
+    """
+
+    def setUp(self):
+        super().setUp()
+        self.category, self.condition, self.products = create_catalog(products=5)
+        self.tables = set(connection.introspection.table_names())
+
+    def explain(self, sql):
+        with connection.cursor() as cursor:
+            cursor.execute(f"EXPLAIN QUERY PLAN {sql}")
+            return [row[-1] for row in cursor.fetchall()]
+
+    def fallbacks(self, sql):
+        plan = self.explain(sql)
+        limited = " LIMIT " in sql
+        sorted_in_memory = "USE TEMP B-TREE FOR ORDER BY" in plan
+        # A LIMIT read in index order stops after one page; that scan is fine
+        ordered_walk = limited and not sorted_in_memory
+        problems = []
+        for step in plan:
+            match = re.match(r"SCAN (\S+)", step)
+            if not match or match.group(1) not in self.tables or "VIRTUAL TABLE" in step:
+                continue
+            # Unfiltered whole-table reads (exports, listing fingerprints) can't
+            # do better
+            if " WHERE " in sql and not ordered_walk:
+                problems.append(step)
+        reads_tables = any(
+            re.match(r"(SCAN|SEARCH) (\S+)", step)
+            and step.split()[1] in self.tables and "VIRTUAL TABLE" not in step
+            for step in plan
+        )
+        # Rows probed one by one from an indexed IN (subquery), e.g. facet
+        # filters, are already narrowed down before they are sorted
+        probed = "LIST SUBQUERY 1" in plan
+        if limited and sorted_in_memory and reads_tables and not probed and " GROUP BY " not in sql:
+            problems.append("USE TEMP B-TREE FOR ORDER BY")
+        return problems
+
+    def assertIndexedPlans(self, request):
+        with CaptureQueriesContext(connection) as queries:
+            response = request()
+            if response.streaming:
+                b"".join(response.streaming_content)
+        self.assertLess(response.status_code, 400)
+        for query in queries.captured_queries:
+            sql = query["sql"]
+            if not sql.startswith(("SELECT", "UPDATE", "DELETE")):
+                continue
+            with self.subTest(sql=sql):
+                self.assertEqual(self.fallbacks(sql), [], "\n".join(self.explain(sql)))
+
+    def test_catalog_reads_use_indexes(self):
+        product = self.products[0]
+        urls = [
+            reverse("product_list"),
+            reverse("product_list") + f"?category={self.category.id}&include=facets&prop.color=Red",
+            reverse("export_products", args=["csv"]),
+            reverse("product_details", args=[product.id]),
+            reverse("category_list") + "?include=products",
+            reverse("category_details", args=[self.category.id]) + "?include=products",
+            reverse("condition_list"),
+            reverse("condition_details", args=[self.condition.id]),
+        ]
+        for ordering in ["price", "-price", "ratings", "-ratings"]:
+            urls += [
+                reverse("product_list") + f"?ordering={ordering}",
+                reverse("product_list") + f"?ordering={ordering}&category={self.category.id}",
+            ]
+        for url in urls:
+            self.assertIndexedPlans(lambda: self.client.get(url))
+
+        # Later pages seek past the cursor instead of scanning
+        page = self.client.get(reverse("product_list") + "?ordering=-price&page_size=2").json()
+        self.assertIndexedPlans(lambda: self.client.get(page["next"]))
+
+    def test_checkout_writes_use_indexes(self):
+        product = self.products[0]
+        items = [{"id": product.id, "qty": 1}]
+        reserve({self.products[1].id: 1})
+
+        self.assertIndexedPlans(lambda: self.client.post(
+            reverse("get_cart_data"), items, content_type="application/json"
+        ))
+        self.assertIndexedPlans(lambda: self.client.post(
+            reverse("reservation_list"), {"items": items}, content_type="application/json"
+        ))
+        self.assertIndexedPlans(lambda: self.client.post(
+            reverse("order_list"),
+            {"items": items, "shipping_address": ADDRESS},
+            content_type="application/json",
+        ))
+
+    def test_unindexed_sort_is_reported(self):
+        sql = str(Product.objects.order_by("discount")[:10].query)
+        self.assertEqual(self.fallbacks(sql), ["USE TEMP B-TREE FOR ORDER BY"])
+        sql = str(Product.objects.filter(discount=5).query)
+        self.assertEqual(self.fallbacks(sql), ["SCAN api_product"])
+
+
+class BenchmarkScenarioTests(APITestCase):
+    def test_every_route_has_a_working_scenario(self):
+        seed_catalog(20, seed=1, images=2, progress=None)
+        self.assertEqual(Product.objects.count(), 20)
+        self.assertEqual(Image.objects.count(), 40)
+        self.assertTrue(ProductFacet.objects.exists())
+
+        all_scenarios = benchmark_routes.scenarios(benchmark_routes.catalog_sample())
+        self.assertEqual(benchmark_routes.missing_routes(all_scenarios), set())
+        for name, requests in all_scenarios.items():
+            for method, path, body in requests[:2]:
+                with self.subTest(name=name, path=path):
+                    response = self.client.generic(
+                        method, path, body or b"", content_type="application/json"
+                    )
+                    self.assertLess(response.status_code, 400)
+
+
+class RequestTraceTests(LiveServerTestCase):
+    def setUp(self):
+        tmp = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, tmp)
+        self.tmp = tmp
+        self.trace = f"{tmp}/requests-{{pid}}.jsonl"
+
+    def read_trace(self):
+        with open(self.trace.format(pid=os.getpid())) as trace:
+            return [json.loads(line) for line in trace]
+
+    # on_commit callbacks run here; keep image variants out of it
+    @mock.patch("api.models.schedule_variants")
+    def test_traces_are_recorded_and_replayed(self, schedule_variants):
+        _, _, (product,) = create_catalog(products=1, images=0)
+        cart = [{"id": product.id, "qty": 2}]
+        with override_settings(
+            REQUEST_TRACE_SAMPLE_RATE=1, REQUEST_TRACE_FILE=self.trace, REQUEST_TRACE_BODIES=True
+        ):
+            self.client.get(reverse("product_list") + "?ordering=price")
+            self.client.post(reverse("get_cart_data"), cart, content_type="application/json")
+            self.client.get(reverse("product_details", args=[product.id + 100]))
+
+        listing, priced, missing = self.read_trace()
+        self.assertEqual(listing["path"], reverse("product_list"))
+        self.assertEqual(listing["query"], "ordering=price")
+        self.assertIsNone(listing["body_sha256"])
+        self.assertGreater(listing["queries"], 0)
+        self.assertEqual(json.loads(priced["body"]), cart)
+        self.assertEqual(len(priced["body_sha256"]), 64)
+        self.assertEqual(missing["status"], 404)
+
+        # Replays the file of every worker by default
+        output = f"{self.tmp}/summary.json"
+        with override_settings(REQUEST_TRACE_FILE=self.trace):
+            call_command(
+                "replay_requests", url=self.live_server_url, rate=0,
+                output=output, stdout=io.StringIO(), stderr=io.StringIO(),
+            )
+        with open(output) as summary:
+            summary = json.load(summary)
+        self.assertEqual(
+            set(summary), {"GET product_list", "POST get_cart_data", "GET product_details"}
+        )
+        self.assertEqual(sum(row["status_mismatches"] + row["errors"] for row in summary.values()), 0)
+
+    async def test_async_requests_are_traced(self):
+        await sync_to_async(create_catalog)(products=2, images=0)
+        with override_settings(REQUEST_TRACE_SAMPLE_RATE=1, REQUEST_TRACE_FILE=self.trace):
+            await self.async_client.get(reverse("product_list"))
+        (record,) = self.read_trace()
+        self.assertEqual(record["status"], 200)
+        # Counted on the thread the queries ran on
+        self.assertGreater(record["queries"], 0)
+
+    def test_trace_paths_expand_globs_and_pids(self):
+        for name in ("requests-2.jsonl", "requests-1.jsonl", "requests-1.jsonl.1", "other.jsonl"):
+            open(f"{self.tmp}/{name}", "w").close()
+        self.assertEqual(
+            [os.path.basename(path) for path in trace_paths([self.trace + "*", f"{self.tmp}/other.jsonl"])],
+            ["requests-1.jsonl", "requests-1.jsonl.1", "requests-2.jsonl", "other.jsonl"],
+        )
+        with self.assertRaises(FileNotFoundError):
+            trace_paths([f"{self.tmp}/missing-*.jsonl"])
+
+    def test_tracing_is_off_by_default(self):
+        self.assertEqual(settings.REQUEST_TRACE_SAMPLE_RATE, 0)
+        with self.assertRaises(MiddlewareNotUsed):
+            RequestTraceMiddleware(lambda request: None)
+
+
+@override_settings(SERVER_TIMING=True)
+class ServerTimingTests(APITestCase):
+    def test_listing_reports_its_timings(self):
+        create_catalog(products=3)
+        with self.assertLogs("api.timing", "INFO") as logs:
+            response = self.client.get(reverse("product_list"))
+
+        metrics = dict(
+            metric.strip().split(";", 1) for metric in response["Server-Timing"].split(",")
+        )
+        self.assertEqual(set(metrics), {"db", "serialize", "render", "total"})
+        timings = logs.records[0].timings
+        self.assertEqual(timings["objects"], 3)
+        self.assertEqual(timings["repeated_queries"], [])
+        self.assertIn(f'desc="{timings["db_queries"]} queries"', metrics["db"])
+        self.assertGreater(timings["serialize_ms"], 0)
+        self.assertGreater(timings["render_ms"], 0)
+
+    async def test_async_requests_are_timed(self):
+        await sync_to_async(create_catalog)(products=3)
+        with self.assertLogs("api.timing", "INFO") as logs:
+            response = await self.async_client.get(reverse("product_list"))
+        self.assertIn("serialize;dur=", response["Server-Timing"])
+        timings = logs.records[0].timings
+        self.assertEqual(timings["objects"], 3)
+        self.assertGreater(timings["db_queries"], 0)
+
+    def test_query_per_row_is_flagged(self):
+        create_catalog(products=6, images=0)
+
+        def n_plus_one(request):
+            # Serializing without for_api() loads each category separately
+            products = Product.objects.order_by("id")
+            return Response(ProductSerializer(products, many=True).data)
+
+        view = api_view(["GET"])(n_plus_one)
+        middleware = ServerTimingMiddleware(view)
+        with self.assertLogs("api.timing", "WARNING") as logs:
+            response = middleware(APIRequestFactory().get("/"))
+
+        self.assertIn("n-plus-one", response["Server-Timing"])
+        self.assertIn("api_category x6", response["Server-Timing"])
+        self.assertIn("possible N+1", logs.output[0])
+
+
+@override_settings(API_CACHE_ENABLED=True)
+class MetricsTests(APITestCase):
+    def setUp(self):
+        super().setUp()
+        self.directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.directory)
+        overrides = override_settings(METRICS=True, METRICS_DIR=self.directory)
+        overrides.enable()
+        self.addCleanup(overrides.disable)
+        metrics.registry.reset()
+        self.addCleanup(metrics.registry.reset)
+
+    def scrape(self):
+        response = self.client.get("/metrics")
+        self.assertEqual(response["Content-Type"], metrics.CONTENT_TYPE)
+        return response.content.decode().splitlines()
+
+    def test_routes_queries_and_cache_are_counted(self):
+        create_catalog(products=2)
+        for _ in range(2):
+            self.client.get(reverse("product_list"))
+        self.client.get(reverse("product_details", args=[999]))
+
+        lines = self.scrape()
+        self.assertIn('api_requests_total{method="GET",route="product_list",status="200"} 2', lines)
+        self.assertIn('api_requests_total{method="GET",route="product_details",status="404"} 1', lines)
+        self.assertIn('api_request_duration_seconds_count{route="product_list"} 2', lines)
+        self.assertIn('api_request_duration_seconds_bucket{route="product_list",le="+Inf"} 2', lines)
+        self.assertIn('api_cache_requests_total{cache="product-list",result="hit"} 1', lines)
+        self.assertIn('api_cache_hit_ratio{cache="product-list"} 0.5', lines)
+        self.assertIn("# TYPE api_response_size_bytes histogram", lines)
+        queries = [line for line in lines if line.startswith('api_db_queries_total{route="product_list"}')]
+        self.assertGreater(int(queries[0].split()[-1]), 0)
+
+    async def test_async_requests_are_counted(self):
+        await sync_to_async(create_catalog)(products=2)
+        await self.async_client.get(reverse("product_list"))
+        lines = await sync_to_async(self.scrape)()
+        self.assertIn('api_requests_total{method="GET",route="product_list",status="200"} 1', lines)
+        queries = [line for line in lines if line.startswith('api_db_queries_total{route="product_list"}')]
+        self.assertGreater(int(queries[0].split()[-1]), 0)
+
+    def test_worker_processes_are_added_up(self):
+        self.client.get(reverse("condition_list"))
+        # What another worker flushed
+        with open(f"{self.directory}/metrics-1.json", "w") as other:
+            json.dump({
+                "counters": [[
+                    "api_requests_total",
+                    [["method", "GET"], ["route", "condition_list"], ["status", "200"]],
+                    4,
+                ]],
+                "histograms": [],
+            }, other)
+
+        self.assertIn(
+            'api_requests_total{method="GET",route="condition_list",status="200"} 5', self.scrape()
+        )
+
+    def test_files_outlive_reused_pids_until_the_server_restarts(self):
+        self.client.get(reverse("condition_list"))
+        # A process that got the same pid after this one exited
+        successor = metrics.Registry()
+        successor.inc("api_requests_total", metrics.labels(method="GET", route="condition_list", status=200))
+        successor.flush(self.directory)
+        self.assertIn(
+            'api_requests_total{method="GET",route="condition_list",status="200"} 2', self.scrape()
+        )
+
+        metrics.clear_metrics_dir(self.directory)
+        self.assertEqual(os.listdir(self.directory), [])
+
+    @override_settings(METRICS=False)
+    def test_endpoint_is_off_by_default(self):
+        self.assertEqual(self.client.get("/metrics").status_code, 404)
+
+
+class JSONRenderingTests(APITestCase):
+    payload = {
+        "price": 2 ** 62,
+        "big": 2 ** 70,
+        "decimal": Decimal("1.50"),
+        "updated_at": timezone.make_aware(datetime(2023, 7, 1, 12, 30, 15, 123456)),
+        "properties": [{"name": "colour", "value": "Grün "}],
+    }
+
+    def test_fast_renderer_matches_drf(self):
+        for data in (self.payload, {**self.payload, "big": 1}, {1: "non-string key"}):
+            self.assertEqual(renderers.JSONRenderer().render(data), JSONRenderer().render(data))
+
+    def test_non_finite_numbers_are_rejected(self):
+        for value in (float("nan"), float("inf"), -float("inf"), Decimal("NaN")):
+            data = {"properties": [{"name": "weight", "value": value}], "note": None}
+            with self.assertRaisesMessage(ValueError, "Out of range float values"):
+                renderers.JSONRenderer().render(data)
+            with mock.patch.object(renderers, "orjson", None):
+                with self.assertRaisesMessage(ValueError, "Out of range float values"):
+                    renderers.JSONRenderer().render(data)
+
+        # Without STRICT_JSON they are written like DRF does
+        fast, drf = renderers.JSONRenderer(), JSONRenderer()
+        fast.strict = drf.strict = False
+        data = {"value": float("nan"), "note": None}
+        self.assertEqual(fast.render(data), b'{"value":NaN,"note":null}')
+        self.assertEqual(fast.render(data), drf.render(data))
+
+    def test_stdlib_is_used_without_orjson(self):
+        with mock.patch.object(renderers, "orjson", None), mock.patch.object(parsers, "orjson", None):
+            body = renderers.JSONRenderer().render(self.payload)
+            self.assertEqual(body, JSONRenderer().render(self.payload))
+            self.assertEqual(parsers.JSONParser().parse(io.BytesIO(body))["big"], 2 ** 70)
+
+    def test_parser(self):
+        parser = parsers.JSONParser()
+        self.assertEqual(
+            parser.parse(io.BytesIO('{"price": 123456789012345678901234, "name": "Grün"}'.encode())),
+            {"price": 123456789012345678901234, "name": "Grün"},
+        )
+        with self.assertRaisesMessage(ParseError, "JSON parse error"):
+            parser.parse(io.BytesIO(b'{"price": NaN}'))
+
+    def test_api_accepts_and_returns_json(self):
+        create_catalog(products=1)
+        response = self.client.post(
+            reverse("get_cart_data"), json.dumps([{"id": Product.objects.get().id, "qty": 2}]),
+            content_type="application/json",
+        )
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response["Content-Type"], "application/json")
+
+
+@override_settings(SQLITE_WRITE_RETRIES=2, SQLITE_RETRY_BACKOFF=0)
+class SQLiteTuningTests(SimpleTestCase):
+    databases = {"default"}
+
+    @skipUnless(connection.vendor == "sqlite", "SQLite PRAGMAs")
+    def test_tuned_profile_is_applied_to_new_connections(self):
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        settings_dict = {**connection.settings_dict, "NAME": f"{directory}/tuned.sqlite3"}
+        for tuned, journal_mode in ((False, "delete"), (True, "wal")):
+            with override_settings(SQLITE_TUNED=tuned):
+                wrapper = type(connections["default"])(settings_dict)
+                with wrapper.cursor() as cursor:
+                    cursor.execute("PRAGMA journal_mode")
+                    self.assertEqual(cursor.fetchone()[0], journal_mode)
+                    cursor.execute("PRAGMA busy_timeout")
+                    busy_timeout = cursor.fetchone()[0]
+                wrapper.close()
+        self.assertEqual(busy_timeout, settings.SQLITE_BUSY_TIMEOUT)
+
+    def test_locked_writes_are_retried(self):
+        calls = []
+
+        @sqlite.retry_if_locked
+        def write(fail_times, message="database is locked"):
+            calls.append(1)
+            if len(calls) <= fail_times:
+                raise OperationalError(message)
+            return "written"
+
+        with self.assertLogs("api.sqlite", "WARNING") as logs:
+            self.assertEqual(write(2), "written")
+        self.assertEqual(len(calls), 3)
+        self.assertIn("retry 2", logs.output[-1])
+
+        calls.clear()
+        with self.assertLogs("api.sqlite", "WARNING"), self.assertRaises(OperationalError):
+            write(3)
+        self.assertEqual(len(calls), 3)
+
+        calls.clear()
+        with self.assertRaises(OperationalError):
+            write(1, "no such table: api_product")
+        self.assertEqual(len(calls), 1)
+
+        # Only the outermost transaction can start over
+        calls.clear()
+        with transaction.atomic(), self.assertRaises(OperationalError):
+            write(1)
+        self.assertEqual(len(calls), 1)
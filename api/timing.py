@@ -0,0 +1,156 @@
+import logging
+import re
+import time
+from collections import defaultdict
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from django.core.exceptions import MiddlewareNotUsed
+
+from .tracing import QueryStats
+
+
+logger = logging.getLogger(__name__)
+
+# Timings of the request being handled; None outside ServerTimingMiddleware
+current_timings = ContextVar('current_timings', default=None)
+
+TABLE_RE = re.compile(r'\bFROM "?(\w+)"?')
+
+
+class RequestTimings:
+    def __init__(self):
+        self.durations = defaultdict(float)
+        self.active = set()
+        # Objects the serializers turned into data
+        self.objects = 0
+
+
+@contextmanager
+def measure(name):
+    """
+    Adds the time spent in the block to the current request's `name` timing.
+    Only the outermost block counts when they nest (nested serializers, a
+    renderer calling another).
+    """
+    timings = current_timings.get()
+    if timings is None or name in timings.active:
+        yield timings
+        return
+    timings.active.add(name)
+    started = time.perf_counter()
+    try:
+        yield timings
+    finally:
+        timings.durations[name] += time.perf_counter() - started
+        timings.active.discard(name)
+
+
+class TimedSerializerMixin:
+    # Serializer time includes the queries the fields trigger, such as lazy
+    # loads from an N+1
+    def to_representation(self, instance):
+        with measure('serialize') as timings:
+            if timings is not None:
+                timings.objects += 1
+            return super().to_representation(instance)
+
+
+class TimedRendererMixin:
+    def render(self, *args, **kwargs):
+        with measure('render'):
+            return super().render(*args, **kwargs)
+
+
+def repeated_tables(repeated):
+    return ', '.join(
+        f"{match.group(1) if match else 'query'} x{count}"
+        for match, count in ((TABLE_RE.search(sql), count) for sql, count in repeated)
+    )
+
+
+def server_timing(queries, timings, total, repeated):
+    metrics = [
+        f'db;dur={queries.duration * 1000:.1f};desc="{queries.count} queries"',
+        f"serialize;dur={timings.durations['serialize'] * 1000:.1f}",
+        f"render;dur={timings.durations['render'] * 1000:.1f}",
+        f'total;dur={total * 1000:.1f}',
+    ]
+    if repeated:
+        metrics.append(f'n-plus-one;desc="{repeated_tables(repeated)}"')
+    return ', '.join(metrics)
+
+
+class ServerTimingMiddleware:
+    """
+    Times every request's SQL (count and time), serialization and rendering
+    (see the mixins above, used by api/serializers.py and api/renderers.py).
+    The result is sent in a Server-Timing header and logged to `api.timing`,
+    with the numbers as extra fields of the log record.
+
+    A SELECT run SERVER_TIMING_REPEATED_QUERIES times or more in one request
+    is what a query per result row looks like: such requests are also logged
+    as warnings and flagged with an `n-plus-one` metric. Off unless
+    SERVER_TIMING is set.
+    """
+
+    async_capable = True
+    sync_capable = True
+
+    def __init__(self, get_response):
+        if not settings.SERVER_TIMING:
+            raise MiddlewareNotUsed
+        self.get_response = get_response
+        self.repeat_threshold = settings.SERVER_TIMING_REPEATED_QUERIES
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        timings = RequestTimings()
+        token = current_timings.set(timings)
+        started = time.perf_counter()
+        try:
+            with QueryStats() as queries:
+                response = self.get_response(request)
+        finally:
+            current_timings.reset(token)
+        return self.report(request, response, queries, timings, time.perf_counter() - started)
+
+    async def __acall__(self, request):
+        timings = RequestTimings()
+        token = current_timings.set(timings)
+        started = time.perf_counter()
+        try:
+            async with QueryStats() as queries:
+                response = await self.get_response(request)
+        finally:
+            current_timings.reset(token)
+        return self.report(request, response, queries, timings, time.perf_counter() - started)
+
+    def report(self, request, response, queries, timings, total):
+        repeated = queries.repeated(self.repeat_threshold)
+        response['Server-Timing'] = server_timing(queries, timings, total, repeated)
+        record = {
+            'method': request.method,
+            'path': request.path,
+            'status': response.status_code,
+            'total_ms': round(total * 1000, 3),
+            'db_ms': round(queries.duration * 1000, 3),
+            'db_queries': queries.count,
+            'serialize_ms': round(timings.durations['serialize'] * 1000, 3),
+            'render_ms': round(timings.durations['render'] * 1000, 3),
+            'objects': timings.objects,
+            'repeated_queries': [{'sql': sql, 'count': count} for sql, count in repeated],
+        }
+        message = f"{request.method} {request.path} {response.status_code} {record['total_ms']}ms"
+        if repeated:
+            logger.warning(
+                f"{message}: possible N+1, {repeated_tables(repeated)}", extra={'timings': record}
+            )
+        else:
+            logger.info(message, extra={'timings': record})
+        return response
@@ -0,0 +1,175 @@
+import hashlib
+import json
+import logging
+import os
+import random
+import time
+from collections import Counter
+from contextlib import ExitStack
+from logging.handlers import RotatingFileHandler
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction, sync_to_async
+from django.conf import settings
+from django.core.exceptions import MiddlewareNotUsed
+from django.db import connections
+from django.utils import timezone
+
+
+# Request bodies of these types can be kept in the trace for replay
+TRACEABLE_CONTENT_TYPES = ('application/json',)
+
+
+class QueryStats:
+    """
+    Counts the queries run on every database connection of this thread, and
+    the time spent in them, while the context is open. `selects` counts each
+    SELECT statement (before parameters are filled in) separately.
+    """
+
+    def __init__(self):
+        self.count = 0
+        self.duration = 0.0
+        self.selects = Counter()
+
+    def __call__(self, execute, sql, params, many, context):
+        started = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.duration += time.perf_counter() - started
+            self.count += 1
+            if sql.startswith('SELECT'):
+                self.selects[sql] += 1
+
+    def repeated(self, threshold):
+        # [(sql, count)] of the SELECTs run at least `threshold` times
+        return [(sql, count) for sql, count in self.selects.most_common() if count >= threshold]
+
+    def __enter__(self):
+        self.stack = ExitStack()
+        for connection in connections.all():
+            self.stack.enter_context(connection.execute_wrapper(self))
+        return self
+
+    def __exit__(self, *exc_info):
+        return self.stack.__exit__(*exc_info)
+
+    # Async views run their queries through thread-sensitive sync_to_async,
+    # on the one sync thread of the request: the wrappers go on its connections
+    async def __aenter__(self):
+        return await sync_to_async(self.__enter__)()
+
+    async def __aexit__(self, *exc_info):
+        return await sync_to_async(self.__exit__)(*exc_info)
+
+
+def trace_logger(path):
+    """
+    A logger appending to `path` (with '{pid}' replaced, so every worker
+    process writes and rotates its own file) through a RotatingFileHandler.
+    """
+    path = path.format(pid=os.getpid())
+    logger = logging.getLogger(f'api.tracing.{path}')
+    if not logger.handlers:
+        os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+        handler = RotatingFileHandler(
+            path,
+            maxBytes=settings.REQUEST_TRACE_MAX_BYTES,
+            backupCount=settings.REQUEST_TRACE_BACKUPS,
+            encoding='utf-8',
+        )
+        handler.setFormatter(logging.Formatter('%(message)s'))
+        logger.addHandler(handler)
+        logger.setLevel(logging.INFO)
+        logger.propagate = False
+    return logger
+
+
+def request_body(request):
+    # Uploads are left to the upload handlers: reading them here would buffer
+    # them whole and trip DATA_UPLOAD_MAX_MEMORY_SIZE
+    limit = settings.DATA_UPLOAD_MAX_MEMORY_SIZE
+    try:
+        length = int(request.META.get('CONTENT_LENGTH') or 0)
+    except ValueError:
+        return None
+    if request.content_type == 'multipart/form-data' or (limit is not None and length > limit):
+        return None
+    return request.body
+
+
+def trace_record(request, body, response, started_at, duration, queries, keep_body):
+    content_type = request.content_type
+    record = {
+        'ts': started_at.isoformat(),
+        'method': request.method,
+        'path': request.path,
+        'query': request.META.get('QUERY_STRING', ''),
+        'content_type': content_type if body else None,
+        'body_sha256': hashlib.sha256(body).hexdigest() if body else None,
+        'status': response.status_code,
+        'duration_ms': round(duration * 1000, 3),
+        'queries': queries,
+    }
+    if not response.streaming:
+        record['response_bytes'] = len(response.content)
+    if body and keep_body and content_type in TRACEABLE_CONTENT_TYPES:
+        record['body'] = body.decode('utf-8', 'replace')
+    return record
+
+
+class RequestTraceMiddleware:
+    """
+    Appends a sample of requests (REQUEST_TRACE_SAMPLE_RATE) to the JSONL
+    trace REQUEST_TRACE_FILE: what was asked, how long it took and how many
+    queries it ran. `manage.py replay_requests` plays a trace back against a
+    server. Request bodies are only hashed unless REQUEST_TRACE_BODIES is set,
+    since orders carry shipping addresses. Off when the rate is 0.
+    """
+
+    async_capable = True
+    sync_capable = True
+
+    def __init__(self, get_response):
+        self.sample_rate = settings.REQUEST_TRACE_SAMPLE_RATE
+        if self.sample_rate <= 0:
+            raise MiddlewareNotUsed
+        self.get_response = get_response
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        if random.random() >= self.sample_rate:
+            return self.get_response(request)
+
+        # Read now: the view may consume the stream
+        body = request_body(request)
+        started_at = timezone.now()
+        started = time.perf_counter()
+        with QueryStats() as queries:
+            response = self.get_response(request)
+        self.log(request, body, response, started_at, time.perf_counter() - started, queries)
+        return response
+
+    async def __acall__(self, request):
+        if random.random() >= self.sample_rate:
+            return await self.get_response(request)
+
+        body = request_body(request)
+        started_at = timezone.now()
+        started = time.perf_counter()
+        async with QueryStats() as queries:
+            response = await self.get_response(request)
+        self.log(request, body, response, started_at, time.perf_counter() - started, queries)
+        return response
+
+    def log(self, request, body, response, started_at, duration, queries):
+        record = trace_record(
+            request, body, response, started_at, duration, queries.count,
+            settings.REQUEST_TRACE_BODIES,
+        )
+        trace_logger(settings.REQUEST_TRACE_FILE).info(
+            json.dumps(record, separators=(',', ':'))
+        )
@@ -1,3 +1,4 @@
+from django.conf import settings
 from django.urls import path
 from .views import (
     product_list,
@@ -7,17 +8,37 @@ from .views import (
     category_details,
     get_saved_data,
     condition_list,
-    condition_details
+    condition_details,
+    export_products,
+    product_bulk,
+    order_list,
+    reservation_list,
+    reservation_details
 )
 
+# Native async catalog views for ASGI servers (see api/async_views.py)
+if settings.API_ASYNC_VIEWS:
+    from .async_views import (
+        product_list,
+        product_details,
+        category_list,
+        get_cart_data,
+        get_saved_data,
+    )
+
 urlpatterns = [
     path('product/', product_list, name="product_list"),
     path('product/<int:id>/', product_details, name="product_details"),
+    path('product/bulk/', product_bulk, name="product_bulk"),
     path('category/', category_list, name="category_list"),
     path('category/<int:id>/', category_details, name="category_details"),
     path('condition/', condition_list, name="condition_list"),
     path('condition/<int:id>/', condition_details, name="condition_details"),
     path('cart/', get_cart_data, name="get_cart_data"),
     path('saved/', get_saved_data, name="get_saved_data"),
+    path('order/', order_list, name="order_list"),
+    path('reservation/', reservation_list, name="reservation_list"),
+    path('reservation/<str:token>/', reservation_details, name="reservation_details"),
+    path('export/products.<str:file_format>', export_products, name="export_products"),
 ]
 
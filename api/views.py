@@ -1,6 +1,7 @@
 from django.shortcuts import get_object_or_404
-from django.http import Http404
+from django.http import Http404, StreamingHttpResponse
 from rest_framework.decorators import api_view
+from rest_framework.exceptions import ValidationError
 from rest_framework.response import Response
 from rest_framework import status
 
@@ -8,33 +9,135 @@ from rest_framework import status
 from .models import (
     Product,
     Category,
-    Condition
+    Condition,
+    CATEGORY_PRODUCTS_FIELDS,
 )
 
+# Property filters and facet counts
+from .facets import property_filters, filter_by_properties, facet_counts, category_facet_names
+
+# Rendered response cache
+from .cache import cached_response
+
+# ETag / Last-Modified fingerprints
+from .conditional import conditional_response
+from .fingerprints import (
+    product_validators,
+    product_list_validators,
+    category_validators,
+    category_list_validators,
+    condition_validators,
+    condition_list_validators,
+)
+
+# Bulk writes
+from .bulk import bulk_create_products, bulk_update_products
+
+# Streaming catalog export
+from .export import EXPORT_FORMATS, export_lines
+
+# Cart pricing
+from .cart import parse_cart, price_cart
+
+# Order placement and checkout stock reservations
+from .orders import OutOfStock, place_order
+from .reservations import release, reserve
+
+# Pagination
+from .pagination import KeysetPagination, ProductPagination, SearchPagination
+
 # Serializers
 from .serializers import (
     ProductSerializer,
     CategorySerializer,
-    ConditionSerializer
+    ConditionSerializer,
+    CustomerOrderSerializer,
+    ShippingAddressSerializer,
+    sparse_fields,
 )
 
 
 # Create your views here.
 
+def requested_includes(request):
+    # Optional, more expensive parts of a response are opt-in:
+    # ?include=products on categories, ?include=facets on products
+    return set(request.query_params.get('include', '').split(','))
+
+
+def requested_category(request):
+    # The ?category= id the listing is narrowed to, or None
+    category_id = request.query_params.get('category')
+    if category_id is None:
+        return None
+    try:
+        category_id = int(category_id)
+    except ValueError:
+        category_id = None
+    # Also out of range for a database integer
+    if category_id is None or not -2 ** 63 <= category_id < 2 ** 63:
+        raise ValidationError({'category': ['A valid integer is required.']})
+    return category_id
+
+
+def embeds_products(request, fields):
+    # Categories embed products on ?include=products, unless the sparse
+    # fieldset leaves out all of their fields
+    return 'products' in requested_includes(request) and (
+        fields is None or bool(fields & CATEGORY_PRODUCTS_FIELDS)
+    )
+
+
+def product_queryset(request):
+    # The listing before property filters, search and pagination
+    fields = sparse_fields(request.query_params, ProductSerializer)
+    if fields is not None:
+        # The pagination reads the ordering of the last product on the page
+        fields = fields | set(ProductPagination.ordering_fields)
+    products = Product.objects.for_api(fields)
+    category_id = requested_category(request)
+    if category_id is not None:
+        products = products.filter(category_id=category_id)
+    return products
+
+
+def list_products(request):
+    searched_term = request.query_params.get('search')
+    category_id = requested_category(request)
+
+    filters = property_filters(request.query_params)
+
+    products = product_queryset(request)
+    unfiltered_products = products
+    products = filter_by_properties(products, filters)
+    
+    # Searches are ranked by relevance instead of the ?ordering= param
+    if searched_term is not None:
+        paginator = SearchPagination(searched_term)
+    else:
+        paginator = ProductPagination()
+    page = paginator.paginate_queryset(products, request)
+    serializer = ProductSerializer(page, many=True, context={
+        'fields': sparse_fields(request.query_params, ProductSerializer),
+    })
+    response = paginator.get_paginated_response(serializer.data)
+
+    # Facet counts cover the whole (property-unfiltered) listing, so they
+    # are not available for relevance-ranked searches
+    if 'facets' in requested_includes(request) and searched_term is None:
+        names = category_facet_names(category_id) if category_id is not None else None
+        response.data['facets'] = facet_counts(unfiltered_products, filters, names)
+    return response
+
+
 @api_view(['GET', 'POST'])
 def product_list(request):
     if request.method == "GET":
-        
-        searched_term = request.query_params.get('search')
-        
-        if searched_term is not None:
-            products = Product.objects.filter(name__icontains=searched_term).all()
-            serializer = ProductSerializer(products, many=True)
-            return Response(serializer.data, status=status.HTTP_200_OK)
-        
-        products = Product.objects.all()
-        serializer = ProductSerializer(products, many=True)
-        return Response(serializer.data, status=status.HTTP_200_OK)
+        return cached_response(
+            request, ['product-list'],
+            lambda: list_products(request),
+            lambda: product_list_validators(request, product_queryset(request)),
+        )
     
     if request.method == "POST":
         payload = request.data
@@ -51,17 +154,74 @@ def product_list(request):
         
         return Response(serializer.error, status=status.HTTP_400_BAD_REQUEST)
     
+# Bulk create (POST) and update (PUT, PATCH) of up to MAX_BULK_PRODUCTS
+# products. Items are validated one by one and invalid ones are reported by
+# index while the valid ones are written.
+@api_view(['POST', 'PUT', 'PATCH'])
+def product_bulk(request):
+    items = request.data
+    serializer = ProductSerializer(
+        data=items, many=True, partial=request.method == 'PATCH'
+    )
+    serializer.is_valid(raise_exception=True)
+    errors = list(serializer.item_errors)
+
+    if request.method == 'POST':
+        valid_items = serializer.valid_items
+        products = bulk_create_products([data for _, data in valid_items])
+        success_status = status.HTTP_201_CREATED
+        message = f'{len(products)} products were created successfully.'
+    else:
+        ids = [item.get('id') if isinstance(item, dict) else None for item in items]
+        instances = Product.objects.in_bulk(
+            [id for id in ids if isinstance(id, int) and not isinstance(id, bool)]
+        )
+        valid_items = []
+        for index, data in serializer.valid_items:
+            instance = instances.get(ids[index])
+            if instance is None:
+                errors.append({'index': index, 'errors': {'id': ['Product not found.']}})
+            else:
+                valid_items.append((index, (instance, data)))
+        products = bulk_update_products([pair for _, pair in valid_items])
+        success_status = status.HTTP_200_OK
+        message = f'{len(products)} products were updated successfully.'
+
+    errors.sort(key=lambda error: error['index'])
+    if errors and not products:
+        success_status = status.HTTP_400_BAD_REQUEST
+    return Response({
+        'status_code': success_status,
+        'message': message,
+        'data': [
+            {'index': index, 'id': product.id}
+            for (index, _), product in zip(valid_items, products)
+        ],
+        'errors': errors,
+    }, status=success_status)
+
+
+def show_product(request, id):
+    fields = sparse_fields(request.query_params, ProductSerializer)
+    product = get_object_or_404(Product.objects.for_api(fields), id=id)
+    serializer = ProductSerializer(product, many=False, context={'fields': fields})
+    return Response(serializer.data, status=status.HTTP_200_OK)
+
+
 @api_view(['GET', 'PUT', 'DELETE'])
 def product_details(request, id):
+    if request.method == 'GET':
+        return cached_response(
+            request, [f'product:{id}', 'catalog-meta'],
+            lambda: show_product(request, id),
+            lambda: product_validators(request, id),
+        )
+
     try:
-        product = get_object_or_404(Product, id=id)
+        product = get_object_or_404(Product.objects.for_api(), id=id)
     except Product.DoesNotExist:
         raise Http404
     
-    if request.method == 'GET':
-        serializer = ProductSerializer(product, many=False)
-        return Response(serializer.data, status=status.HTTP_200_OK)
-    
     if request.method == 'PUT':
         serializer = ProductSerializer(product, data=request.data)
         if serializer.is_valid(raise_exception=True):
@@ -75,12 +235,22 @@ def product_details(request, id):
     
 
 # Condition Views
+def list_conditions(request):
+    conditions = Condition.objects.all()
+    paginator = KeysetPagination()
+    page = paginator.paginate_queryset(conditions, request)
+    serializer = ConditionSerializer(page, many=True)
+    return paginator.get_paginated_response(serializer.data)
+
+
 @api_view(['POST', 'GET'])
 def condition_list(request):
     if request.method == "GET":
-        conditions = Condition.objects.all()
-        serializer = ConditionSerializer(conditions, many=True)
-        return Response(serializer.data, status=status.HTTP_200_OK)
+        return conditional_response(
+            request,
+            lambda: condition_list_validators(request),
+            lambda: list_conditions(request),
+        )
     
     if request.method == "POST":
         payload = request.data
@@ -95,16 +265,28 @@ def condition_list(request):
         return Response(serializer.error, status=status.HTTP_400_BAD_REQUEST)
 
 
+def show_condition(id):
+    try:
+        condition = Condition.objects.get(id=id)
+    except Condition.DoesNotExist:
+        raise Http404
+    serializer = ConditionSerializer(condition, many=False)
+    return Response(serializer.data, status=status.HTTP_200_OK)
+
+
 @api_view(['POST', 'GET'])
 def condition_details(request, id):
+    if request.method == 'GET':
+        return conditional_response(
+            request,
+            lambda: condition_validators(request, id),
+            lambda: show_condition(id),
+        )
+
     try:
         condition = Condition.objects.get(id=id)
     except Condition.DoesNotExist:
         raise Http404
-    
-    if request.method == 'GET':
-        serializer = ConditionSerializer(condition, many=False)
-        return Response(serializer.data, status=status.HTTP_200_OK)
 
     if request.method == 'PUT':
         serializer = ConditionSerializer(condition, data=request.data)
@@ -121,12 +303,29 @@ def condition_details(request, id):
 
 
 # Category views
+def list_categories(request, with_products):
+    fields = sparse_fields(request.query_params, CategorySerializer)
+    category = Category.objects.for_api(fields, with_products)
+    paginator = KeysetPagination()
+    page = paginator.paginate_queryset(category, request)
+    serializer = CategorySerializer(page, many=True, context={
+        'request': request,
+        'include_products': with_products,
+        'fields': fields,
+    })
+    return paginator.get_paginated_response(serializer.data)
+
+
 @api_view(['POST', 'GET'])
 def category_list(request):
     if request.method == 'GET':
-        category = Category.objects.all()
-        serializer = CategorySerializer(category, many=True)
-        return Response(serializer.data, status=status.HTTP_200_OK)
+        fields = sparse_fields(request.query_params, CategorySerializer)
+        with_products = embeds_products(request, fields)
+        return conditional_response(
+            request,
+            lambda: category_list_validators(request, with_products),
+            lambda: list_categories(request, with_products),
+        )
     
     if request.method == 'POST':
         payload = request.data
@@ -140,17 +339,38 @@ def category_list(request):
             }, status=status.HTTP_201_CREATED)
         return Response(serializer.error, status=status.HTTP_400_BAD_REQUEST)
 
+def show_category(request, id):
+    fields = sparse_fields(request.query_params, CategorySerializer)
+    with_products = embeds_products(request, fields)
+    try:
+        category = Category.objects.for_api(fields, with_products).get(id=id)
+    except Category.DoesNotExist:
+        raise Http404
+
+    serializer = CategorySerializer(category, many=False, context={
+        'request': request,
+        'include_products': with_products,
+        'fields': fields,
+    })
+    return Response(serializer.data, status=status.HTTP_200_OK)
+
+
 @api_view(['GET', 'PUT', 'DELETE'])
 def category_details(request, id):
+    if request.method == 'GET':
+        fields = sparse_fields(request.query_params, CategorySerializer)
+        with_products = embeds_products(request, fields)
+        return cached_response(
+            request, [f'category:{id}'],
+            lambda: show_category(request, id),
+            lambda: category_validators(request, id, with_products),
+        )
+
     try:
         category = Category.objects.get(id=id)
     except Category.DoesNotExist:
         raise Http404
     
-    if request.method == 'GET':
-        serializer = CategorySerializer(category, many=False)
-        return Response(serializer.data, status=status.HTTP_200_OK)
-    
     if request.method == 'PUT':
         serializer = CategorySerializer(category, data=request.data)
         if serializer.is_valid(raise_exception=True):
@@ -163,20 +383,73 @@ def category_details(request, id):
         return Response({}, status=status.HTTP_204_NO_CONTENT)
 
 
-#  Cart data information derived from a list of product ids
+#  Cart pricing derived from a list of {id, qty} lines (or bare product ids)
 @api_view(['POST'])
 def get_cart_data(request):
-    # The payload should be a list of number
+    # The payload should be a list of {"id": 1, "qty": 2} objects
     # sent in json format
-    cart_data_ids_list = request.data
-    
-    if (isinstance(cart_data_ids_list, list)):
-        cart_items_data = Product.objects.filter(id__in=cart_data_ids_list)
-        serializer = ProductSerializer(cart_items_data, many=True)
-        return Response(serializer.data, status=status.HTTP_200_OK)
+    # ?reservation=<token>: the cart's own holds count as available
+    cart = parse_cart(request.data)
+    token = request.query_params.get('reservation')
+    return Response(price_cart(cart, token=token), status=status.HTTP_200_OK)
+
+# Places a whole cart for a shipping address, taking the stock atomically
+@api_view(['POST'])
+def order_list(request):
+    # {"items": [{"id": 1, "qty": 2}], "shipping_address": {"first_name": ...},
+    #  "reservation": "<token>"}, the reservation being optional
+    payload = request.data if isinstance(request.data, dict) else {}
+    cart = parse_cart(payload.get('items'))
+    if not cart:
+        raise ValidationError({'items': ['An order needs at least one product.']})
+    address = ShippingAddressSerializer(data=payload.get('shipping_address'))
+    address.is_valid(raise_exception=True)
+
+    try:
+        order = place_order(cart, address.validated_data, payload.get('reservation'))
+    except OutOfStock as exc:
+        return Response({
+            'detail': 'Some products are not available in the requested quantity.',
+            'unavailable': exc.unavailable,
+        }, status=status.HTTP_409_CONFLICT)
+
+    serializer = CustomerOrderSerializer(order)
     return Response({
-        "detail": "invalid datatype. Must be a list or array of product ids"
-    }, status=status.HTTP_400_BAD_REQUEST)
+        'status_code': 201,
+        'message': 'Order was placed successfully.',
+        'data': serializer.data
+    }, status=status.HTTP_201_CREATED)
+
+# Holds the stock of a cart in checkout for RESERVATION_TTL seconds
+@api_view(['POST'])
+def reservation_list(request):
+    # {"items": [{"id": 1, "qty": 2}], "token": "<token>"}; sending the token
+    # of an existing reservation replaces its holds and extends it
+    payload = request.data if isinstance(request.data, dict) else {}
+    cart = parse_cart(payload.get('items'))
+    token = payload.get('token')
+    if token is not None and (not isinstance(token, str) or len(token) > 32):
+        raise ValidationError({'token': ['Invalid reservation token.']})
+
+    try:
+        token, expires_at = reserve(cart, token)
+    except OutOfStock as exc:
+        return Response({
+            'detail': 'Some products are not available in the requested quantity.',
+            'unavailable': exc.unavailable,
+        }, status=status.HTTP_409_CONFLICT)
+
+    return Response({
+        'token': token,
+        'expires_at': expires_at,
+        'lines': [{'id': id, 'quantity': quantity} for id, quantity in cart.items()],
+    }, status=status.HTTP_201_CREATED)
+
+
+@api_view(['DELETE'])
+def reservation_details(request, token):
+    release(token)
+    return Response({}, status=status.HTTP_204_NO_CONTENT)
 
 # Saved data derived from a list of product ids
 @api_view(['POST'])
@@ -186,16 +459,28 @@ def get_saved_data(request):
     saved_data_ids_list = request.data
 
     if (isinstance(saved_data_ids_list, list)):
-        saved_items_data = Product.objects.filter(id__in=saved_data_ids_list)
-        serializer = ProductSerializer(saved_items_data, many=True)
+        fields = sparse_fields(request.query_params, ProductSerializer)
+        saved_items_data = Product.objects.for_api(fields).filter(id__in=saved_data_ids_list)
+        serializer = ProductSerializer(saved_items_data, many=True, context={'fields': fields})
         return Response(serializer.data, status=status.HTTP_200_OK)
     return Response({
         "detail": "invalid datatype. Must be a list or array of product ids"
     }, status=status.HTTP_400_BAD_REQUEST)
 
 
+# Streams the whole catalog (optionally one ?category=) as NDJSON or CSV
+@api_view(['GET'])
+def export_products(request, file_format):
+    if file_format not in EXPORT_FORMATS:
+        raise Http404
+    category_id = requested_category(request)
+    products = Product.objects.all()
+    if category_id is not None:
+        products = products.filter(category_id=category_id)
 
-
-
-
-
+    response = StreamingHttpResponse(
+        export_lines(products, file_format),
+        content_type=EXPORT_FORMATS[file_format],
+    )
+    response['Content-Disposition'] = f'attachment; filename="products.{file_format}"'
+    return response
@@ -0,0 +1,4 @@
+"""
+Performance benchmarks for the API. Run them as modules from the project
+root, e.g. `python -m benchmarks.run` (see benchmarks/run.py).
+"""
@@ -0,0 +1,154 @@
+"""
+Compares the sync (WSGI) and native async (ASGI) catalog views under load.
+
+Start the same project twice, e.g.
+
+    gunicorn ecommerce_backend.wsgi -w 4 --threads 8 -b 127.0.0.1:8000
+    API_ASYNC_VIEWS=1 uvicorn ecommerce_backend.asgi:application --workers 4 --port 8001
+
+then run
+
+    python benchmarks/async_views.py \\
+        --target wsgi=http://127.0.0.1:8000 --target asgi=http://127.0.0.1:8001 \\
+        --connections 500 --duration 30
+
+Every connection is a keep-alive HTTP/1.1 client cycling through the async
+routes; requests/sec and latency percentiles are printed per target. Only
+the standard library is needed.
+"""
+import argparse
+import asyncio
+import json
+import time
+import urllib.request
+from urllib.parse import urlsplit
+
+
+def routes(base_url):
+    # Product ids to request, taken from the first page of the catalog
+    with urllib.request.urlopen(f'{base_url}/api/product/?page_size=20') as response:
+        ids = [product['id'] for product in json.load(response)['results']]
+    if not ids:
+        raise SystemExit(f'{base_url} has no products; seed the database first')
+    cart = json.dumps([{'id': id, 'qty': 1} for id in ids[:5]]).encode()
+    saved = json.dumps(ids[:10]).encode()
+    return [
+        ('GET', '/api/product/', None),
+        ('GET', '/api/product/?page_size=50&ordering=-price', None),
+        ('GET', f'/api/product/{ids[0]}/', None),
+        ('GET', '/api/category/?include=products', None),
+        ('POST', '/api/cart/', cart),
+        ('POST', '/api/saved/', saved),
+    ]
+
+
+def encode_request(host, method, path, body):
+    lines = [f'{method} {path} HTTP/1.1', f'Host: {host}', 'Accept: application/json']
+    if body is not None:
+        lines += ['Content-Type: application/json', f'Content-Length: {len(body)}']
+    return ('\r\n'.join(lines) + '\r\n\r\n').encode() + (body or b'')
+
+
+async def read_response(reader):
+    status_line = await reader.readline()
+    if not status_line:
+        raise ConnectionError('connection closed')
+    status = int(status_line.split()[1])
+    headers = {}
+    while True:
+        line = await reader.readline()
+        if line in (b'\r\n', b''):
+            break
+        name, _, value = line.decode('latin-1').partition(':')
+        headers[name.strip().lower()] = value.strip()
+
+    if headers.get('transfer-encoding') == 'chunked':
+        while True:
+            size = int((await reader.readline()).split(b';')[0], 16)
+            await reader.readexactly(size + 2)
+            if size == 0:
+                break
+    else:
+        await reader.readexactly(int(headers.get('content-length', 0)))
+    return status, headers.get('connection') == 'close'
+
+
+async def client(url, requests, deadline, offset, latencies, errors):
+    parts = urlsplit(url)
+    reader = writer = None
+    index = offset
+    while time.monotonic() < deadline:
+        try:
+            if writer is None:
+                reader, writer = await asyncio.open_connection(parts.hostname, parts.port or 80)
+            started = time.perf_counter()
+            writer.write(requests[index % len(requests)])
+            index += 1
+            status, closed = await read_response(reader)
+            latencies.append(time.perf_counter() - started)
+            if status >= 400:
+                errors.append(status)
+            if closed:
+                writer.close()
+                writer = None
+        except (OSError, ValueError, asyncio.IncompleteReadError) as exc:
+            errors.append(type(exc).__name__)
+            if writer is not None:
+                writer.close()
+            writer = None
+            await asyncio.sleep(0.01)
+    if writer is not None:
+        writer.close()
+
+
+def percentile(values, fraction):
+    if not values:
+        return float('nan')
+    values = sorted(values)
+    return values[min(int(len(values) * fraction), len(values) - 1)]
+
+
+async def run(url, connections, duration, route_list=None):
+    # route_list: [(method, path, body)], the catalog routes by default
+    host = urlsplit(url).netloc
+    requests = [encode_request(host, *route) for route in route_list or routes(url)]
+    latencies, errors = [], []
+    started = time.monotonic()
+    deadline = started + duration
+    await asyncio.gather(*[
+        client(url, requests, deadline, offset, latencies, errors)
+        for offset in range(connections)
+    ])
+    elapsed = time.monotonic() - started
+    return {
+        'requests': len(latencies),
+        'rps': len(latencies) / elapsed,
+        'p50_ms': percentile(latencies, 0.50) * 1000,
+        'p95_ms': percentile(latencies, 0.95) * 1000,
+        'p99_ms': percentile(latencies, 0.99) * 1000,
+        'errors': len(errors),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument(
+        '--target', action='append', required=True, metavar='NAME=URL',
+        help='Server to benchmark; repeat to compare several.'
+    )
+    parser.add_argument('--connections', '-c', type=int, default=500)
+    parser.add_argument('--duration', '-d', type=float, default=30)
+    args = parser.parse_args()
+
+    print(f"{'target':<10} {'requests':>9} {'req/s':>9} {'p50 ms':>9} {'p99 ms':>9} {'errors':>7}")
+    for target in args.target:
+        name, _, url = target.partition('=')
+        result = asyncio.run(run(url.rstrip('/'), args.connections, args.duration))
+        print(
+            f"{name:<10} {result['requests']:>9} {result['rps']:>9.1f} "
+            f"{result['p50_ms']:>9.1f} {result['p99_ms']:>9.1f} {result['errors']:>7}"
+        )
+
+
+if __name__ == '__main__':
+    main()
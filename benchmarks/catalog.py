@@ -0,0 +1,105 @@
+"""
+Seeded synthetic catalog for the benchmarks: categories, conditions and
+products with property JSON, their albums and images. The same size and seed
+always give the same catalog, from a thousand products up to millions.
+"""
+import random
+import sys
+
+from api.bulk import BULK_BATCH_SIZE, bulk_create_products
+from api.models import Category, Condition, Image, ImageAlbum
+
+
+PRODUCTS_PER_CATEGORY = 500
+IMAGES_PER_PRODUCT = 3
+
+CONDITIONS = ['New', 'Used', 'Refurbished', 'Open box']
+
+# Facets offered by every category: {name: values}
+PROPERTIES = {
+    'color': ['Black', 'White', 'Red', 'Blue', 'Green', 'Silver', 'Gold'],
+    'size': ['XS', 'S', 'M', 'L', 'XL', 'XXL'],
+    'brand': [f'Brand {i}' for i in range(50)],
+    'material': ['Cotton', 'Leather', 'Steel', 'Plastic', 'Wood', 'Glass'],
+}
+
+# Words product names and descriptions are made of, so searches find matches
+WORDS = [
+    'wireless', 'portable', 'classic', 'premium', 'compact', 'smart', 'vintage',
+    'ultra', 'lightweight', 'durable', 'phone', 'laptop', 'speaker', 'jacket',
+    'watch', 'camera', 'backpack', 'headphones', 'lamp', 'chair', 'keyboard',
+    'monitor', 'sneakers', 'bottle', 'charger', 'tablet', 'blender', 'kettle',
+]
+
+
+def category_data(index):
+    return {
+        'name': f'Category {index}',
+        'category_banner_image': f'category/banner-{index % 10}.png',
+        'category_thumbnail_image': f'category/thumbnail-{index % 10}.png',
+        'properties': [{'name': name, 'value': values} for name, values in PROPERTIES.items()],
+    }
+
+
+def product_data(rng, index, categories, conditions):
+    name = ' '.join(rng.choice(WORDS) for _ in range(3)).title()
+    price = rng.randrange(500, 500_000)
+    discount = rng.choice([0, 0, 0, 5, 10, 25])
+    quantity = rng.choice([0, rng.randrange(1, 50), rng.randrange(50, 1000)])
+    return {
+        'name': f'{name} {index}',
+        'category': categories[index % len(categories)],
+        'condition': rng.choice(conditions),
+        'description': ' '.join(rng.choice(WORDS) for _ in range(rng.randrange(10, 40))),
+        'price': price * (100 - discount) // 100,
+        'previous_price': price,
+        'discount': discount,
+        'quantity_available': quantity,
+        'product_in_stock': quantity > 0,
+        'free_shipping': rng.random() < 0.3,
+        'ratings': rng.randrange(1, 6),
+        'properties': [
+            {'name': name, 'value': rng.choice(values)}
+            for name, values in PROPERTIES.items()
+            if rng.random() < 0.8
+        ],
+    }
+
+
+def seed_catalog(products, seed=0, images=IMAGES_PER_PRODUCT, batch_size=BULK_BATCH_SIZE,
+                 progress=sys.stderr):
+    """
+    Bulk-creates `products` products spread over one category per
+    PRODUCTS_PER_CATEGORY of them, each with `images` images, through
+    api/bulk.py so albums, facets and the search index are filled in too.
+    """
+    rng = random.Random(seed)
+    categories = Category.objects.bulk_create([
+        Category(**category_data(index))
+        for index in range(max(1, products // PRODUCTS_PER_CATEGORY))
+    ])
+    conditions = Condition.objects.bulk_create([Condition(name=name) for name in CONDITIONS])
+
+    for start in range(0, products, batch_size):
+        stop = min(start + batch_size, products)
+        created = bulk_create_products([
+            product_data(rng, index, categories, conditions) for index in range(start, stop)
+        ])
+        album_ids = ImageAlbum.objects.filter(
+            product__in=created
+        ).order_by('id').values_list('id', flat=True)
+        Image.objects.bulk_create([
+            Image(
+                name=f'Image {position}',
+                album_id=album_id,
+                image=f'Image_Albums/images/bench-{rng.randrange(100)}.png',
+            )
+            for album_id in album_ids
+            for position in range(images)
+        ])
+        if progress is not None:
+            progress.write(f'\rSeeded {stop}/{products} products')
+            progress.flush()
+    if progress is not None:
+        progress.write('\n')
+    return {'products': products, 'categories': len(categories), 'images': products * images}
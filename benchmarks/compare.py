@@ -0,0 +1,63 @@
+"""
+Compares two benchmarks/run.py result files, route by route.
+
+    python -m benchmarks.compare before.json after.json --threshold 10
+
+Exits with status 1 when a route got slower (p95) or its throughput fell by
+more than the threshold percentage, or when it makes more SQL queries.
+"""
+import argparse
+import json
+
+
+def change(before, after):
+    if not before or after is None:
+        return None
+    return (after - before) / before * 100
+
+
+def compare(before, after, threshold):
+    rows, regressions = [], []
+    for section in ('routes', 'live'):
+        old = before.get(section) or {}
+        new = after.get(section) or {}
+        if section == 'live':
+            old, new = old.get('routes', {}), new.get('routes', {})
+        for name in sorted(old.keys() & new.keys()):
+            rps = change(old[name]['rps'], new[name]['rps'])
+            p95 = change(old[name]['p95_ms'], new[name]['p95_ms'])
+            queries = (old[name].get('queries'), new[name].get('queries'))
+            rows.append((section, name, rps, p95, queries))
+            if (rps is not None and rps < -threshold) or (p95 is not None and p95 > threshold) \
+                    or (None not in queries and queries[1] > queries[0]):
+                regressions.append(f'{section}/{name}')
+    return rows, regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('before')
+    parser.add_argument('after')
+    parser.add_argument('--threshold', type=float, default=10,
+                        help='Percentage change reported as a regression.')
+    args = parser.parse_args()
+
+    with open(args.before) as before, open(args.after) as after:
+        before, after = json.load(before), json.load(after)
+    print(f"{before.get('commit')} -> {after.get('commit')}")
+    print(f"{'route':<34} {'req/s':>9} {'p95':>9} {'queries':>9}")
+    rows, regressions = compare(before, after, args.threshold)
+    for section, name, rps, p95, (old_queries, new_queries) in rows:
+        queries = '-' if old_queries is None else f'{old_queries}->{new_queries}'
+        print(
+            f"{section + '/' + name:<34} "
+            f"{'-' if rps is None else f'{rps:+.1f}%':>9} "
+            f"{'-' if p95 is None else f'{p95:+.1f}%':>9} {queries:>9}"
+        )
+    if regressions:
+        print(f"\nRegressed: {', '.join(regressions)}")
+        raise SystemExit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,84 @@
+"""
+Compares DRF's stdlib JSON renderer and parser with the ones in
+api/renderers.py and api/parsers.py on product list payloads.
+
+    python -m benchmarks.json_rendering --sizes 1000 10000
+
+The products are serialized once from the seeded catalog (see
+benchmarks/run.py) with ProductSerializer, as the product list returns
+them; only rendering the data to bytes and parsing the bytes back are
+timed. Both renderers must produce the same bytes.
+"""
+import argparse
+import statistics
+import tempfile
+import time
+from pathlib import Path
+
+from benchmarks.run import setup_database
+
+
+def median_ms(function, repeat):
+    timings = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        function()
+        timings.append((time.perf_counter() - started) * 1000)
+    return statistics.median(timings)
+
+
+def product_payload(size):
+    from api.models import Product
+    from api.serializers import ProductSerializer
+
+    products = Product.objects.for_api().order_by('id')[:size]
+    if len(products) < size:
+        raise SystemExit(f'The catalog has only {len(products)} products; use --products {size}')
+    return {'count': size, 'next': None, 'previous': None,
+            'results': ProductSerializer(products, many=True).data}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--sizes', type=int, nargs='+', default=[1000, 10000],
+                        help='Products per payload.')
+    parser.add_argument('--products', '-n', type=int,
+                        help='Catalog size (default: the largest payload).')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--reseed', action='store_true')
+    parser.add_argument('--repeat', '-r', type=int, default=20,
+                        help='Timed runs per payload; the median is printed.')
+    args = parser.parse_args()
+    args.products = args.products or max(args.sizes)
+
+    with tempfile.TemporaryDirectory(prefix='benchmark-') as tmp:
+        setup_database(args, Path(tmp) / 'catalog.sqlite3')
+
+        import io
+        from rest_framework import parsers, renderers
+        from api import parsers as api_parsers, renderers as api_renderers
+        if api_renderers.orjson is None:
+            print('orjson is not installed: the api classes fall back to the stdlib')
+
+        stdlib_renderer, fast_renderer = renderers.JSONRenderer(), api_renderers.FastJSONRenderer()
+        stdlib_parser, fast_parser = parsers.JSONParser(), api_parsers.JSONParser()
+
+        print(f"{'products':>8} {'MB':>6} {'render std':>11} {'render fast':>12} {'x':>5} "
+              f"{'parse std':>10} {'parse fast':>11} {'x':>5}")
+        for size in args.sizes:
+            data = product_payload(size)
+            body = stdlib_renderer.render(data)
+            if fast_renderer.render(data) != body:
+                raise SystemExit(f'The renderers disagree on the {size} products payload')
+
+            render_std = median_ms(lambda: stdlib_renderer.render(data), args.repeat)
+            render_fast = median_ms(lambda: fast_renderer.render(data), args.repeat)
+            parse_std = median_ms(lambda: stdlib_parser.parse(io.BytesIO(body)), args.repeat)
+            parse_fast = median_ms(lambda: fast_parser.parse(io.BytesIO(body)), args.repeat)
+            print(f'{size:>8} {len(body) / 1e6:>6.2f} {render_std:>9.2f}ms {render_fast:>10.2f}ms '
+                  f'{render_std / render_fast:>5.1f} {parse_std:>8.2f}ms {parse_fast:>9.2f}ms '
+                  f'{parse_std / parse_fast:>5.1f}')
+
+
+if __name__ == '__main__':
+    main()
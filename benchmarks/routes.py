@@ -0,0 +1,102 @@
+"""
+The requests the benchmarks send: at least one scenario per route in
+api/urls.py, built from ids found in the seeded catalog.
+"""
+import json
+
+from django.urls import URLPattern
+
+from api import urls
+from api.models import Category, Condition, Product
+
+
+# Reservations are re-made under this token, so holds don't pile up
+RESERVATION_TOKEN = 'benchmark'
+
+SHIPPING_ADDRESS = {
+    'first_name': 'Bench',
+    'last_name': 'Mark',
+    'country': 'Nigeria',
+    'state': 'Lagos',
+    'postal_code': '100001',
+    'address_one': '1 Load Street',
+    'address_two': 'Ikoyi',
+}
+
+
+def route_names():
+    return {
+        pattern.name for pattern in urls.urlpatterns if isinstance(pattern, URLPattern)
+    }
+
+
+def catalog_sample(count=50):
+    # The best stocked products are ordered from, so a long run doesn't sell out
+    stocked = list(Product.objects.filter(product_in_stock=True).order_by(
+        '-quantity_available'
+    ).values_list('id', flat=True)[:count])
+    if not stocked:
+        raise SystemExit('The catalog has no products in stock; seed it first')
+    return {
+        'products': list(Product.objects.order_by('id').values_list('id', flat=True)[:count]),
+        'stocked': stocked,
+        'category': Category.objects.order_by('id').values_list('id', flat=True).first(),
+        'condition': Condition.objects.order_by('id').values_list('id', flat=True).first(),
+    }
+
+
+def body(data):
+    return json.dumps(data).encode()
+
+
+def scenarios(sample):
+    """
+    {name: [(method, path, body)]}; a scenario cycles through its requests.
+    Names are a route name from api/urls.py, optionally followed by
+    ':variant'.
+    """
+    products, stocked = sample['products'], sample['stocked']
+    category, condition = sample['category'], sample['condition']
+    cart = [{'id': id, 'qty': 1} for id in products[:5]]
+    return {
+        'product_list': [('GET', '/api/product/', None)],
+        'product_list:price': [('GET', '/api/product/?ordering=-price&page_size=50', None)],
+        'product_list:category': [('GET', f'/api/product/?category={category}&ordering=ratings', None)],
+        'product_list:facets': [
+            ('GET', f'/api/product/?category={category}&include=facets&prop.color=Red', None)
+        ],
+        'product_list:search': [('GET', '/api/product/?search=wireless+speaker', None)],
+        'product_list:fields': [
+            ('GET', '/api/product/?fields=id,name,price,thumbnails&page_size=50', None)
+        ],
+        'product_details': [('GET', f'/api/product/{id}/', None) for id in products],
+        'product_bulk': [('PATCH', '/api/product/bulk/', body([
+            {'id': id, 'ratings': 1 + id % 5} for id in products[:10]
+        ]))],
+        'category_list': [('GET', '/api/category/', None)],
+        'category_list:products': [('GET', '/api/category/?include=products', None)],
+        'category_details': [('GET', f'/api/category/{category}/?include=products', None)],
+        'condition_list': [('GET', '/api/condition/', None)],
+        'condition_details': [('GET', f'/api/condition/{condition}/', None)],
+        'get_cart_data': [('POST', '/api/cart/', body(cart))],
+        'get_saved_data': [('POST', '/api/saved/', body(products[:10]))],
+        'reservation_list': [
+            ('POST', '/api/reservation/', body({
+                'items': [{'id': id, 'qty': 1}], 'token': RESERVATION_TOKEN
+            }))
+            for id in stocked
+        ],
+        'reservation_details': [('DELETE', f'/api/reservation/{RESERVATION_TOKEN}/', None)],
+        'order_list': [
+            ('POST', '/api/order/', body({
+                'items': [{'id': id, 'qty': 1}],
+                'shipping_address': SHIPPING_ADDRESS,
+            }))
+            for id in stocked
+        ],
+        'export_products': [('GET', f'/api/export/products.ndjson?category={category}', None)],
+    }
+
+
+def missing_routes(scenario_names):
+    return route_names() - {name.split(':')[0] for name in scenario_names}
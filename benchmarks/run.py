@@ -0,0 +1,298 @@
+"""
+Benchmarks every route in api/urls.py against a seeded synthetic catalog.
+
+    python -m benchmarks.run --products 100000
+    python -m benchmarks.run --products 10000 --server gunicorn --workers 4
+    python -m benchmarks.compare before.json after.json
+
+The catalog is generated once per size and seed into benchmarks/.data/ and
+copied for each run, so runs never touch db.sqlite3 and always start from
+the same data. Each scenario (see benchmarks/routes.py) is driven through
+the Django test client, recording latency percentiles, throughput and SQL
+queries per request. With --server the same scenarios are also run under
+load against a local gunicorn or uvicorn serving the copy. Results,
+including the commit they were measured at and peak RSS, are written as
+JSON.
+"""
+import argparse
+import asyncio
+import json
+import os
+import platform
+import resource
+import shutil
+import signal
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+import urllib.request
+from datetime import datetime, timezone
+from pathlib import Path
+
+
+BASE_DIR = Path(__file__).resolve().parent.parent
+DATA_DIR = BASE_DIR / 'benchmarks' / '.data'
+RESULTS_DIR = BASE_DIR / 'benchmarks' / 'results'
+
+SERVERS = {
+    'gunicorn': lambda port, workers: [
+        sys.executable, '-m', 'gunicorn', 'ecommerce_backend.wsgi',
+        '--workers', str(workers), '--threads', '4', '--bind', f'127.0.0.1:{port}',
+    ],
+    'uvicorn': lambda port, workers: [
+        sys.executable, '-m', 'uvicorn', 'ecommerce_backend.asgi:application',
+        '--workers', str(workers), '--port', str(port), '--log-level', 'warning',
+    ],
+}
+
+
+def peak_rss_kb(who=resource.RUSAGE_SELF):
+    peak = resource.getrusage(who).ru_maxrss
+    # bytes on macOS, kilobytes on Linux
+    return peak // 1024 if sys.platform == 'darwin' else peak
+
+
+def percentile(values, fraction):
+    if not values:
+        return None
+    values = sorted(values)
+    return values[min(int(len(values) * fraction), len(values) - 1)]
+
+
+def latency_summary(latencies, elapsed, errors):
+    return {
+        'requests': len(latencies),
+        'rps': len(latencies) / elapsed if elapsed else None,
+        'p50_ms': percentile(latencies, 0.50) * 1000,
+        'p95_ms': percentile(latencies, 0.95) * 1000,
+        'p99_ms': percentile(latencies, 0.99) * 1000,
+        'errors': errors,
+    }
+
+
+def git_commit():
+    try:
+        commit = subprocess.run(
+            ['git', 'rev-parse', '--short', 'HEAD'],
+            cwd=BASE_DIR, capture_output=True, text=True, check=True,
+        ).stdout.strip()
+        dirty = subprocess.run(
+            ['git', 'status', '--porcelain', '--untracked-files=no'],
+            cwd=BASE_DIR, capture_output=True, text=True, check=True,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+    return f'{commit}-dirty' if dirty else commit
+
+
+def setup_database(args, database):
+    """
+    Points Django at `database`, a copy of the seeded catalog, seeding and
+    caching the catalog first when this size and seed were never generated.
+    """
+    seeded = DATA_DIR / f'catalog-{args.products}-{args.seed}.sqlite3'
+    if seeded.exists() and not args.reseed:
+        shutil.copyfile(seeded, database)
+
+    os.environ['DATABASE_NAME'] = str(database)
+    os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'ecommerce_backend.settings')
+    import django
+    django.setup()
+    from django.core.management import call_command
+    from django.db import connection
+
+    # Also brings an older cached catalog up to the current migrations
+    call_command('migrate', verbosity=0)
+    if seeded.exists() and not args.reseed:
+        return None
+
+    from benchmarks.catalog import seed_catalog
+    started = time.perf_counter()
+    seed_catalog(args.products, seed=args.seed)
+    seconds = time.perf_counter() - started
+    connection.close()
+    DATA_DIR.mkdir(parents=True, exist_ok=True)
+    shutil.copyfile(database, seeded)
+    return seconds
+
+
+def run_in_process(scenarios, iterations, cold):
+    from django.core.cache import cache
+    from django.db import connection
+    from django.test import Client
+    from django.test.utils import CaptureQueriesContext, override_settings
+
+    client = Client(SERVER_NAME='localhost', HTTP_ACCEPT='application/json')
+    results = {}
+    # A single process, so the locmem response cache is correct here
+    with override_settings(DEBUG=False, ALLOWED_HOSTS=['localhost'], API_CACHE_ENABLED=True):
+        for name, requests in scenarios.items():
+            latencies, queries, errors = [], [], 0
+            started = time.perf_counter()
+            for index in range(iterations):
+                method, path, body = requests[index % len(requests)]
+                if cold:
+                    cache.clear()
+                with CaptureQueriesContext(connection) as captured:
+                    sent = time.perf_counter()
+                    response = client.generic(
+                        method, path, body or b'', content_type='application/json'
+                    )
+                    if response.streaming:
+                        b''.join(response.streaming_content)
+                    latencies.append(time.perf_counter() - sent)
+                queries.append(len(captured))
+                errors += response.status_code >= 400
+            results[name] = latency_summary(latencies, time.perf_counter() - started, errors)
+            results[name].update({
+                'queries': percentile(queries, 0.50),
+                'max_queries': max(queries),
+                'peak_rss_kb': peak_rss_kb(),
+            })
+            print_row(name, results[name])
+    return results
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+def wait_until_up(url, process, timeout=30):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if process.poll() is not None:
+            raise SystemExit(f'The server exited with status {process.returncode}')
+        try:
+            with urllib.request.urlopen(f'{url}/api/condition/', timeout=1):
+                return
+        except OSError:
+            time.sleep(0.2)
+    raise SystemExit(f'The server did not answer at {url} within {timeout}s')
+
+
+def run_server(args, scenarios, database):
+    from benchmarks import async_views
+    from django.db import connections
+    connections.close_all()
+
+    port = free_port()
+    url = f'http://127.0.0.1:{port}'
+    env = dict(os.environ, DATABASE_NAME=str(database))
+    if args.server == 'uvicorn':
+        env['API_ASYNC_VIEWS'] = '1'
+    process = subprocess.Popen(
+        SERVERS[args.server](port, args.workers), cwd=BASE_DIR, env=env,
+        stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+    )
+    results = {}
+    try:
+        wait_until_up(url, process)
+        for name, requests in scenarios.items():
+            results[name] = asyncio.run(async_views.run(
+                url, args.connections, args.duration, requests
+            ))
+            print_row(name, results[name])
+    finally:
+        process.send_signal(signal.SIGTERM)
+        process.wait(timeout=30)
+    # The workers are reaped by the server, whose peak includes theirs
+    return {
+        'server': args.server,
+        'workers': args.workers,
+        'connections': args.connections,
+        'duration': args.duration,
+        'peak_rss_kb': peak_rss_kb(resource.RUSAGE_CHILDREN),
+        'routes': results,
+    }
+
+
+def print_row(name, result):
+    queries = result.get('queries')
+    print(
+        f"{name:<26} {result['requests']:>8} {result['rps']:>9.1f} "
+        f"{result['p50_ms']:>8.2f} {result['p95_ms']:>8.2f} {result['p99_ms']:>8.2f} "
+        f"{'-' if queries is None else queries:>7} {result['errors']:>6}"
+    )
+
+
+def print_header(title):
+    print(f'\n{title}')
+    print(
+        f"{'route':<26} {'requests':>8} {'req/s':>9} {'p50 ms':>8} {'p95 ms':>8} "
+        f"{'p99 ms':>8} {'queries':>7} {'errors':>6}"
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--products', '-n', type=int, default=1000,
+                        help='Catalog size, from 1000 up to 1000000.')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--reseed', action='store_true',
+                        help='Regenerate the cached catalog for this size and seed.')
+    parser.add_argument('--iterations', '-i', type=int, default=200,
+                        help='Test client requests per scenario.')
+    parser.add_argument('--cold', action='store_true',
+                        help='Clear the response cache before every request.')
+    parser.add_argument('--only', action='append', metavar='SCENARIO',
+                        help='Run only these scenarios; repeatable.')
+    parser.add_argument('--server', choices=sorted(SERVERS),
+                        help='Also load test a local server of this kind.')
+    parser.add_argument('--workers', type=int, default=4)
+    parser.add_argument('--connections', '-c', type=int, default=50)
+    parser.add_argument('--duration', '-d', type=float, default=10,
+                        help='Seconds of server load per scenario.')
+    parser.add_argument('--output', '-o', help='JSON file for the results.')
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory(prefix='benchmark-') as tmp:
+        database = Path(tmp) / 'catalog.sqlite3'
+        seed_seconds = setup_database(args, database)
+
+        from benchmarks.routes import catalog_sample, missing_routes, scenarios
+        all_scenarios = scenarios(catalog_sample())
+        missing = missing_routes(all_scenarios)
+        if missing:
+            raise SystemExit(f"No benchmark scenario for: {', '.join(sorted(missing))}")
+        selected = {
+            name: requests for name, requests in all_scenarios.items()
+            if not args.only or name in args.only
+        }
+
+        import django
+        from django.db import connection
+        commit = git_commit()
+        report = {
+            'commit': commit,
+            'date': datetime.now(timezone.utc).isoformat(timespec='seconds'),
+            'python': platform.python_version(),
+            'django': django.get_version(),
+            'database': connection.vendor,
+            'products': args.products,
+            'seed': args.seed,
+            'seed_seconds': seed_seconds,
+            'iterations': args.iterations,
+            'cold_cache': args.cold,
+        }
+
+        print_header(f'test client, {args.products} products')
+        report['routes'] = run_in_process(selected, args.iterations, args.cold)
+        report['peak_rss_kb'] = peak_rss_kb()
+        if args.server:
+            print_header(f'{args.server}, {args.workers} workers, {args.connections} connections')
+            report['live'] = run_server(args, selected, database)
+
+    output = Path(args.output) if args.output else (
+        RESULTS_DIR / f"{report['date'][:10]}-{commit or 'unknown'}-{args.products}.json"
+    )
+    output.parent.mkdir(parents=True, exist_ok=True)
+    output.write_text(json.dumps(report, indent=2) + '\n')
+    print(f'\nResults written to {output}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,135 @@
+"""
+Compares the stock and the tuned (SQLITE_TUNED) SQLite setup under
+concurrent reads and writes from several processes.
+
+    python -m benchmarks.sqlite_concurrency --readers 4 --writers 2 --duration 10
+
+Each profile gets a fresh copy of the seeded catalog (see benchmarks/run.py)
+and its own reader and writer processes, driving the API views through the
+Django test client with the response cache off. Readers cycle through
+product and category listings and product pages, writers through bulk
+product updates, stock reservations and orders (benchmarks/routes.py).
+Requests/sec, latency percentiles and failed requests (5xx, mostly
+"database is locked") are printed per profile and role.
+"""
+import argparse
+import multiprocessing
+import os
+import shutil
+import sqlite3
+import tempfile
+import time
+from pathlib import Path
+
+from benchmarks.run import latency_summary, setup_database
+
+
+READS = ['product_list', 'product_list:price', 'product_details', 'category_list:products']
+WRITES = ['product_bulk', 'reservation_list', 'reservation_details', 'order_list']
+
+PROFILES = {
+    'stock': {'SQLITE_TUNED': 'False'},
+    'tuned': {'SQLITE_TUNED': 'True'},
+}
+
+
+def worker(env, names, start, duration, results):
+    os.environ.update(env)
+    import django
+    django.setup()
+    from django.test import Client
+    from django.test.utils import override_settings
+    from benchmarks.routes import catalog_sample, scenarios
+
+    all_scenarios = scenarios(catalog_sample())
+    requests = [request for name in names for request in all_scenarios[name]]
+    client = Client(SERVER_NAME='localhost', HTTP_ACCEPT='application/json')
+    latencies, errors, index = [], 0, os.getpid()
+    start.wait()
+    started = time.perf_counter()
+    with override_settings(DEBUG=False, ALLOWED_HOSTS=['localhost']):
+        while time.perf_counter() - started < duration:
+            method, path, body = requests[index % len(requests)]
+            index += 1
+            sent = time.perf_counter()
+            try:
+                response = client.generic(method, path, body or b'', content_type='application/json')
+                errors += response.status_code >= 500
+            except Exception:
+                errors += 1
+            latencies.append(time.perf_counter() - sent)
+    results.put((env['ROLE'], latencies, time.perf_counter() - started, errors))
+
+
+def run_profile(name, catalog, args, tmp):
+    database = Path(tmp) / f'{name}.sqlite3'
+    shutil.copyfile(catalog, database)
+    if name == 'stock':
+        # The journal mode is stored in the file; start from SQLite's default
+        with sqlite3.connect(database) as raw:
+            raw.execute('PRAGMA journal_mode = DELETE')
+
+    context = multiprocessing.get_context('spawn')
+    start, results = context.Event(), context.Queue()
+    env = dict(
+        PROFILES[name], DATABASE_NAME=str(database),
+        CACHE_BACKEND='django.core.cache.backends.dummy.DummyCache',
+        DJANGO_SETTINGS_MODULE='ecommerce_backend.settings',
+    )
+    processes = [
+        context.Process(target=worker, args=(
+            dict(env, ROLE=role), names, start, args.duration, results
+        ))
+        for role, names, count in (('read', READS, args.readers), ('write', WRITES, args.writers))
+        for _ in range(count)
+    ]
+    for process in processes:
+        process.start()
+    # Lets every worker finish importing Django before the clock starts
+    time.sleep(args.warmup)
+    start.set()
+
+    by_role = {'read': ([], 0.0, 0), 'write': ([], 0.0, 0)}
+    for _ in processes:
+        role, latencies, elapsed, errors = results.get()
+        previous, longest, failed = by_role[role]
+        by_role[role] = (previous + latencies, max(longest, elapsed), failed + errors)
+    for process in processes:
+        process.join()
+
+    for role, (latencies, elapsed, errors) in by_role.items():
+        if latencies:
+            row = latency_summary(latencies, elapsed, errors)
+            print(f"{name:<6} {role:<6} {row['requests']:>8} {row['rps']:>8.1f} "
+                  f"{row['p50_ms']:>8.2f} {row['p95_ms']:>8.2f} {row['p99_ms']:>8.2f} {errors:>7}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--products', '-n', type=int, default=10000)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--reseed', action='store_true')
+    parser.add_argument('--readers', type=int, default=4, help='Reading processes.')
+    parser.add_argument('--writers', type=int, default=2, help='Writing processes.')
+    parser.add_argument('--duration', '-d', type=float, default=10,
+                        help='Seconds of load per profile.')
+    parser.add_argument('--warmup', type=float, default=3,
+                        help='Seconds the workers get to start up.')
+    parser.add_argument('--profile', action='append', choices=sorted(PROFILES),
+                        help='Run only these profiles; repeatable.')
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory(prefix='benchmark-') as tmp:
+        catalog = Path(tmp) / 'catalog.sqlite3'
+        setup_database(args, catalog)
+        from django.db import connection
+        connection.close()
+
+        print(f"{'profile':<6} {'role':<6} {'requests':>8} {'req/s':>8} "
+              f"{'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8} {'5xx':>7}")
+        for name in args.profile or PROFILES:
+            run_profile(name, catalog, args, tmp)
+
+
+if __name__ == '__main__':
+    main()
@@ -57,13 +57,24 @@ INSTALLED_APPS = [
     'api.apps.ApiConfig',
 ]
 
+# Serve the catalog and cart views with their native async versions; only
+# worth it under an ASGI server (ecommerce_backend/asgi.py). Every middleware
+# must then be async-capable, or Django runs the whole chain on one thread:
+# WhiteNoise isn't, so static files have to be served by the proxy instead
+# (from STATIC_ROOT, after collectstatic).
+API_ASYNC_VIEWS = config('API_ASYNC_VIEWS', default=False, cast=bool)
+
 MIDDLEWARE = [
+    # Outermost, so a traced request's timing covers the whole stack
+    'api.tracing.RequestTraceMiddleware',
+    'api.timing.ServerTimingMiddleware',
+    'api.metrics.MetricsMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
 
     # Third party libraries
     "corsheaders.middleware.CorsMiddleware",
-    'whitenoise.middleware.WhiteNoiseMiddleware', #add whitenoise
+    *([] if API_ASYNC_VIEWS else ['whitenoise.middleware.WhiteNoiseMiddleware']), #add whitenoise
 
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
@@ -99,10 +110,48 @@ WSGI_APPLICATION = 'ecommerce_backend.wsgi.application'
 DATABASES = {
     'default': {
         'ENGINE': 'django.db.backends.sqlite3',
-        'NAME': BASE_DIR / 'db.sqlite3',
+        # Overridable so the benchmarks (benchmarks/run.py) can use a seeded copy
+        'NAME': config('DATABASE_NAME', default=str(BASE_DIR / 'db.sqlite3')),
+    }
+}
+
+# Production profile for SQLite connections (see api/sqlite.py): WAL journal,
+# synchronous=NORMAL, memory-mapped reads, a larger page cache (negative
+# sizes are KiB), temp tables in memory and writers waiting for the lock
+SQLITE_TUNED = config('SQLITE_TUNED', default=False, cast=bool)
+SQLITE_MMAP_SIZE = config('SQLITE_MMAP_SIZE', default=256 * 1024 * 1024, cast=int)
+SQLITE_CACHE_SIZE = config('SQLITE_CACHE_SIZE', default=-64 * 1024, cast=int)
+SQLITE_BUSY_TIMEOUT = config('SQLITE_BUSY_TIMEOUT', default=5000, cast=int)
+# Retries of a write transaction that still found the database locked, the
+# first one after SQLITE_RETRY_BACKOFF seconds, each later one waiting twice as long
+SQLITE_WRITE_RETRIES = config('SQLITE_WRITE_RETRIES', default=5, cast=int)
+SQLITE_RETRY_BACKOFF = config('SQLITE_RETRY_BACKOFF', default=0.05, cast=float)
+
+# Cache
+# https://docs.djangoproject.com/en/4.2/topics/cache/
+# Any shared backend (redis, memcached, database) can be configured here in
+# production; locmem and file based caches work per process / per host.
+
+CACHE_BACKEND = config('CACHE_BACKEND', default='django.core.cache.backends.locmem.LocMemCache')
+
+CACHES = {
+    'default': {
+        'BACKEND': CACHE_BACKEND,
+        'LOCATION': config('CACHE_LOCATION', default='ecommerce-backend'),
     }
 }
 
+# Rendered API responses (api/cache.py). Writes invalidate them by bumping
+# version keys in the cache, which only the processes sharing that cache
+# see: the response cache is off by default with locmem, which is only
+# correct when a single process serves the API (e.g. runserver). Turn it on
+# with a shared backend, or with API_CACHE_ENABLED=True for one process.
+API_CACHE_ENABLED = config(
+    'API_CACHE_ENABLED', default=CACHE_BACKEND != 'django.core.cache.backends.locmem.LocMemCache', cast=bool
+)
+API_CACHE_ALIAS = 'default'
+API_CACHE_TIMEOUT = config('API_CACHE_TIMEOUT', default=60 * 60, cast=int)
+
 # CORS HEADERS
 CORS_ALLOW_ALL_ORIGINS = True
 
@@ -136,12 +185,62 @@ CORS_ALLOW_HEADERS = [
 
 REST_FRAMEWORK = {
     "EXCEPTION_HANDLER": "api.errors.api_exception_handler",
+    # Same as DRF's defaults, timed for the Server-Timing header (api/timing.py)
+    # and with JSON encoded and decoded by orjson when it's installed
+    'DEFAULT_RENDERER_CLASSES': [
+        'api.renderers.JSONRenderer',
+        'api.renderers.BrowsableAPIRenderer',
+    ],
+    'DEFAULT_PARSER_CLASSES': [
+        'api.parsers.JSONParser',
+        'rest_framework.parsers.FormParser',
+        'rest_framework.parsers.MultiPartParser',
+    ],
     'DEFAULT_AUTHENTICATION_CLASSES': [
         'rest_framework.authentication.TokenAuthentication',
         'rest_framework_simplejwt.authentication.JWTAuthentication',
     ],
 }
 
+# Flat shipping fee added to a cart unless every line ships free
+CART_SHIPPING_FEE = config('CART_SHIPPING_FEE', default=0, cast=int)
+
+# Seconds a checkout holds the stock of its cart
+RESERVATION_TTL = config('RESERVATION_TTL', default=15 * 60, cast=int)
+
+# Fraction of requests written to the JSONL trace REQUEST_TRACE_FILE (see
+# api/tracing.py and `manage.py replay_requests`); 0 turns tracing off. The
+# '{pid}' in the file name gives every worker process its own file, which it
+# alone rotates; without it several workers would rotate the same file.
+REQUEST_TRACE_SAMPLE_RATE = config('REQUEST_TRACE_SAMPLE_RATE', default=0.0, cast=float)
+REQUEST_TRACE_FILE = config(
+    'REQUEST_TRACE_FILE', default=str(BASE_DIR / 'traces' / 'requests-{pid}.jsonl')
+)
+REQUEST_TRACE_MAX_BYTES = config('REQUEST_TRACE_MAX_BYTES', default=50 * 1024 * 1024, cast=int)
+REQUEST_TRACE_BACKUPS = config('REQUEST_TRACE_BACKUPS', default=5, cast=int)
+# Keep JSON request bodies (not just their hash) so writes can be replayed
+REQUEST_TRACE_BODIES = config('REQUEST_TRACE_BODIES', default=False, cast=bool)
+
+# Send a Server-Timing header (SQL, serializer and renderer time) with every
+# response and log the timings to `api.timing` (see api/timing.py). A SELECT
+# repeated this many times in one request is flagged as a likely N+1.
+SERVER_TIMING = config('SERVER_TIMING', default=False, cast=bool)
+SERVER_TIMING_REPEATED_QUERIES = config('SERVER_TIMING_REPEATED_QUERIES', default=5, cast=int)
+
+# Prometheus metrics at /metrics (see api/metrics.py). Every process writes
+# its numbers to METRICS_DIR every METRICS_FLUSH_INTERVAL seconds
+# and /metrics adds them up, so all workers of a host must share the
+# directory (default: <tmp>/ecommerce-backend-metrics). The gunicorn master
+# empties it as it starts (gunicorn.conf.py); with other servers, empty it
+# before starting them, or the last run's totals carry over. /metrics has no
+# access control of its own: restrict it to the scraper at the proxy.
+METRICS = config('METRICS', default=False, cast=bool)
+METRICS_DIR = config('METRICS_DIR', default='')
+METRICS_FLUSH_INTERVAL = config('METRICS_FLUSH_INTERVAL', default=1.0, cast=float)
+
+# Processes resizing uploaded images into WebP/JPEG variants (0 = inline)
+IMAGE_VARIANT_WORKERS = config('IMAGE_VARIANT_WORKERS', default=2, cast=int)
+
 
 # Password validation
 # https://docs.djangoproject.com/en/4.2/ref/settings/#auth-password-validators
@@ -190,6 +289,18 @@ MEDIA_ROOT = os.path.join(BASE_DIR, 'media')
 
 MEDIA_URL = 'media/'  # or any prefix you choose
 
+# How MEDIA_URL is served: 'django' (FileResponse with Range support),
+# 'x-sendfile' (Apache/lighttpd), 'x-accel-redirect' (nginx) or 'none' when
+# the front proxy serves MEDIA_ROOT itself. With 'django' only whole files
+# can go out with sendfile(): Range requests (video seeking, resumed
+# downloads) are read and streamed through Python, so large media belongs
+# behind one of the proxy options, which also answer the ranges.
+MEDIA_SERVER = config('MEDIA_SERVER', default='django')
+# nginx `internal` location aliased to MEDIA_ROOT
+MEDIA_ACCEL_REDIRECT_PREFIX = config('MEDIA_ACCEL_REDIRECT_PREFIX', default='/protected-media/')
+# Cache lifetime of media files without a content-hashed name
+MEDIA_MAX_AGE = config('MEDIA_MAX_AGE', default=60 * 60 * 24, cast=int)
+
 
 
 
@@ -15,10 +15,14 @@ Including another URLconf
     2. Add a URL to urlpatterns:  path('blog/', include('blog.urls'))
 """
 from django.contrib import admin
-from django.urls import path, include
-from django.conf.urls.static import static
+import re
+
+from django.urls import path, re_path, include
 from django.conf import settings
 
+from api.media import serve_media
+from api.metrics import metrics_view
+
 admin.site.site_header  =  "Ecommerce"  
 admin.site.site_title  =  "Ecommerce Nigeria"
 admin.site.index_title  =  "DASHBOARD"
@@ -26,8 +30,12 @@ admin.site.index_title  =  "DASHBOARD"
 urlpatterns = [
     path('admin/', admin.site.urls),
     path('api/', include('api.urls')),
+    path('metrics', metrics_view, name='metrics'),
 ]
-urlpatterns += static(settings.MEDIA_URL, document_root=settings.MEDIA_ROOT)
+if settings.MEDIA_SERVER != 'none':
+    urlpatterns += [
+        re_path(r'^%s(?P<path>.*)$' % re.escape(settings.MEDIA_URL.lstrip('/')), serve_media),
+    ]
 
 
 
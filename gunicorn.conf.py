@@ -0,0 +1,17 @@
+"""
+gunicorn settings, read from the directory it is started in:
+
+    gunicorn ecommerce_backend.wsgi --workers 4
+"""
+import os
+
+
+def on_starting(server):
+    # Runs once in the master, before any worker: the metrics the workers of
+    # the last run left in METRICS_DIR must not add up with this run's
+    os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'ecommerce_backend.settings')
+    from django.conf import settings
+    from api.metrics import clear_metrics_dir
+
+    if settings.METRICS:
+        clear_metrics_dir()